@@ -0,0 +1,279 @@
+# backend/ams_ingest.py
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List
+
+from models import db, get_inventory_version
+from helper import ams_units_to_payloads, bulk_upsert_filaments
+from consumption import compact_consumption, COMPACT_INTERVAL
+from metrics import INGEST_LATENCY
+
+# Profondeur de la file et politique quand elle est pleine:
+#  - "merge"       : fusionne le rapport dans le dernier rapport en attente (aucune perte d'état)
+#  - "drop_oldest" : jette le plus ancien rapport en attente
+#  - "drop_newest" : refuse le nouveau rapport
+INGEST_QUEUE_SIZE = int(os.getenv("AMS_INGEST_QUEUE_SIZE", "64"))
+INGEST_POLICY = os.getenv("AMS_INGEST_POLICY", "merge")
+# Délai minimal (s) entre deux écritures: les rapports reçus entre-temps sont fusionnés
+FLUSH_INTERVAL = float(os.getenv("AMS_FLUSH_INTERVAL", "2.0"))
+
+_POLICIES = ("merge", "drop_oldest", "drop_newest")
+# Trays mémorisés par le coalesceur: au-delà, la mémoire repart de zéro
+_LAST_MAX = 4096
+
+
+def _merge_ams_units(dst: List[dict], src: List[dict]) -> None:
+    """Fusionne les trays de src dans dst, par (id AMS, id tray). Les champs récents écrasent les anciens."""
+    by_id = {sensor.get("id"): sensor for sensor in dst}
+    for sensor in src:
+        target = by_id.get(sensor.get("id"))
+        if target is None:
+            dst.append(sensor)
+            by_id[sensor.get("id")] = sensor
+            continue
+        trays = {t.get("id"): t for t in target.setdefault("tray", [])}
+        for tray in sensor.get("tray", []):
+            if tray.get("id") in trays:
+                trays[tray.get("id")].update(tray)
+            else:
+                target["tray"].append(tray)
+
+
+def _merge_item(dst: dict, src: dict) -> None:
+    """Fusionne un rapport en attente dans un autre, imprimante par imprimante (les id AMS/tray sont locaux)."""
+    for serial, ams in src["printers"].items():
+        if serial in dst["printers"]:
+            _merge_ams_units(dst["printers"][serial], ams)
+        else:
+            dst["printers"][serial] = ams
+    dst["reports"] += src["reports"]
+
+
+# Champs qui changent à chaque rapport sans refléter un changement de la bobine
+_VOLATILE_FIELDS = {"last_sync_at", "last_sync_source"}
+
+
+class AmsCoalescer:
+    """
+    Garde le dernier état écrit par tray (tag_uid, sinon tray_uuid) et ne laisse
+    passer que les trays dont un champ significatif (remain, couleur, poids...) a changé.
+    Cet état n'est valable qu'à la version d'inventaire où il a été écrit: toute autre écriture
+    (PUT, DELETE, import, restore, autre worker) change la version et vide la mémoire (voir sync).
+    """
+
+    def __init__(self):
+        self._last: Dict[str, tuple] = {}
+        self._version: Optional[int] = None
+        self.reports_in = 0
+        self.reports_suppressed = 0
+        self.trays_in = 0
+        self.trays_suppressed = 0
+        self.trays_written = 0
+
+    @staticmethod
+    def _key(payload: dict) -> Optional[str]:
+        return payload.get("uid") or payload.get("tray_uid")
+
+    @staticmethod
+    def _state(payload: dict) -> tuple:
+        return tuple(sorted((k, v) for k, v in payload.items() if k not in _VOLATILE_FIELDS))
+
+    def sync(self, version: int) -> None:
+        """Vide la mémoire si l'inventaire a été modifié depuis la dernière écriture du coalesceur."""
+        if version != self._version:
+            self._last.clear()
+            self._version = version
+
+    def diff(self, payloads: List[dict], reports: int = 1) -> List[dict]:
+        """Retourne les payloads à écrire. L'état n'est mémorisé qu'après commit (voir mark_written)."""
+        self.reports_in += reports
+        self.trays_in += len(payloads)
+        changed = [p for p in payloads if self._last.get(self._key(p)) != self._state(p)]
+        self.trays_suppressed += len(payloads) - len(changed)
+        # Tous les rapports du lot sont évités sauf celui qui déclenche l'écriture
+        self.reports_suppressed += reports - (1 if changed else 0)
+        return changed
+
+    def mark_written(self, payloads: List[dict], version: Optional[int] = None) -> None:
+        """version: version d'inventaire attribuée à l'écriture (None si aucune ligne n'a changé)."""
+        self.trays_written += len(payloads)
+        if version is not None:
+            if self._version is None or version != self._version + 1:
+                # Une autre écriture s'est intercalée depuis sync(): son effet nous est inconnu
+                self._last.clear()
+            self._version = version
+        if len(self._last) + len(payloads) > _LAST_MAX:
+            self._last.clear()
+        for p in payloads:
+            self._last[self._key(p)] = self._state(p)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "reports_in": self.reports_in,
+            "reports_suppressed": self.reports_suppressed,
+            "trays_in": self.trays_in,
+            "trays_suppressed": self.trays_suppressed,
+            "trays_written": self.trays_written,
+            "tracked_trays": len(self._last),
+        }
+
+
+class AmsIngestWorker:
+    """
+    File bornée alimentée par le callback MQTT et vidée par un thread dédié,
+    qui applique les rapports AMS directement en base (sans repasser par HTTP).
+    """
+
+    def __init__(self, app, maxsize: Optional[int] = None, policy: Optional[str] = None,
+                 flush_interval: Optional[float] = None):
+        self.app = app
+        self.flush_interval = FLUSH_INTERVAL if flush_interval is None else max(0.0, flush_interval)
+        self.coalescer = AmsCoalescer()
+        self._last_flush = 0.0
+        self._last_compact = 0.0
+        self.maxsize = max(1, maxsize or INGEST_QUEUE_SIZE)
+        self.policy = policy or INGEST_POLICY
+        if self.policy not in _POLICIES:
+            print(f"[INGEST] Politique inconnue '{self.policy}', fallback sur 'merge'")
+            self.policy = "merge"
+
+        self._pending: deque = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+        self.queued = 0
+        self.merged = 0
+        self.dropped = 0
+        self.processed = 0
+        self.errors = 0
+        self.trays_synced = 0
+        self.consumption_events = 0
+        self.last_error: Optional[str] = None
+
+    # ---------- Producteur (thread réseau paho) ----------
+    def submit(self, ams_units: List[dict], serial: Optional[str] = None) -> bool:
+        """Non bloquant. Retourne False si le rapport a été jeté. serial: imprimante d'origine."""
+        serial = serial or ""
+        item = {"printers": {serial: ams_units}, "reports": 1, "received_at": time.time()}
+        with self._cond:
+            if len(self._pending) >= self.maxsize:
+                if self.policy == "drop_newest":
+                    self.dropped += 1
+                    return False
+                if self.policy == "drop_oldest":
+                    self._pending.popleft()
+                    self.dropped += 1
+                else:
+                    _merge_item(self._pending[-1], item)
+                    self.merged += 1
+                    return True
+            self._pending.append(item)
+            self.queued += 1
+            self._cond.notify()
+        return True
+
+    # ---------- Consommateur ----------
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="ams-ingest", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _next(self) -> Optional[dict]:
+        """Attend un rapport puis fusionne tout ce qui arrive jusqu'à l'échéance de flush."""
+        with self._cond:
+            while not self._pending and not self._stopping:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            batch = self._pending.popleft()
+            deadline = self._last_flush + self.flush_interval
+            while True:
+                while self._pending:
+                    _merge_item(batch, self._pending.popleft())
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopping:
+                    return batch
+                self._cond.wait(remaining)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next()
+            if batch is None:
+                return
+            self._apply(batch)
+            self._last_flush = time.monotonic()
+            if self._last_flush - self._last_compact >= COMPACT_INTERVAL:
+                self._compact()
+                self._last_compact = self._last_flush
+
+    def _apply(self, batch: dict) -> None:
+        payloads = [
+            p for serial, ams in batch["printers"].items()
+            for p in ams_units_to_payloads(ams, serial or None)
+        ]
+        with self.app.app_context():
+            try:
+                self.coalescer.sync(get_inventory_version(db.session))
+                payloads = self.coalescer.diff(payloads, batch["reports"])
+                if not payloads:
+                    self.processed += batch["reports"]
+                    return
+                res = bulk_upsert_filaments(db.session, payloads)
+                INGEST_LATENCY.observe(time.time() - batch["received_at"])
+                self.consumption_events += res["consumption_events"]
+                self.coalescer.mark_written(payloads, res.get("version"))
+                self.trays_synced += len(payloads)
+                self.processed += batch["reports"]
+            except Exception as e:
+                db.session.rollback()
+                self.errors += 1
+                self.last_error = str(e)
+                print(f"[INGEST] Erreur de synchro AMS: {e}")
+            finally:
+                db.session.remove()
+
+    def _compact(self) -> None:
+        """Purge périodique de l'historique de consommation (événements bruts / buckets horaires)."""
+        with self.app.app_context():
+            try:
+                res = compact_consumption(db.session)
+                if any(res.values()):
+                    print(f"[INGEST] Compaction consommation: {res}")
+            except Exception as e:
+                db.session.rollback()
+                print(f"[INGEST] Erreur de compaction: {e}")
+            finally:
+                db.session.remove()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            depth = len(self._pending)
+        return {
+            "policy": self.policy,
+            "flush_interval": self.flush_interval,
+            "max_queue": self.maxsize,
+            "queue_depth": depth,
+            "queued": self.queued,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "errors": self.errors,
+            "trays_synced": self.trays_synced,
+            "consumption_events": self.consumption_events,
+            "last_error": self.last_error,
+            "coalescing": self.coalescer.stats(),
+        }
@@ -0,0 +1,268 @@
+# backend/asgi.py — mode ASGI: gunicorn -k uvicorn_worker.UvicornWorker asgi:app (ou uvicorn asgi:app)
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qs, urlencode
+
+from app import app as flask_app
+from jobs import JobStore, JOB_WAIT_MAX, WAIT_POLL_INTERVAL
+from metrics import HTTP_LATENCY
+from threemf_jobs import QueueFullError, UploadTooLargeError, RETRY_AFTER
+
+# Threads par worker pour les vues Flask (et donc la base). Les connexions longues n'en occupent
+# pas: SSE et ?wait= sont servis par la boucle asyncio, les uploads sont reçus avant l'appel de la vue.
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", "8"))
+
+executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="asgi")
+
+_JOB_PATH = re.compile(r"^/api/(?:3mf/)?jobs/([0-9a-f]{32})$")
+_THREEMF_UPLOADS = {"/api/3mf/analyze", "/api/3mf/jobs"}
+_SSE_HEADERS = [
+    (b"content-type", b"text/event-stream; charset=utf-8"),
+    (b"cache-control", b"no-cache"),
+    (b"x-accel-buffering", b"no"),
+    (b"access-control-allow-origin", b"*"),
+]
+# Corps gardé en mémoire jusqu'à cette taille, sur disque au-delà
+_SPOOL_MEMORY = 64 * 1024
+
+
+async def run_sync(fn, *args):
+    """Exécute fn(*args) dans le pool borné du worker."""
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+class _FlaskRequest:
+    """
+    Requête HTTP servie par l'app Flask (WSGI): le corps est reçu sur la boucle, borné par
+    MAX_CONTENT_LENGTH (Content-Length annoncé ou octets reçus), puis la vue tourne dans le pool borné.
+    """
+
+    def __init__(self, wsgi_app, scope, send):
+        self.wsgi_app = wsgi_app
+        self.scope = scope
+        self.send = send
+        self.loop = asyncio.get_running_loop()
+        self.status = None
+        self.headers = None
+
+    async def __call__(self, receive, max_body: int, content_length) -> None:
+        if content_length is not None and content_length > max_body:
+            await _send_json(self.send, 413, {"error": "Request body too large"})
+            return
+        with SpooledTemporaryFile(max_size=_SPOOL_MEMORY) as body:
+            size = 0
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size > max_body:
+                    # Uploads sans Content-Length (chunked): arrêt dès la limite
+                    await _send_json(self.send, 413, {"error": "Request body too large"})
+                    return
+                body.write(chunk)
+                if not message.get("more_body"):
+                    break
+            body.seek(0)
+            await run_sync(self._run, self._environ(body, size))
+
+    def _environ(self, body, size: int) -> dict:
+        scope = self.scope
+        script_name = scope.get("root_path", "").encode("utf8").decode("latin1")
+        path_info = scope["path"].encode("utf8").decode("latin1")
+        if path_info.startswith(script_name):
+            path_info = path_info[len(script_name):]
+        server = scope.get("server") or ("localhost", 80)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": script_name,
+            "PATH_INFO": path_info,
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        if scope.get("client"):
+            environ["REMOTE_ADDR"] = scope["client"][0]
+        for name, value in scope.get("headers") or []:
+            name = name.decode("latin1")
+            if name in ("content-length", "content-type"):
+                key = name.upper().replace("-", "_")
+            else:
+                key = "HTTP_" + name.upper().replace("-", "_")
+            value = value.decode("latin1")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        # Corps entièrement reçu: taille réelle, y compris pour un upload chunked
+        environ["CONTENT_LENGTH"] = str(size)
+        return environ
+
+    def _start_response(self, status, headers, exc_info=None):
+        # Rien n'est envoyé avant le premier morceau du corps: un nouvel appel (page d'erreur) remplace l'en-tête
+        self.status = int(status.split(" ", 1)[0])
+        self.headers = [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers]
+
+    def _send(self, *messages) -> None:
+        # Un seul aller-retour vers la boucle pour l'en-tête et le corps d'une réponse non streamée
+        async def send_all():
+            for message in messages:
+                await self.send(message)
+        asyncio.run_coroutine_threadsafe(send_all(), self.loop).result()
+
+    def _response_start(self) -> dict:
+        return {"type": "http.response.start", "status": self.status, "headers": self.headers}
+
+    def _run(self, environ) -> None:
+        result = self.wsgi_app(environ, self._start_response)
+        started = False
+        previous = None  # un morceau de retard: le dernier part avec more_body=False
+        try:
+            for chunk in result:
+                if not chunk:
+                    continue
+                if previous is not None:
+                    messages = [{"type": "http.response.body", "body": previous, "more_body": True}]
+                    if not started:
+                        started = True
+                        messages.insert(0, self._response_start())
+                    self._send(*messages)
+                previous = chunk
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        messages = [{"type": "http.response.body", "body": previous or b""}]
+        if not started:
+            messages.insert(0, self._response_start())
+        self._send(*messages)
+
+
+async def _send_json(send, status: int, payload, headers=()) -> None:
+    body = json.dumps(payload).encode()
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        (b"access-control-allow-origin", b"*"),
+        *headers,
+    ]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _until_disconnect(receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _pump(send, chunks) -> None:
+    try:
+        async for chunk in chunks:
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+    finally:
+        await chunks.aclose()
+
+
+async def _events(flask_app, receive, send, query: dict, headers: dict) -> int:
+    """GET /api/events (voir routes.api_events): un client SSE ne coûte qu'une tâche asyncio."""
+    raw = headers.get(b"last-event-id", b"").decode("latin1") or query.get("last_event_id", [""])[0]
+    try:
+        last_event_id = int(raw) if raw else None
+    except ValueError:
+        await _send_json(send, 400, {"error": "Invalid Last-Event-ID"})
+        return 400
+    await send({"type": "http.response.start", "status": 200, "headers": _SSE_HEADERS})
+    # Le serveur ignore les envois vers un client parti: la déconnexion arrête le flux
+    stream = asyncio.ensure_future(_pump(send, flask_app.event_hub.astream(last_event_id, run_sync)))
+    watch = asyncio.ensure_future(_until_disconnect(receive))
+    try:
+        await asyncio.wait({stream, watch}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (stream, watch):
+            task.cancel()
+        await asyncio.gather(stream, watch, return_exceptions=True)
+    return 200
+
+
+async def _wait_job(flask_app, job_id: str, wait: float) -> None:
+    """Attente de ?wait=<s> sans bloquer de thread (relecture du fichier du job)."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(wait, JOB_WAIT_MAX)
+    while JobStore.is_pending(flask_app.jobs.get(job_id)) and loop.time() < deadline:
+        await asyncio.sleep(WAIT_POLL_INTERVAL)
+
+
+class AsgiApp:
+    """Routes longues servies en natif asynchrone, tout le reste délégué à l'app Flask."""
+
+    def __init__(self, flask_app):
+        self.flask = flask_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        path, method = scope["path"], scope["method"]
+        query = parse_qs(scope.get("query_string", b"").decode("latin1"))
+        headers = dict(scope.get("headers") or [])
+        t0 = time.perf_counter()
+
+        if method == "GET" and path == "/api/events":
+            status = await _events(self.flask, receive, send, query, headers)
+            HTTP_LATENCY.labels(method, "/api/events", str(status)).observe(time.perf_counter() - t0)
+            return
+        match = _JOB_PATH.match(path) if method == "GET" else None
+        if match:
+            try:
+                wait = float(query.get("wait", ["0"])[0])
+            except ValueError:
+                wait = 0.0  # Flask répond 400
+            if wait > 0:
+                # Attente ici, puis réponse par la vue Flask (état du job, bobines compatibles...)
+                await _wait_job(self.flask, match.group(1), wait)
+                query.pop("wait")
+                scope = {**scope, "query_string": urlencode(query, doseq=True).encode()}
+        try:
+            content_length = int(headers[b"content-length"]) if b"content-length" in headers else None
+        except ValueError:
+            await _send_json(send, 400, {"error": "Invalid Content-Length"})
+            return
+        if method == "POST" and path in _THREEMF_UPLOADS:
+            # Mêmes refus que la vue (taille annoncée, file pleine), mais avant de recevoir le corps
+            queue = self.flask.threemf_queue
+            try:
+                queue.check_size(content_length)
+                queue.check_capacity()
+            except UploadTooLargeError as e:
+                await _send_json(send, 413, {"error": str(e)})
+                return
+            except QueueFullError as e:
+                await _send_json(send, 429, {"error": str(e)}, [(b"retry-after", str(RETRY_AFTER).encode())])
+                return
+        request = _FlaskRequest(self.flask, scope, send)
+        await request(receive, self.flask.config.get("MAX_CONTENT_LENGTH") or sys.maxsize, content_length)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                executor.shutdown(wait=False, cancel_futures=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+app = AsgiApp(flask_app)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark de l'analyse 3MF sur une archive synthétique (gros maillage + metadata Bambu).
+
+    python benchmarks/bench_3mf.py [--mesh-mb 200] [--objects 500]
+
+Compare l'ancienne méthode (extractall sur disque + lecture complète des XML)
+à l'analyse en streaming (threemf.analyze_3mf_stream): durée, pic mémoire Python
+(tracemalloc) et octets écrits sur disque.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from threemf import analyze_3mf_stream
+
+
+def make_3mf(path: str, mesh_mb: int, objects: int) -> None:
+    """Archive type Bambu Studio: 3D/3dmodel.model volumineux + Metadata/*.config."""
+    settings = {
+        "filament_colour": ["#000000", "#FFFFFF", "#E02928", "#2140B4"],
+        "filament_settings_id": ["Bambu PLA Basic @BBL X1C", "Bambu PLA Matte @BBL X1C",
+                                 "Bambu PETG HF @BBL X1C", "Generic ASA @BBL X1C"],
+    }
+    model_settings = "<?xml version=\"1.0\"?>\n<config>\n<objects>\n" + "".join(
+        f'  <object id="{i}"><metadata key="name" value="part_{i}"/></object>\n' for i in range(objects)
+    ) + "</objects>\n</config>\n"
+
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as z:
+        with z.open("3D/3dmodel.model", "w", force_zip64=True) as f:
+            f.write(b'<?xml version="1.0"?>\n<model><resources><object id="1"><mesh><vertices>\n')
+            i = 0
+            chunk = []
+            written = 0
+            while written < mesh_mb * 1024 * 1024:
+                line = f'<vertex x="{i * 0.013:.4f}" y="{i * 0.029:.4f}" z="{i * 0.007:.4f}"/>\n'.encode()
+                chunk.append(line)
+                i += 1
+                if len(chunk) == 10000:
+                    data = b"".join(chunk)
+                    f.write(data)
+                    written += len(data)
+                    chunk = []
+            f.write(b"".join(chunk) + b"</vertices></mesh></object></resources></model>\n")
+        z.writestr("Metadata/project_settings.config", json.dumps(settings))
+        z.writestr("Metadata/model_settings.config", model_settings)
+        z.writestr("Metadata/slice_info.xml", model_settings)
+
+
+def legacy_analyze(path: str) -> dict:
+    """Reproduction de l'ancienne implémentation de /api/3mf/analyze."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with zipfile.ZipFile(path, "r") as archive:
+            archive.extractall(tmpdir)
+        written = sum(os.path.getsize(os.path.join(dp, f)) for dp, _, fs in os.walk(tmpdir) for f in fs)
+        meta = os.path.join(tmpdir, "Metadata")
+        with open(os.path.join(meta, "project_settings.config"), "r", encoding="utf-8") as f:
+            settings = json.load(f)
+        pieces_count = 0
+        for fname in os.listdir(meta):
+            if fname.lower().endswith((".xml", ".html")):
+                p = os.path.join(meta, fname)
+                with open(p, "r", encoding="utf-8") as f:
+                    content = f.read().lstrip()
+                if "<objects" in content:
+                    pieces_count = len(ET.parse(p).getroot().findall(".//object"))
+                    break
+    return {"pieces_count": pieces_count, "colors": settings.get("filament_colour", []),
+            "disk_bytes_written": written}
+
+
+def streaming_analyze(path: str) -> dict:
+    with open(path, "rb") as f:
+        res = analyze_3mf_stream(f)
+    res["disk_bytes_written"] = 0
+    return res
+
+
+def measure(fn, path: str) -> dict:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    res = fn(path)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": round(elapsed, 3),
+        "peak_python_mem_mb": round(peak / 1024 / 1024, 2),
+        "disk_mb_written": round(res["disk_bytes_written"] / 1024 / 1024, 1),
+        "pieces_count": res["pieces_count"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mesh-mb", type=int, default=200, help="taille décompressée du maillage")
+    parser.add_argument("--objects", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "big.3mf")
+        t0 = time.perf_counter()
+        make_3mf(path, args.mesh_mb, args.objects)
+        print(json.dumps({
+            "archive_mb": round(os.path.getsize(path) / 1024 / 1024, 1),
+            "mesh_mb": args.mesh_mb,
+            "generation_s": round(time.perf_counter() - t0, 1),
+            "legacy_extractall": measure(legacy_analyze, path),
+            "streaming": measure(streaming_analyze, path),
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
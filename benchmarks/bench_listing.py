@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark du listing des filaments et du lookup tray_uid, avec et sans index.
+
+    python benchmarks/bench_listing.py [--rows 10000 100000] [--repeat 5]
+
+Base SQLite temporaire, aucune dépendance au reste du déploiement (MQTT, config).
+Affiche pour chaque taille le plan de requête (EXPLAIN QUERY PLAN) et les temps médians en JSON.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from flask import Flask
+from sqlalchemy import select, insert, text
+
+from models import db, Filament, listing_order
+
+_TYPES = ["PLA", "PETG", "ABS", "ASA", "TPU", "PA", None]
+_SUBTYPES = ["Basic", "Matte", "Silk", "CF", "HF", None]
+_COLORS = ["#000000", "#FFFFFF", "#FF0000", "#00A6A0", "#2140B4", "#8A949E", None]
+
+
+def _make_app(db_path: str) -> Flask:
+    app = Flask("bench")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+    db.init_app(app)
+    return app
+
+
+def _fill(n: int) -> None:
+    rnd = random.Random(42)
+    rows = []
+    for i in range(n):
+        t = rnd.choice(_TYPES)
+        sub = rnd.choice(_SUBTYPES)
+        weight = rnd.choice([250, 500, 750, 1000])
+        rows.append({
+            "uid": f"UID{i:08d}",
+            "tray_uid": f"TRAY{i:08d}",
+            "filament_type": t,
+            "filament_detailed_type": f"{t} {sub}" if t and sub else None,
+            "color_code": rnd.choice(_COLORS),
+            "color_name": rnd.choice(["Black", "White", "Red", None]),
+            "spool_weight": weight,
+            "remaining_grams": rnd.randint(0, weight) if rnd.random() > 0.2 else None,
+        })
+    db.session.execute(insert(Filament.__table__), rows)
+    db.session.commit()
+    db.session.execute(text("ANALYZE"))
+
+
+def _median_ms(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return round(statistics.median(samples), 2)
+
+
+def _plan(stmt) -> list:
+    sql = str(stmt.compile(db.engine, compile_kwargs={"literal_binds": True}))
+    return [row[-1] for row in db.session.execute(text("EXPLAIN QUERY PLAN " + sql))]
+
+
+def _measure(n: int, repeat: int) -> dict:
+    table = Filament.__table__
+    listing = select(table).order_by(*listing_order())
+    lookup = select(table.c.id).where(table.c.tray_uid == f"TRAY{n // 2:08d}")
+
+    def run_listing():
+        db.session.execute(listing).all()
+
+    def run_lookups():
+        for i in range(0, n, max(1, n // 200)):
+            db.session.execute(select(table.c.id).where(table.c.tray_uid == f"TRAY{i:08d}")).first()
+
+    return {
+        "listing_plan": _plan(listing),
+        "listing_ms": _median_ms(run_listing, repeat),
+        "tray_uid_plan": _plan(lookup),
+        "tray_uid_200_lookups_ms": _median_ms(run_lookups, repeat),
+    }
+
+
+def bench(n: int, repeat: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _make_app(os.path.join(tmp, "bench.db"))
+        with app.app_context():
+            db.create_all()
+            _fill(n)
+            indexed = _measure(n, repeat)
+            db.session.execute(text("DROP INDEX ix_filaments_listing"))
+            db.session.execute(text("DROP INDEX ix_filaments_tray_uid"))
+            db.session.commit()
+            # Nouvelle connexion: évite les plans préparés mis en cache avant le DROP
+            db.session.remove()
+            db.engine.dispose()
+            no_index = _measure(n, repeat)
+            db.session.remove()
+            db.engine.dispose()
+    return {"rows": n, "indexed": indexed, "no_index": no_index}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for n in args.rows:
+        print(json.dumps(bench(n, args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,690 @@
+#!/usr/bin/env python3
+"""
+Suite de benchmarks des chemins critiques du backend, résultats en JSON comparables entre commits.
+
+    python benchmarks/run.py [--quick] [--only ams_sync listing import threemf color startup concurrency] [--output out.json]
+    python benchmarks/run.py --compare avant.json apres.json
+
+Hors-ligne: base SQLite temporaire, routes appelées via le client de test Flask, rapports MQTT
+injectés directement dans PrinterSession._on_message (fixtures/bambu_push_status.json: rapport
+push_status X1C, 4 AMS x 4 trays), sans broker ni imprimante.
+Scénarios:
+  ams_sync  rapports/s à 1, 4, 8 et 16 trays, via POST /api/ams/sync et via MQTT → file d'ingestion → commit
+  listing   GET /api/filaments à 1k / 10k / 100k bobines: à froid, cache chaud, page keyset, 304
+  import    POST /api/filaments/import (NDJSON de dumps de tags): nouvelles lignes puis doublons
+  threemf   POST /api/3mf/analyze sur une petite et une très grosse archive, cache miss puis hit;
+            file d'analyse saturée: 202/429 et latence de la synchro AMS pendant les analyses
+  color     resolve_color_name: mémo, correspondance exacte, plus proche (Lab), inconnue
+  startup   process neufs: import de l'app (1er démarrage, redémarrage), /health prêt sous gunicorn -w 2
+  concurrency  GET concurrents pendant des connexions longues (SSE, uploads lents): gthread vs ASGI (asgi.py)
+"""
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import urllib.request
+from datetime import datetime
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(_HERE, "..")))
+
+from flask import Flask
+from sqlalchemy import insert, text
+
+from database import engine_options
+from models import db, Filament, COLOR_PALETTE, ensure_inventory_state, resolve_color_name
+from palette import Palette
+from routes import api, _listing_cache
+from threemf import AnalysisCache
+from threemf_jobs import ThreeMFQueue
+from jobs import JobStore
+from inventory_index import InventoryIndex
+from ams_ingest import AmsIngestWorker
+from mqtt_listener import PrinterSession
+from bench_3mf import make_3mf
+
+_FIXTURE = os.path.join(_HERE, "fixtures", "bambu_push_status.json")
+_TRAY_COUNTS = (1, 4, 8, 16)
+
+_TYPES = ["PLA", "PETG", "ABS", "ASA", "TPU", "PA", None]
+_SUBTYPES = ["Basic", "Matte", "Silk", "CF", "HF", None]
+_COLORS = ["#000000", "#FFFFFF", "#FF0000", "#00A6A0", "#2140B4", "#8A949E", None]
+
+
+def _log(msg: str) -> None:
+    print(f"[BENCH] {msg}", file=sys.stderr, flush=True)
+
+
+def _make_app(tmp: str) -> Flask:
+    url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    app = Flask("bench")
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(url)
+    db.init_app(app)
+    app.register_blueprint(api)
+    app.threemf_cache = AnalysisCache(os.path.join(tmp, "3mf_cache"))
+    app.jobs = JobStore(os.path.join(tmp, "jobs"))
+    app.threemf_queue = ThreeMFQueue(app.jobs, app.threemf_cache, os.path.join(tmp, "3mf_spool"))
+    app.inventory_index = InventoryIndex()
+    with app.app_context():
+        db.create_all()
+        ensure_inventory_state(db.session)
+    _listing_cache.update(version=None, bodies={})
+    return app
+
+
+def _dispose(app: Flask) -> None:
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+def _summary(samples_ms: list) -> dict:
+    samples = sorted(samples_ms)
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "min_ms": round(samples[0], 3),
+    }
+
+
+def _timings(fn, repeat: int, setup=None) -> dict:
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return _summary(samples)
+
+
+def _rate(count: int, seconds: float) -> float:
+    return round(count / seconds, 1) if seconds > 0 else None
+
+
+# ------------------- ams_sync -------------------
+
+def _reports(n_trays: int, count: int) -> list:
+    """`count` rapports à n_trays trays, remain modifié à chaque rapport (chaque tray est réécrit)."""
+    with open(_FIXTURE, encoding="utf-8") as f:
+        base = json.load(f)
+    units = base["print"]["ams"]["ams"]
+    per_unit = len(units[0]["tray"])
+    base["print"]["ams"]["ams"] = [
+        {**u, "tray": u["tray"][:max(0, n_trays - i * per_unit)]} for i, u in enumerate(units)
+        if n_trays > i * per_unit
+    ]
+    out = []
+    for k in range(count):
+        report = copy.deepcopy(base)
+        for unit in report["print"]["ams"]["ams"]:
+            for tray in unit["tray"]:
+                tray["remain"] = 100 - (k % 95)
+        out.append(report)
+    return out
+
+
+def bench_ams_sync(count: int) -> dict:
+    results = {}
+    for n in _TRAY_COUNTS:
+        reports = _reports(n, count + 1)
+        with tempfile.TemporaryDirectory() as tmp:
+            app = _make_app(tmp)
+            client = app.test_client()
+
+            # 1) HTTP: un rapport par requête, écrit dans la requête
+            client.post("/api/ams/sync", json=reports[0])
+            samples = []
+            t0 = time.perf_counter()
+            for r in reports[1:]:
+                t1 = time.perf_counter()
+                client.post("/api/ams/sync", json=r)
+                samples.append((time.perf_counter() - t1) * 1000)
+            http_s = time.perf_counter() - t0
+
+            # 2) MQTT: callback paho → file d'ingestion → thread d'écriture
+            ingest = AmsIngestWorker(app, flush_interval=0)
+            ingest.start()
+            session = PrinterSession({"serial": "BENCH01", "ip": "127.0.0.1", "password": ""}, ingest=ingest)
+            messages = [types.SimpleNamespace(payload=json.dumps(r).encode()) for r in reports[1:]]
+
+            def wait_for(done: int) -> None:
+                while ingest.processed + ingest.dropped + ingest.errors < done:
+                    time.sleep(0.0002)
+
+            # Un rapport à la fois: latence callback → commit de chaque rapport
+            paced = []
+            for i, m in enumerate(messages):
+                t1 = time.perf_counter()
+                session._on_message(None, None, m)
+                wait_for(i + 1)
+                paced.append((time.perf_counter() - t1) * 1000)
+
+            # Rafale: les rapports en attente sont fusionnés avant écriture
+            # (ordre inverse: l'état final diffère du dernier écrit, sinon le coalesceur n'écrit rien)
+            written = ingest.trays_synced
+            t0 = time.perf_counter()
+            for m in reversed(messages):
+                session._on_message(None, None, m)
+            wait_for(2 * len(messages))
+            burst_s = time.perf_counter() - t0
+            ingest.stop()
+            _dispose(app)
+
+        results[f"{n}_trays"] = {
+            "message_bytes": len(messages[0].payload),
+            "http_reports_per_s": _rate(count, http_s),
+            "http": _summary(samples),
+            "mqtt_paced_reports_per_s": _rate(count, sum(paced) / 1000),
+            "mqtt_paced": _summary(paced),
+            "mqtt_burst_reports_per_s": _rate(count, burst_s),
+            "mqtt_burst_trays_written": ingest.trays_synced - written,
+            "mqtt_errors": ingest.errors,
+        }
+        _log(f"ams_sync {n} trays: {results[f'{n}_trays']}")
+    return results
+
+
+# ------------------- listing -------------------
+
+def _fill(n: int) -> None:
+    rnd = random.Random(42)
+    rows = []
+    for i in range(n):
+        t = rnd.choice(_TYPES)
+        sub = rnd.choice(_SUBTYPES)
+        weight = rnd.choice([250, 500, 750, 1000])
+        rows.append({
+            "uid": f"UID{i:08d}",
+            "tray_uid": f"TRAY{i:08d}",
+            "filament_type": t,
+            "filament_detailed_type": f"{t} {sub}" if t and sub else None,
+            "color_code": rnd.choice(_COLORS),
+            "color_name": rnd.choice(["Black", "White", "Red", None]),
+            "spool_weight": weight,
+            "remaining_grams": rnd.randint(0, weight) if rnd.random() > 0.2 else None,
+        })
+    for i in range(0, n, 10_000):
+        db.session.execute(insert(Filament.__table__), rows[i:i + 10_000])
+    db.session.commit()
+    db.session.execute(text("ANALYZE"))
+
+
+def bench_listing(sizes: list, repeat: int) -> dict:
+    def cold():
+        _listing_cache.update(version=None, bodies={})
+
+    results = {}
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            app = _make_app(tmp)
+            with app.app_context():
+                _fill(n)
+                db.session.remove()
+            client = app.test_client()
+            resp = client.get("/api/filaments")
+            etag = resp.headers["ETag"]
+            results[f"{n}_rows"] = {
+                "body_bytes": len(resp.data),
+                "cold": _timings(lambda: client.get("/api/filaments"), repeat, setup=cold),
+                "cached": _timings(lambda: client.get("/api/filaments"), repeat),
+                "page_100_cold": _timings(lambda: client.get("/api/filaments?limit=100"), repeat, setup=cold),
+                "not_modified": _timings(lambda: client.get("/api/filaments", headers={"If-None-Match": etag}),
+                                         repeat),
+            }
+            _dispose(app)
+        _log(f"listing {n} rows: cold p50 {results[f'{n}_rows']['cold']['p50_ms']} ms")
+    return results
+
+
+# ------------------- import -------------------
+
+def _tag_dumps(n: int) -> bytes:
+    rnd = random.Random(1)
+    lines = []
+    for i in range(n):
+        t = rnd.choice(["PLA", "PETG", "ABS", "ASA"])
+        lines.append(json.dumps({
+            "tag_uid": f"IMP{i:012X}",
+            "material_code": "GFA00",
+            "type": t,
+            "subtype": f"{t} {rnd.choice(['Basic', 'Matte', 'HF'])}",
+            "color_hex": rnd.choice(["#000000", "#FFFFFF", "#E02928", "#2140B4", "#00AE42"]),
+            "diameter_mm": 1.75,
+            "spool_weight_g": 1000,
+            "length_m": 330,
+            "nozzle_diameter_mm": 0.4,
+            "temp_hotend_min": 190,
+            "temp_hotend_max": 230,
+            "temp_drying": 55,
+            "drying_time_h": 8,
+            "produced_at": "2024-05-17-08-41",
+        }))
+    return ("\n".join(lines) + "\n").encode()
+
+
+def bench_import(rows: int) -> dict:
+    payload = _tag_dumps(rows)
+    results = {"rows": rows, "file_bytes": len(payload)}
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _make_app(tmp)
+        client = app.test_client()
+        for phase in ("fresh", "duplicates"):
+            t0 = time.perf_counter()
+            resp = client.post("/api/filaments/import",
+                               data={"files": (io.BytesIO(payload), "tags.ndjson")},
+                               content_type="multipart/form-data")
+            elapsed = time.perf_counter() - t0
+            results[phase] = {"seconds": round(elapsed, 3), "rows_per_s": _rate(rows, elapsed), **resp.get_json()}
+        _dispose(app)
+    _log(f"import {rows} rows: {results['fresh']['rows_per_s']} rows/s")
+    return results
+
+
+# ------------------- threemf -------------------
+
+def bench_threemf(sizes_mb: list, objects: int) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _make_app(tmp)
+        client = app.test_client()
+        for mesh_mb in sizes_mb:
+            path = os.path.join(tmp, f"mesh_{mesh_mb}.3mf")
+            make_3mf(path, mesh_mb, objects=200)
+            entry = {"mesh_mb": mesh_mb, "archive_mb": round(os.path.getsize(path) / 1024 / 1024, 2)}
+            for phase in ("miss", "hit"):
+                with open(path, "rb") as f:
+                    t0 = time.perf_counter()
+                    resp = client.post("/api/3mf/analyze", data={"file": (f, "bench.3mf")},
+                                       content_type="multipart/form-data")
+                    entry[f"{phase}_s"] = round(time.perf_counter() - t0, 3)
+                entry[f"{phase}_x_cache"] = resp.headers.get("X-Cache")
+            results[f"{mesh_mb}_mb"] = entry
+            os.unlink(path)
+            _log(f"threemf {mesh_mb} MB: {entry}")
+        results["under_load"] = _threemf_under_load(tmp, app, client, objects)
+        _log(f"threemf under_load: {results['under_load']}")
+        _dispose(app)
+    return results
+
+
+def _threemf_under_load(tmp: str, app: Flask, client, objects: int) -> dict:
+    """
+    Plus d'analyses lourdes (XML de `objects` pièces) que la file n'en accepte, soumises d'un coup:
+    réponses 202 / 429, et latence de POST /api/ams/sync pendant qu'elles tournent (process séparés).
+    """
+    path = os.path.join(tmp, "objects.3mf")
+    make_3mf(path, 1, objects=objects)
+    with open(path, "rb") as f:
+        data = f.read()
+    reports = _reports(4, 41)
+    client.post("/api/ams/sync", json=reports[0])
+
+    def sync_latency(batch) -> dict:
+        samples = []
+        for r in batch:
+            t1 = time.perf_counter()
+            client.post("/api/ams/sync", json=r)
+            samples.append((time.perf_counter() - t1) * 1000)
+        return _summary(samples)
+
+    idle = sync_latency(reports[1:21])
+    queue = app.threemf_queue
+    t0 = time.perf_counter()
+    responses = [client.post("/api/3mf/jobs", data={"file": (io.BytesIO(data), "objects.3mf")},
+                             content_type="multipart/form-data") for _ in range(queue.queue_size + 2)]
+    during = sync_latency(reports[21:])
+    urls = [r.json["url"] for r in responses if r.status_code == 202]
+    for url in urls:
+        while client.get(f"{url}?wait=30").json["status"] in ("queued", "running"):
+            pass
+    return {
+        "objects": objects,
+        "queue": {"workers": queue.workers, "size": queue.queue_size},
+        "accepted": len(urls),
+        "rejected_429": sum(r.status_code == 429 for r in responses),
+        "all_done_s": round(time.perf_counter() - t0, 3),
+        "ams_sync_idle": idle,
+        "ams_sync_during_analysis": during,
+    }
+
+
+# ------------------- color -------------------
+
+def bench_color(lookups: int) -> dict:
+    palette = COLOR_PALETTE.get()
+    keys = list(palette.exact)
+    rnd = random.Random(3)
+
+    def shifted(hx: str) -> str:
+        # Décalage d'une unité par canal: le cas tray_color "presque" dans la palette
+        return "#" + "".join(f"{min(255, int(hx[i:i + 2], 16) + 1):02X}" for i in (1, 3, 5))
+
+    exact = [keys[i % len(keys)] for i in range(lookups)]
+    nearest = [(m, shifted(h)) for m, h in exact]
+    unknown = [("NOPE", f"#{rnd.getrandbits(24):06X}") for _ in range(lookups)]
+
+    def per_s(pairs, fresh: bool, batch: bool = False) -> float:
+        p = Palette(palette.exact, labs=palette._labs) if fresh else palette
+        t0 = time.perf_counter()
+        if batch:
+            p.resolve_many(pairs)
+        elif fresh:
+            for m, h in pairs:
+                p.resolve(m, h)
+        else:
+            for m, h in pairs:
+                resolve_color_name(m, h)
+        return _rate(len(pairs), time.perf_counter() - t0)
+
+    distinct = len(keys)
+    results = {
+        "palette_size": len(palette),
+        "memo_hits_per_s": per_s(exact, fresh=False),
+        "exact_per_s": per_s(exact[:distinct], fresh=True),
+        "nearest_per_s": per_s(nearest[:distinct], fresh=True),
+        "nearest_batch_per_s": per_s(nearest[:distinct], fresh=True, batch=True),
+        "unknown_material_per_s": per_s(unknown, fresh=True),
+    }
+    _log(f"color: {results}")
+    return results
+
+
+# ------------------- startup -------------------
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, proc, timeout: float = 60.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and proc.poll() is None:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as resp:
+                if resp.status == 200:
+                    return True
+        except OSError:
+            pass
+        time.sleep(0.01)
+    return False
+
+
+def bench_startup(repeat: int) -> dict:
+    """
+    Process neufs, comme un redémarrage de conteneur: import de l'app (premier démarrage sur base
+    vide, puis redémarrages) et délai jusqu'au premier 200 de /health sous gunicorn -w 2.
+    """
+    root = os.path.abspath(os.path.join(_HERE, ".."))
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'app.db')}",
+               "PYTHONPATH": os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")]))}
+        cmd = [sys.executable, "-c", "import json, app; print(json.dumps(app.app.startup))"]
+
+        def boot() -> tuple:
+            t0 = time.perf_counter()
+            out = subprocess.run(cmd, cwd=tmp, env=env, capture_output=True, text=True, check=True).stdout
+            return (time.perf_counter() - t0) * 1000, json.loads(out.strip().splitlines()[-1])
+
+        first_ms, first = boot()
+        restarts = [boot() for _ in range(repeat)]
+        results["import_app"] = {
+            "first_boot_ms": round(first_ms, 1),
+            "first_boot": first,
+            "restart": _summary([ms for ms, _ in restarts]),
+            "restart_phases": restarts[-1][1],
+        }
+
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            results["gunicorn"] = None
+            _log("startup: gunicorn absent, mesure /health ignorée")
+            return results
+        samples = []
+        for _ in range(repeat):
+            port = _free_port()
+            proc = subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "-c", os.path.join(root, "gunicorn.conf.py"),
+                 "-w", "2", "-k", "gthread", "--threads", "4", "-b", f"127.0.0.1:{port}", "app:app"],
+                cwd=tmp, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            t0 = time.perf_counter()
+            try:
+                if _wait_ready(f"http://127.0.0.1:{port}/health", proc):
+                    samples.append((time.perf_counter() - t0) * 1000)
+            finally:
+                proc.terminate()
+                proc.wait(30)
+        results["gunicorn"] = {"workers": 2, "health_ready": _summary(samples) if samples else None}
+    _log(f"startup: {results}")
+    return results
+
+
+# ------------------- concurrency -------------------
+
+def _hold_sse(port: int) -> socket.socket:
+    """Client SSE inactif: requête envoyée, connexion gardée ouverte sans rien lire."""
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.sendall(b"GET /api/events HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n\r\n")
+    return sock
+
+
+def _slow_upload(port: int, size: int, stop) -> None:
+    """Upload 3MF lent (client mobile): le corps arrive par morceaux de 4 Ko jusqu'à la fin de la mesure."""
+    boundary = "benchboundary"
+    head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"slow.3mf\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n").encode()
+    length = len(head) + size + len(f"\r\n--{boundary}--\r\n")
+    try:
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            sock.sendall(f"POST /api/3mf/analyze HTTP/1.1\r\nHost: bench\r\nContent-Length: {length}\r\n"
+                         f"Content-Type: multipart/form-data; boundary={boundary}\r\n\r\n".encode() + head)
+            sent = 0
+            while sent < size - 4096 and not stop.wait(0.05):
+                sock.sendall(b"\0" * 4096)
+                sent += 4096
+    except OSError:
+        pass
+
+
+def _get(port: int, path: str, timeout: float) -> float:
+    import http.client
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        t0 = time.perf_counter()
+        conn.request("GET", path)
+        resp = conn.getresponse()
+        resp.read()
+        if resp.status != 200:
+            raise OSError(f"HTTP {resp.status}")
+        return (time.perf_counter() - t0) * 1000
+    finally:
+        conn.close()
+
+
+def _load_run(args: list, sse_clients: int, uploads: int, requests: int, timeout: float) -> dict:
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    root = os.path.abspath(os.path.join(_HERE, ".."))
+    with tempfile.TemporaryDirectory() as tmp:
+        port = _free_port()
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'app.db')}",
+               "ASGI_THREADS": "4", "EVENTS_KEEPALIVE": "60",
+               "PYTHONPATH": os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")]))}
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", os.path.join(root, "gunicorn.conf.py"),
+             "-w", "1", "-b", f"127.0.0.1:{port}", "--graceful-timeout", "2", *args],
+            cwd=tmp, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        stop = threading.Event()
+        held = []
+        try:
+            if not _wait_ready(f"http://127.0.0.1:{port}/health", proc):
+                _log(f"concurrency: serveur non démarré ({' '.join(args)})")
+                return None
+            held = [_hold_sse(port) for _ in range(sse_clients)]
+            for _ in range(uploads):
+                threading.Thread(target=_slow_upload, args=(port, 64 << 20, stop), daemon=True).start()
+            time.sleep(0.5)
+
+            def one(_):
+                try:
+                    return _get(port, "/api/filaments?limit=50", timeout)
+                except OSError:
+                    return None
+
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                samples = list(pool.map(one, range(requests)))
+            elapsed = time.perf_counter() - t0
+            ok = [ms for ms in samples if ms is not None]
+            return {
+                "ok": len(ok),
+                "failed": len(samples) - len(ok),
+                "requests_per_s": _rate(len(ok), elapsed),
+                "latency": _summary(ok) if ok else None,
+            }
+        finally:
+            stop.set()
+            for sock in held:
+                sock.close()
+            proc.terminate()
+            proc.wait(30)
+
+
+def bench_concurrency(requests: int) -> dict:
+    """
+    Un worker, 4 threads, face à des connexions longues (clients SSE inactifs, uploads 3MF lents):
+    latence de GET /api/filaments?limit=50 envoyés 8 par 8, sous gunicorn gthread (WSGI, un thread
+    par connexion) puis sous gunicorn + UvicornWorker (asgi.py, ASGI_THREADS=4).
+    light: 3 threads sur 4 occupés en WSGI; saturated: plus de connexions longues que de threads.
+    """
+    servers = {
+        "gthread": ["-k", "gthread", "--threads", "4", "app:app"],
+        "asgi": ["-k", "uvicorn_worker.UvicornWorker", "asgi:app"],
+    }
+    try:
+        import uvicorn_worker  # noqa: F401
+    except ImportError:
+        servers.pop("asgi")
+        _log("concurrency: uvicorn-worker absent, mode ASGI ignoré")
+    timeout = 5.0
+    results = {"requests": requests, "timeout_s": timeout}
+    for load, (sse_clients, uploads) in {"light": (2, 1), "saturated": (8, 2)}.items():
+        entry = {"sse_clients": sse_clients, "slow_uploads": uploads}
+        for name, args in servers.items():
+            entry[name] = _load_run(args, sse_clients, uploads, requests, timeout)
+            _log(f"concurrency {load} {name}: {entry[name]}")
+        results[load] = entry
+    return results
+
+# ------------------- Exécution / comparaison -------------------
+
+def _meta(quick: bool) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=_HERE, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "commit": commit,
+        "date": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "quick": quick,
+    }
+
+
+def _flatten(d, prefix="") -> dict:
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}.{k}" if prefix else k
+        if isinstance(v, dict):
+            out.update(_flatten(v, key))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = v
+    return out
+
+
+def compare(before_path: str, after_path: str) -> dict:
+    """Écart relatif (%) de chaque mesure numérique présente dans les deux fichiers."""
+    with open(before_path, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(after_path, encoding="utf-8") as f:
+        after = json.load(f)
+    a, b = _flatten(before["results"]), _flatten(after["results"])
+    return {
+        "before": before["meta"].get("commit"),
+        "after": after["meta"].get("commit"),
+        "changes": {
+            k: {"before": a[k], "after": b[k], "delta_pct": round((b[k] - a[k]) / a[k] * 100, 1) if a[k] else None}
+            for k in sorted(a.keys() & b.keys())
+        },
+    }
+
+
+_SCENARIOS = ("ams_sync", "listing", "import", "threemf", "color", "startup", "concurrency")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=_SCENARIOS, default=list(_SCENARIOS))
+    parser.add_argument("--quick", action="store_true", help="tailles réduites (CI, vérification rapide)")
+    parser.add_argument("--repeat", type=int, default=None, help="échantillons par mesure de latence")
+    parser.add_argument("--output", help="fichier JSON de sortie (défaut: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("AVANT", "APRES"), help="compare deux résultats")
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2))
+        return
+
+    quick = args.quick
+    repeat = args.repeat or (5 if quick else 20)
+    results = {}
+    # Les logs du backend ([PALETTE], [INGEST]...) vont sur stderr: stdout ne contient que le JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        for name in args.only:
+            if name == "ams_sync":
+                results[name] = bench_ams_sync(50 if quick else 300)
+            elif name == "listing":
+                results[name] = bench_listing([1_000, 10_000] if quick else [1_000, 10_000, 100_000], repeat)
+            elif name == "import":
+                results[name] = bench_import(5_000 if quick else 50_000)
+            elif name == "threemf":
+                results[name] = bench_threemf([1, 20] if quick else [1, 200], 200_000 if quick else 1_000_000)
+            elif name == "color":
+                results[name] = bench_color(20_000 if quick else 200_000)
+            elif name == "startup":
+                results[name] = bench_startup(3 if quick else 5)
+            elif name == "concurrency":
+                results[name] = bench_concurrency(40 if quick else 200)
+
+    out = json.dumps({"meta": _meta(quick), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
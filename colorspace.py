@@ -0,0 +1,70 @@
+# backend/colorspace.py
+from typing import Optional, Tuple
+
+import numpy as np
+
+Lab = Tuple[float, float, float]
+
+
+def hex_to_rgb(hex_code: Optional[str]) -> Optional[Tuple[int, int, int]]:
+    """'#RRGGBB', 'RRGGBB', '#RRGGBBAA' (alpha ignoré) ou '#RGB' → (r, g, b)."""
+    if not hex_code:
+        return None
+    s = hex_code.strip().lstrip("#")
+    if len(s) == 3:
+        s = "".join(c * 2 for c in s)
+    if len(s) == 8:
+        s = s[:6]
+    if len(s) != 6:
+        return None
+    try:
+        return int(s[0:2], 16), int(s[2:4], 16), int(s[4:6], 16)
+    except ValueError:
+        return None
+
+
+def _srgb_to_linear(c: float) -> float:
+    c = c / 255.0
+    return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+
+def _lab_f(t: float) -> float:
+    return t ** (1 / 3) if t > 216 / 24389 else (24389 / 27 * t + 16) / 116
+
+
+def rgb_to_lab(rgb: Tuple[int, int, int]) -> Lab:
+    """sRGB (D65) → CIE L*a*b*."""
+    r, g, b = (_srgb_to_linear(c) for c in rgb)
+    x = (0.4124564 * r + 0.3575761 * g + 0.1804375 * b) / 0.95047
+    y = 0.2126729 * r + 0.7151522 * g + 0.0721750 * b
+    z = (0.0193339 * r + 0.1191920 * g + 0.9503041 * b) / 1.08883
+    fx, fy, fz = _lab_f(x), _lab_f(y), _lab_f(z)
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def hex_to_lab(hex_code: Optional[str]) -> Optional[Lab]:
+    rgb = hex_to_rgb(hex_code)
+    return rgb_to_lab(rgb) if rgb else None
+
+
+def delta_e(a: Lab, b: Lab) -> float:
+    """Distance perceptuelle CIE76 (≈ 2.3: différence juste perceptible)."""
+    return ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2) ** 0.5
+
+
+# --------- Versions vectorisées (NumPy) ---------
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+_D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+
+def rgb_to_lab_array(rgb: np.ndarray) -> np.ndarray:
+    """(n, 3) sRGB 0-255 → (n, 3) CIE L*a*b*. Mêmes formules que rgb_to_lab."""
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    lin = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = lin @ _RGB_TO_XYZ.T / _D65_WHITE
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
@@ -0,0 +1,254 @@
+# backend/consumption.py
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List
+
+from sqlalchemy import select, update, insert, delete, func, bindparam, tuple_
+
+from database import dialect_insert
+from models import Filament, ConsumptionEvent, ConsumptionRollup
+
+# Rétention: événements bruts → buckets horaires → buckets journaliers (conservés indéfiniment)
+RAW_RETENTION_DAYS = int(os.getenv("CONSUMPTION_RAW_DAYS", "7"))
+HOURLY_RETENTION_DAYS = int(os.getenv("CONSUMPTION_HOURLY_DAYS", "90"))
+# Intervalle (s) entre deux purges automatiques (déclenchées par le thread d'ingestion)
+COMPACT_INTERVAL = float(os.getenv("CONSUMPTION_COMPACT_INTERVAL", "3600"))
+
+HOUR = 3600
+DAY = 86400
+_RESOLUTIONS = {"hour": HOUR, "day": DAY}
+
+
+def _bucket(ts: datetime, seconds: int) -> datetime:
+    if seconds == DAY:
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def record_consumption(session, changes: List[dict]) -> int:
+    """
+    Ajoute les variations de poids au journal et aux buckets horaires/journaliers, dans la
+    transaction courante (le commit reste à l'appelant).
+    changes: [{"filament_id", "material", "before", "after", "at", "source"}, ...]
+    """
+    changes = [c for c in changes if c["before"] is not None and c["after"] is not None
+               and c["before"] != c["after"]]
+    if not changes:
+        return 0
+
+    session.execute(insert(ConsumptionEvent.__table__), [
+        {
+            "filament_id": c["filament_id"], "material": c["material"], "recorded_at": c["at"],
+            "grams_before": c["before"], "grams_after": c["after"], "source": c["source"],
+        }
+        for c in changes
+    ])
+
+    # Pré-agrégation en mémoire: une ligne par (résolution, bobine, bucket)
+    buckets: Dict[tuple, dict] = OrderedDict()
+    for c in sorted(changes, key=lambda c: c["at"]):
+        delta = c["before"] - c["after"]
+        for seconds in (HOUR, DAY):
+            key = (seconds, c["filament_id"], _bucket(c["at"], seconds))
+            b = buckets.get(key)
+            if b is None:
+                b = buckets[key] = {
+                    "bucket_seconds": seconds, "filament_id": c["filament_id"], "bucket_start": key[2],
+                    "material": c["material"], "consumed_grams": 0, "refilled_grams": 0, "samples": 0,
+                }
+            b["consumed_grams"] += max(delta, 0)
+            b["refilled_grams"] += max(-delta, 0)
+            b["samples"] += 1
+            b["last_grams"] = c["after"]
+    _upsert_rollups(session, list(buckets.values()))
+    return len(changes)
+
+
+def _upsert_rollups(session, rows: List[dict]) -> None:
+    table = ConsumptionRollup.__table__
+    dialect_ins = dialect_insert(session)
+    if dialect_ins is not None:
+        stmt = dialect_ins(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.bucket_seconds, table.c.filament_id, table.c.bucket_start],
+            set_={
+                "consumed_grams": table.c.consumed_grams + stmt.excluded.consumed_grams,
+                "refilled_grams": table.c.refilled_grams + stmt.excluded.refilled_grams,
+                "samples": table.c.samples + stmt.excluded.samples,
+                "last_grams": stmt.excluded.last_grams,
+                "material": stmt.excluded.material,
+            },
+        )
+        session.execute(stmt, rows)
+        return
+
+    keys = [(r["bucket_seconds"], r["filament_id"], r["bucket_start"]) for r in rows]
+    existing = {
+        tuple(k): rid for *k, rid in session.execute(
+            select(table.c.bucket_seconds, table.c.filament_id, table.c.bucket_start, table.c.id)
+            .where(tuple_(table.c.bucket_seconds, table.c.filament_id, table.c.bucket_start).in_(keys))
+        )
+    }
+    new = [r for r, k in zip(rows, keys) if k not in existing]
+    upd = [{**r, "_id": existing[k]} for r, k in zip(rows, keys) if k in existing]
+    if new:
+        session.execute(insert(table), new)
+    if upd:
+        session.execute(
+            update(table).where(table.c.id == bindparam("_id")).values(
+                consumed_grams=table.c.consumed_grams + bindparam("consumed_grams"),
+                refilled_grams=table.c.refilled_grams + bindparam("refilled_grams"),
+                samples=table.c.samples + bindparam("samples"),
+                last_grams=bindparam("last_grams"),
+                material=bindparam("material"),
+            ),
+            upd,
+        )
+
+
+def compact_consumption(session, now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Purge ce qui est déjà couvert par une résolution plus grossière:
+    événements bruts > RAW_RETENTION_DAYS (couverts par les buckets horaires),
+    buckets horaires > HOURLY_RETENTION_DAYS (couverts par les buckets journaliers).
+    """
+    now = now or datetime.utcnow()
+    events = ConsumptionEvent.__table__
+    rollups = ConsumptionRollup.__table__
+    raw = session.execute(
+        delete(events).where(events.c.recorded_at < now - timedelta(days=RAW_RETENTION_DAYS))
+    ).rowcount
+    hourly = session.execute(
+        delete(rollups)
+        .where(rollups.c.bucket_seconds == HOUR)
+        .where(rollups.c.bucket_start < _bucket(now - timedelta(days=HOURLY_RETENTION_DAYS), HOUR))
+    ).rowcount
+    session.commit()
+    return {"events_deleted": raw, "hourly_buckets_deleted": hourly}
+
+
+# ------------------- Lecture (toujours sur les buckets journaliers/horaires) -------------------
+
+def _projection(remaining: Optional[float], per_day: float, now: datetime) -> Dict[str, Any]:
+    if not remaining or remaining <= 0 or per_day <= 0:
+        return {"days_left": None, "runout_date": None}
+    days_left = remaining / per_day
+    return {
+        "days_left": round(days_left, 1),
+        "runout_date": (now + timedelta(days=days_left)).strftime("%Y-%m-%d"),
+    }
+
+
+def _observed_days(since: datetime, created_at: Optional[datetime], now: datetime) -> float:
+    """Jours observés dans la fenêtre: une bobine ajoutée récemment n'est pas diluée sur toute la période."""
+    start = max(since, created_at) if created_at else since
+    return max((now - start).total_seconds() / DAY, 1.0)
+
+
+def spool_usage(session, days: int, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Consommation (g/jour) et date d'épuisement projetée, par bobine, sur les `days` derniers jours."""
+    now = now or datetime.utcnow()
+    since = _bucket(now - timedelta(days=days), DAY)
+    r = ConsumptionRollup.__table__
+    f = Filament.__table__
+    totals = (
+        select(r.c.filament_id, func.sum(r.c.consumed_grams).label("consumed"))
+        .where(r.c.bucket_seconds == DAY, r.c.bucket_start >= since)
+        .group_by(r.c.filament_id)
+        .subquery()
+    )
+    rows = session.execute(
+        select(f.c.id, f.c.uid, f.c.filament_type, f.c.filament_detailed_type, f.c.color_name,
+               f.c.color_code, f.c.remaining_grams, f.c.created_at, totals.c.consumed)
+        .join(totals, totals.c.filament_id == f.c.id)
+        .order_by(totals.c.consumed.desc())
+    ).mappings().all()
+
+    out = []
+    for row in rows:
+        per_day = row["consumed"] / _observed_days(since, row["created_at"], now)
+        out.append({
+            "uid": row["uid"],
+            "material": row["filament_detailed_type"] or row["filament_type"],
+            "color_name": row["color_name"],
+            "color_code": row["color_code"],
+            "remaining_grams": row["remaining_grams"],
+            "consumed_grams": row["consumed"],
+            "grams_per_day": round(per_day, 2),
+            **_projection(row["remaining_grams"], per_day, now),
+        })
+    return out
+
+
+def spool_series(session, filament: Filament, days: int, resolution: str = "day",
+                 now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Série temporelle d'une bobine (buckets horaires limités à HOURLY_RETENTION_DAYS)."""
+    if resolution not in _RESOLUTIONS:
+        raise ValueError("resolution must be 'hour' or 'day'")
+    seconds = _RESOLUTIONS[resolution]
+    if seconds == HOUR:
+        days = min(days, HOURLY_RETENTION_DAYS)
+    now = now or datetime.utcnow()
+    since = _bucket(now - timedelta(days=days), seconds)
+    r = ConsumptionRollup.__table__
+    buckets = session.execute(
+        select(r.c.bucket_start, r.c.consumed_grams, r.c.refilled_grams, r.c.last_grams)
+        .where(r.c.bucket_seconds == seconds, r.c.filament_id == filament.id, r.c.bucket_start >= since)
+        .order_by(r.c.bucket_start)
+    ).all()
+
+    consumed = sum(b.consumed_grams for b in buckets)
+    per_day = consumed / _observed_days(since, filament.created_at, now)
+    return {
+        "uid": filament.uid,
+        "material": filament.filament_detailed_type or filament.filament_type,
+        "remaining_grams": filament.remaining_grams,
+        "resolution": resolution,
+        "days": days,
+        "consumed_grams": consumed,
+        "grams_per_day": round(per_day, 2),
+        **_projection(filament.remaining_grams, per_day, now),
+        "buckets": [
+            {
+                "start": b.bucket_start.strftime("%Y-%m-%d %H:%M:%S"),
+                "consumed_grams": b.consumed_grams,
+                "refilled_grams": b.refilled_grams,
+                "remaining_grams": b.last_grams,
+            }
+            for b in buckets
+        ],
+    }
+
+
+def material_usage(session, days: int, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Consommation (g/jour) par matériau et épuisement projeté du stock restant de ce matériau."""
+    now = now or datetime.utcnow()
+    since = _bucket(now - timedelta(days=days), DAY)
+    r = ConsumptionRollup.__table__
+    f = Filament.__table__
+    consumed = dict(session.execute(
+        select(r.c.material, func.sum(r.c.consumed_grams))
+        .where(r.c.bucket_seconds == DAY, r.c.bucket_start >= since)
+        .group_by(r.c.material)
+    ).all())
+    material = func.coalesce(f.c.filament_detailed_type, f.c.filament_type)
+    stock = dict(session.execute(
+        select(material, func.sum(f.c.remaining_grams))
+        .where(f.c.remaining_grams > 0)
+        .group_by(material)
+    ).all())
+
+    period = max((now - since).total_seconds() / DAY, 1.0)
+    out = []
+    for name, grams in consumed.items():
+        per_day = grams / period
+        out.append({
+            "material": name,
+            "consumed_grams": grams,
+            "grams_per_day": round(per_day, 2),
+            "remaining_grams": stock.get(name),
+            **_projection(stock.get(name), per_day, now),
+        })
+    out.sort(key=lambda m: m["consumed_grams"], reverse=True)
+    return out
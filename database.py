@@ -0,0 +1,74 @@
+# backend/database.py
+import os
+import sqlite3
+from typing import Dict, Any, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# Pool de connexions (PostgreSQL et autres serveurs; SQLite garde le pool par défaut)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Recycle (s) les connexions avant les coupures côté serveur / proxy (pgbouncer, NAT...)
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Attente max (s) du verrou d'écriture SQLite avant "database is locked"
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+
+
+def normalize_database_url(url: str) -> str:
+    """postgres:// (Heroku, docker) et postgresql:// sans driver → driver psycopg 3."""
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    if url.startswith("postgresql://"):
+        url = "postgresql+psycopg://" + url[len("postgresql://"):]
+    return url
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """SQLALCHEMY_ENGINE_OPTIONS selon le dialecte de DATABASE_URL."""
+    backend = make_url(url).get_backend_name()
+    if backend == "sqlite":
+        return {
+            "connect_args": {
+                "check_same_thread": False,     # thread MQTT / ingestion
+                "timeout": SQLITE_BUSY_TIMEOUT,
+            }
+        }
+    return {
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_conn, connection_record):
+    """PRAGMAs appliqués à chaque nouvelle connexion SQLite (sans effet sur les autres dialectes)."""
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    cur = dbapi_conn.cursor()
+    try:
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT * 1000)}")
+    finally:
+        cur.close()
+
+
+def dialect_insert(session):
+    """
+    insert() du dialecte courant s'il supporte ON CONFLICT (SQLite, PostgreSQL), sinon None:
+    l'appelant retombe alors sur SELECT + INSERT / UPDATE.
+    """
+    name = session.get_bind().dialect.name
+    if name == "sqlite":
+        return sqlite_insert
+    if name == "postgresql":
+        # Dialecte importé seulement s'il sert (~25 ms au démarrage sinon)
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert
+    return None
@@ -0,0 +1,252 @@
+# backend/events.py
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Iterator, AsyncIterator, Callable, Awaitable
+
+from sqlalchemy import select, delete, func
+
+from models import db, FilamentChange, purge_tombstones
+
+# Intervalle (s) de lecture du journal filament_changes (partagé entre workers via la base)
+POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "1"))
+# Événements gardés en mémoire par worker pour servir les reconnexions sans requête
+BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "1000"))
+# Rétention (h) du journal et des tombstones en base: au-delà, un client trop en retard reçoit "reset"
+# (SSE) ou 410 (/api/filaments/changes)
+RETENTION_HOURS = float(os.getenv("EVENTS_RETENTION_HOURS", "24"))
+# Commentaire keep-alive (s): détecte les clients partis et traverse les proxies
+KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+
+_PURGE_INTERVAL = 3600.0
+_FETCH_LIMIT = 500
+
+
+def _to_event(row) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "op": row.op,
+        "filament_id": row.filament_id,
+        "uid": row.uid,
+        "fields": json.loads(row.fields) if row.fields else None,
+        "at": row.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    name = "reload" if event["op"] == "reload" else "filament"
+    return f"id: {event['id']}\nevent: {name}\ndata: {json.dumps(event)}\n\n"
+
+
+class EventHub:
+    """
+    Diffusion des modifications d'inventaire aux clients SSE d'un worker.
+    Un seul thread par worker lit le journal filament_changes (écrit par tous les workers dans la
+    transaction de chaque écriture) et réveille les flux; les Last-Event-ID plus anciens que le
+    tampon mémoire sont rejoués depuis la base.
+    Les id du journal suivent l'ordre des commits (aussi sur PostgreSQL): chaque écriture verrouille
+    d'abord la ligne inventory_state (bump_inventory_version) jusqu'à son commit, puis écrit le journal.
+    """
+
+    def __init__(self, app, poll_interval: Optional[float] = None, buffer_size: Optional[int] = None):
+        self.app = app
+        self.poll_interval = POLL_INTERVAL if poll_interval is None else poll_interval
+        self._buffer: deque = deque(maxlen=buffer_size or BUFFER_SIZE)
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._head: Optional[int] = None
+        self._last_purge = 0.0
+        # Flux asynchrones (asgi.py): (boucle, asyncio.Event) réveillés par le thread de lecture
+        self._async_waiters: set = set()
+        self.subscribers = 0
+        self.delivered = 0
+
+    # ---------- Lecture du journal ----------
+    def _fetch(self, after: int, limit: int = _FETCH_LIMIT) -> List[Dict[str, Any]]:
+        t = FilamentChange.__table__
+        with self.app.app_context():
+            try:
+                rows = db.session.execute(
+                    select(t).where(t.c.id > after).order_by(t.c.id).limit(limit)
+                ).all()
+                return [_to_event(r) for r in rows]
+            finally:
+                db.session.remove()
+
+    def _bounds(self) -> tuple:
+        t = FilamentChange.__table__
+        with self.app.app_context():
+            try:
+                return db.session.execute(select(func.min(t.c.id), func.max(t.c.id))).one()
+            finally:
+                db.session.remove()
+
+    def _ensure_started(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._head = self._bounds()[1] or 0
+            self._thread = threading.Thread(target=self._run, name="events-hub", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self._poll()
+                if time.monotonic() - self._last_purge >= _PURGE_INTERVAL:
+                    self._last_purge = time.monotonic()
+                    self.purge()
+            except Exception as e:
+                print(f"[EVENTS] Erreur de lecture du journal: {e}")
+            time.sleep(self.poll_interval)
+
+    def _poll(self) -> None:
+        while True:
+            events = self._fetch(self._head)
+            if not events:
+                return
+            with self._cond:
+                self._buffer.extend(events)
+                self._head = events[-1]["id"]
+                self._cond.notify_all()
+                for loop, wake in self._async_waiters:
+                    loop.call_soon_threadsafe(wake.set)
+            if len(events) < _FETCH_LIMIT:
+                return
+
+    def purge(self) -> int:
+        """Journal et tombstones plus anciens que RETENTION_HOURS, dans une même transaction."""
+        t = FilamentChange.__table__
+        cutoff = datetime.utcnow() - timedelta(hours=RETENTION_HOURS)
+        with self.app.app_context():
+            try:
+                n = db.session.execute(delete(t).where(t.c.created_at < cutoff)).rowcount
+                purge_tombstones(db.session, cutoff)
+                db.session.commit()
+                return n
+            finally:
+                db.session.remove()
+
+    # ---------- Flux client ----------
+    def _replay(self, last_id: int) -> Iterator[Dict[str, Any]]:
+        """Événements > last_id jusqu'à la tête courante: tampon mémoire si possible, sinon base."""
+        with self._cond:
+            head = self._head
+            buffered = list(self._buffer)
+        if buffered and buffered[0]["id"] <= last_id + 1:
+            yield from (e for e in buffered if e["id"] > last_id)
+            return
+        cursor = last_id
+        while cursor < head:
+            events = self._fetch(cursor)
+            if not events:
+                return
+            for e in events:
+                if e["id"] > head:
+                    return
+                yield e
+            cursor = events[-1]["id"]
+
+    def _catch_up(self, last_event_id: int, cursor: int) -> Iterator[tuple]:
+        """Reprise après Last-Event-ID: (nouveau curseur, message SSE ou "" si rien à envoyer)."""
+        oldest, newest = self._bounds()
+        if oldest is None or last_event_id > newest or last_event_id < oldest - 1:
+            # Journal purgé (ou base remplacée) depuis: le client doit recharger le listing
+            yield cursor, f"id: {cursor}\nevent: reset\ndata: {json.dumps({'id': cursor})}\n\n"
+        elif last_event_id > cursor:
+            yield last_event_id, ""  # vu par un autre worker, ce tampon n'y est pas encore
+        else:
+            for e in self._replay(last_event_id):
+                yield e["id"], format_sse(e)
+
+    def _pending(self, cursor: int) -> Optional[List[Dict[str, Any]]]:
+        """Événements du tampon après cursor; None si le tampon est dépassé (rattrapage en base). Sous self._cond."""
+        if self._buffer and self._buffer[0]["id"] <= cursor + 1:
+            return [e for e in self._buffer if e["id"] > cursor]
+        if self._head > cursor:
+            return None
+        return []
+
+    def stream(self, last_event_id: Optional[int] = None) -> Iterator[str]:
+        """Générateur SSE. Sans Last-Event-ID, ne reçoit que les modifications à venir."""
+        self._ensure_started()
+        yield f"retry: {int(self.poll_interval * 3000)}\n\n"
+        with self._cond:
+            self.subscribers += 1
+            cursor = self._head
+        try:
+            if last_event_id is not None and last_event_id != cursor:
+                for cursor, message in self._catch_up(last_event_id, cursor):
+                    if message:
+                        yield message
+
+            while True:
+                with self._cond:
+                    if self._head <= cursor:
+                        self._cond.wait(KEEPALIVE)
+                    pending = self._pending(cursor)
+                if pending is None:
+                    pending = list(self._replay(cursor))
+                if not pending:
+                    yield ": keepalive\n\n"
+                    continue
+                for e in pending:
+                    cursor = e["id"]
+                    self.delivered += 1
+                    yield format_sse(e)
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+    async def astream(self, last_event_id: Optional[int],
+                      run: Callable[..., Awaitable[Any]]) -> AsyncIterator[str]:
+        """
+        Même flux que stream() pour le mode ASGI: l'attente se fait sur la boucle asyncio, sans
+        thread par client; les lectures en base passent par run(fn, *args) (pool de threads borné).
+        """
+        await run(self._ensure_started)
+        yield f"retry: {int(self.poll_interval * 3000)}\n\n"
+        wake = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), wake)
+        with self._cond:
+            self.subscribers += 1
+            self._async_waiters.add(waiter)
+            cursor = self._head
+        try:
+            if last_event_id is not None and last_event_id != cursor:
+                for cursor, message in await run(lambda c=cursor: list(self._catch_up(last_event_id, c))):
+                    if message:
+                        yield message
+
+            while True:
+                with self._cond:
+                    wake.clear()  # un _poll postérieur au calcul ci-dessous le repositionne
+                    pending = self._pending(cursor)
+                if pending is None:
+                    pending = await run(lambda c=cursor: list(self._replay(c)))
+                if not pending:
+                    try:
+                        await asyncio.wait_for(wake.wait(), KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        yield ": keepalive\n\n"
+                    continue
+                for e in pending:
+                    cursor = e["id"]
+                    self.delivered += 1
+                    yield format_sse(e)
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+                self._async_waiters.discard(waiter)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": self.subscribers,
+            "head": self._head,
+            "buffered": len(self._buffer),
+            "delivered": self.delivered,
+        }
@@ -0,0 +1,35 @@
+# backend/gunicorn.conf.py — chargé automatiquement par gunicorn depuis le dossier courant (/app)
+import os
+import shutil
+import tempfile
+
+# L'app est importée une seule fois, dans le master: imports, palette et vérification du schéma
+# ne sont pas refaits par chaque worker, qui démarre par fork (copy-on-write).
+preload_app = True
+# Threads de fond (ingestion, MQTT) démarrés dans chaque worker après le fork (post_worker_init)
+os.environ["DEFER_SERVICES"] = "1"
+
+# Métriques Prometheus agrégées entre workers (voir metrics.py): le dossier doit être connu
+# avant l'import de prometheus_client, donc défini ici, dans le master, avant le fork.
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "filament-tracker-metrics")
+)
+
+
+def on_starting(server):
+    # Repart de zéro à chaque démarrage: les fichiers d'anciens pids fausseraient les compteurs
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def post_worker_init(worker):
+    # worker.wsgi est l'app ASGI (asgi.py) sous UvicornWorker: les services sont ceux de l'app Flask
+    from app import app, start_services
+    start_services(app)
+
+
+def child_exit(server, worker):
+    # Worker terminé (redémarrage, crash): ses compteurs restent comptés, ses jauges "live" non
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,9 +1,16 @@
 # backend/helper.py
 from datetime import datetime
-from models import Filament 
+from models import Filament, resolve_color_names, bump_inventory_version, change_row, record_filament_changes
+from consumption import record_consumption
+from sqlalchemy import select, update, insert, or_, func, bindparam
+from database import dialect_insert
+from metrics import UPSERTS
+import io
 import json
+import os
+import zipfile
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, Tuple, List
 
 def _hex_rgba_to_hex(rgb_or_rgba: str) -> str | None:
     if not rgb_or_rgba:
@@ -79,35 +86,322 @@ def tray_to_filament_dict(sensor_id: str, tray: dict) -> dict:
         "last_sync_at": datetime.utcnow(),
     }
 
-def upsert_filament(session, payload: dict):
+_FILAMENT_COLUMNS = {c.name for c in Filament.__table__.columns} - {"id"}
+_SYNC_FIELDS = {"last_sync_at", "last_sync_source"}
+
+def bulk_upsert_filaments(session, payloads: list) -> Dict[str, int]:
     """
-    Identifie par payload['uid'] (tag_uid). Fallback sur payload['tray_uid'].
-    Met à jour uniquement les champs non-nuls.
-    Le champ color_name sera rempli automatiquement par les events du modèle.
+    Upsert d'un lot de bobines (ex: tous les trays d'un rapport AMS), identifiées par payload['uid']
+    (tag_uid), sinon par payload['tray_uid']:
+    - une seule requête pour résoudre toutes les clés uid / tray_uid existantes
+    - toutes les écritures dans une seule transaction (INSERT ... ON CONFLICT(uid) DO UPDATE sur SQLite / PostgreSQL)
+    Seuls les champs non-nuls sont appliqués, et les payloads d'un même lot sont appliqués dans l'ordre.
+    Les events ORM ne s'appliquent pas aux requêtes Core: color_name est donc calculé ici.
+    Chaque variation de remaining_grams d'une bobine existante est ajoutée au journal de consommation
+    (pas lors d'un changement de tag_uid dans un tray: c'est une autre bobine).
     """
-    key_uid = payload.get("uid")
-    alt_key = payload.get("tray_uid")
-    if not key_uid and not alt_key:
-        return
+    stats = {"inserted": 0, "updated": 0, "unchanged": 0, "consumption_events": 0}
+    payloads = [p for p in payloads if p.get("uid") or p.get("tray_uid")]
+    if not payloads:
+        return stats
+
+    table = Filament.__table__
+    uids = {p["uid"] for p in payloads if p.get("uid")}
+    tray_uids = {p["tray_uid"] for p in payloads if p.get("tray_uid")}
+    existing = session.execute(
+        select(table).where(or_(table.c.uid.in_(uids), table.c.tray_uid.in_(tray_uids)))
+    ).mappings().all()
+
+    by_uid: Dict[str, dict] = {}
+    by_tray: Dict[str, dict] = {}
+    for r in existing:
+        state = {"row": dict(r), "orig": dict(r)}
+        by_uid[r["uid"]] = state
+        if r["tray_uid"]:
+            by_tray.setdefault(r["tray_uid"], state)
+
+    # 1) Résolution + fusion en mémoire, dans l'ordre des payloads
+    touched: list = []
+    cols = {"uid", "color_name"}
+    for p in payloads:
+        key_uid, alt_key = p.get("uid"), p.get("tray_uid")
+        state = by_uid.get(key_uid) if key_uid else None
+        if state is None and alt_key:
+            state = by_tray.get(alt_key)
+        if state is None:
+            state = {"row": {"uid": key_uid or alt_key}, "orig": None}
+        if not any(state is t for t in touched):
+            touched.append(state)
+
+        row = state["row"]
+        old_uid = row["uid"]
+        for k, v in p.items():
+            if v is not None and k in _FILAMENT_COLUMNS:
+                row[k] = v
+                cols.add(k)
+        if row["uid"] != old_uid:
+            by_uid.pop(old_uid, None)
+        by_uid[row["uid"]] = state
+        if row.get("tray_uid"):
+            by_tray.setdefault(row["tray_uid"], state)
+
+    # 2) color_name sur l'état fusionné + classement insert / update
+    names = resolve_color_names([
+        (s["row"].get("filament_detailed_type") or s["row"].get("filament_type"), s["row"].get("color_code"))
+        for s in touched
+    ])
+    changed = []
+    for state, color_name in zip(touched, names):
+        row, orig = state["row"], state["orig"]
+        row["color_name"] = color_name
+        changed.append(orig is None or any(orig.get(k) != v for k, v in row.items() if k not in _SYNC_FIELDS))
+
+    # Version d'inventaire de ce lot, portée par chaque ligne insérée ou modifiée (updated_version).
+    # Rapport identique à l'état en base: ni version (ETag du listing inchangé) ni verrou inventory_state.
+    if any(changed):
+        version = stats["version"] = bump_inventory_version(session.connection())
+        cols |= {"updated_version", "updated_at"}
+    upserts, inserts, by_id, changes, events = [], [], [], [], []
+    now = datetime.utcnow()
+    for state, is_changed in zip(touched, changed):
+        row, orig = state["row"], state["orig"]
+        if is_changed:
+            row["updated_version"], row["updated_at"] = version, now
+        values = {c: row.get(c) for c in cols}
+        if orig is None:
+            stats["inserted"] += 1
+            inserts.append(values)
+            continue
+
+        if not is_changed:
+            stats["unchanged"] += 1
+        else:
+            stats["updated"] += 1
+            diff = {k: v for k, v in row.items() if k != "id" and orig.get(k) != v}
+            events.append(change_row("update", orig["id"], row["uid"], diff))
+        if row["uid"] != orig["uid"]:
+            # Nouvelle bobine dans un tray connu: le poids précédent est celui de l'ancienne bobine
+            by_id.append({**values, "_id": orig["id"]})
+            continue
+        changes.append({
+            "filament_id": orig["id"],
+            "material": row.get("filament_detailed_type") or row.get("filament_type"),
+            "before": orig.get("remaining_grams"),
+            "after": row.get("remaining_grams"),
+            "at": now,
+            "source": row.get("last_sync_source"),
+        })
+        upserts.append((values, orig["id"]))
+
+    # 3) Écritures, une seule transaction
+    cols = sorted(cols)
+    dialect_ins = dialect_insert(session)
+    if dialect_ins is not None:
+        upserts = inserts + [v for v, _ in upserts]
+        if upserts:
+            stmt = dialect_ins(table)
+            set_ = {c: func.coalesce(stmt.excluded[c], table.c[c]) for c in cols if c not in ("uid", "color_name")}
+            set_["color_name"] = stmt.excluded.color_name
+            session.execute(stmt.on_conflict_do_update(index_elements=[table.c.uid], set_=set_), upserts)
+    else:
+        if inserts:
+            session.execute(insert(table), inserts)
+        by_id = [{**v, "_id": fid} for v, fid in upserts] + by_id
+    if by_id:
+        stmt = update(table).where(table.c.id == bindparam("_id")).values({c: bindparam(c) for c in cols})
+        session.execute(stmt, by_id)
+
+    if inserts:
+        # Les INSERT en lot ne renvoient pas les id: une requête pour les retrouver
+        ids = dict(session.execute(
+            select(table.c.uid, table.c.id).where(table.c.uid.in_([v["uid"] for v in inserts]))
+        ).all())
+        events += [
+            change_row("insert", ids.get(v["uid"]), v["uid"], {k: x for k, x in v.items() if x is not None})
+            for v in inserts
+        ]
+    record_filament_changes(session, events)
+    stats["consumption_events"] = record_consumption(session, changes)
+    session.commit()
+    UPSERTS.labels("insert").inc(stats["inserted"])
+    UPSERTS.labels("update").inc(stats["updated"])
+    UPSERTS.labels("noop").inc(stats["unchanged"])
+    return stats
+
+# ------------------- Import en masse de dumps de tags -------------------
+
+# Nombre de lignes insérées (et commitées) par lot lors d'un import
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
 
-    q = None
-    if key_uid:
-        q = Filament.query.filter_by(uid=key_uid).first()
-    if not q and alt_key:
-        q = Filament.query.filter_by(tray_uid=alt_key).first()
+_IMPORT_EXTENSIONS = (".json", ".ndjson", ".jsonl", ".zip")
+
+def tag_dump_to_row(content: dict) -> dict:
+    """Dump JSON d'un tag (lecteur RFID) → ligne de la table filaments. Lève une exception si invalide."""
+    uid = content.get('tag_uid')
+    return {
+        "uid": uid,
+        "tray_uid": uid,
+        "tag_manufacturer": content.get('material_code'),
+        "filament_type": content.get('type'),
+        "filament_detailed_type": content.get('subtype'),
+        "color_code": content.get('color_hex'),
+        "filament_diameter": content.get('diameter_mm'),
+        "spool_weight": content.get('spool_weight_g'),
+        "filament_length": content.get('length_m'),
+        "nozzle_diameter": int(round(content.get('nozzle_diameter_mm', 0) * 1000)),
+        "print_temp_min": content.get('temp_hotend_min'),
+        "print_temp_max": content.get('temp_hotend_max'),
+        "dry_temp": content.get('temp_drying'),
+        "dry_time_hour": content.get('drying_time_h', 0) * 60,
+        "manufacture_datetime_utc": datetime.strptime(content.get('produced_at'), "%Y-%m-%d-%H-%M"),
+        "short_date": content.get('produced_at').replace('-', '')[:8],
+    }
 
-    if not q:
-        q = Filament(uid=key_uid or alt_key)
-        session.add(q)
+def _iter_json_lines(stream, name: str) -> Iterator[Tuple[str, Any]]:
+    text = io.TextIOWrapper(stream, encoding="utf-8")
+    for lineno, line in enumerate(text, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield f"{name}:{lineno}", json.loads(line)
+        except ValueError as e:
+            yield f"{name}:{lineno}", e
+    text.detach()
 
-    for k, v in payload.items():
-        if v is not None and hasattr(q, k):
-            setattr(q, k, v)
+def iter_import_records(filename: str, stream) -> Iterator[Tuple[str, Any]]:
+    """
+    Parcourt un fichier uploadé en streaming et produit (source, contenu) par dump de tag,
+    ou (source, exception) si l'entrée est illisible.
+    Formats: .json (un dump), .ndjson/.jsonl (un dump par ligne), .zip (de .json / .ndjson).
+    """
+    lower = filename.lower()
+    if lower.endswith(".json"):
+        try:
+            yield filename, json.loads(stream.read().decode("utf-8"))
+        except ValueError as e:
+            yield filename, e
+    elif lower.endswith((".ndjson", ".jsonl")):
+        yield from _iter_json_lines(stream, filename)
+    elif lower.endswith(".zip"):
+        try:
+            archive = zipfile.ZipFile(stream)
+        except zipfile.BadZipFile as e:
+            yield filename, e
+            return
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith((".json", ".ndjson", ".jsonl")):
+                    continue
+                source = f"{filename}/{info.filename}"
+                with archive.open(info) as member:
+                    yield from iter_import_records(source, member)
 
+def _insert_import_chunk(session, rows: list) -> int:
+    """Insère un lot (doublons ignorés) et le commit. Retourne le nombre de lignes réellement insérées."""
+    table = Filament.__table__
+    existing = set(session.execute(
+        select(table.c.uid).where(table.c.uid.in_([r["uid"] for r in rows]))
+    ).scalars())
+    rows = [r for r in rows if r["uid"] not in existing]
+    if rows:
+        names = resolve_color_names([(r["filament_detailed_type"] or r["filament_type"], r["color_code"]) for r in rows])
+        version = bump_inventory_version(session.connection())
+        now = datetime.utcnow()
+        for r, name in zip(rows, names):
+            r["color_name"] = name
+            r["updated_version"], r["updated_at"] = version, now
+        dialect_ins = dialect_insert(session)
+        if dialect_ins is not None:
+            # ON CONFLICT DO NOTHING: sûr même si un autre worker insère le même uid entre-temps
+            session.execute(dialect_ins(table).on_conflict_do_nothing(index_elements=[table.c.uid]), rows)
+        else:
+            session.execute(insert(table), rows)
+        # Un seul événement par lot: les clients SSE rechargent le listing
+        record_filament_changes(session, [change_row("reload", fields={"reason": "import", "rows": len(rows)})])
     session.commit()
+    return len(rows)
+
+def bulk_import_filaments(session, records: Iterator[Tuple[str, Any]],
+                          chunk_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Import en masse: lots de chunk_size lignes, uids existants pré-chargés par lot,
+    un commit par lot (un lot en erreur n'empêche pas les autres), rapport d'erreur par fichier.
+    """
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    imported = skipped = 0
+    errors = []
+    chunk, sources, seen = [], [], set()
+
+    def flush():
+        nonlocal imported, skipped
+        try:
+            n = _insert_import_chunk(session, chunk)
+        except Exception as e:
+            session.rollback()
+            skipped += len(chunk)
+            errors.append({"file": f"{sources[0]} … {sources[-1]}", "error": str(e)})
+            return
+        imported += n
+        skipped += len(chunk) - n
+
+    for source, content in records:
+        if isinstance(content, Exception):
+            skipped += 1
+            errors.append({"file": source, "error": str(content)})
+            continue
+        try:
+            if not isinstance(content, dict):
+                raise ValueError("Objet JSON attendu")
+            uid = content.get('tag_uid')
+            if not uid or uid in seen:
+                skipped += 1
+                continue
+            row = tag_dump_to_row(content)
+        except Exception as e:
+            skipped += 1
+            errors.append({"file": source, "error": str(e)})
+            continue
+
+        seen.add(uid)
+        chunk.append(row)
+        sources.append(source)
+        if len(chunk) >= chunk_size:
+            flush()
+            chunk, sources = [], []
+
+    if chunk:
+        flush()
+
+    return {"imported": imported, "skipped": skipped, "errors": errors}
+
+def ams_units_to_payloads(ams_units: list, printer_serial: Optional[str] = None) -> list:
+    """
+    Convertit la liste print.ams.ams d'un rapport Bambu en payloads filament (trays tagués uniquement).
+    printer_serial: imprimante d'origine, enregistrée sur la bobine si connue.
+    """
+    payloads = []
+    for sensor in ams_units:
+        sid = sensor.get("id")
+        for tray in sensor.get("tray", []):
+            if not tray.get("tag_uid"):
+                continue
+            payload = tray_to_filament_dict(sid, tray)
+            if printer_serial:
+                payload["printer_serial"] = printer_serial
+            payloads.append(payload)
+    return payloads
+
+def sync_ams_units(session, ams_units: list, printer_serial: Optional[str] = None) -> int:
+    """
+    Applique la liste print.ams.ams d'un rapport Bambu: un upsert par tray tagué.
+    Utilisé par /api/ams/sync (le worker d'ingestion MQTT appelle bulk_upsert_filaments directement).
+    """
+    payloads = ams_units_to_payloads(ams_units, printer_serial)
+    bulk_upsert_filaments(session, payloads)
+    return len(payloads)
 
 CONFIG_FILE = Path("./config/mqtt.json")
-CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
 
 def load_config() -> Optional[Dict[str, Any]]:
     if CONFIG_FILE.exists():
@@ -115,9 +409,41 @@ def load_config() -> Optional[Dict[str, Any]]:
     return None
 
 def save_config(cfg: Dict[str, Any]) -> None:
+    # Dossier créé à la première sauvegarde (pas à l'import du module)
+    CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
     CONFIG_FILE.write_text(json.dumps(cfg, indent=2), encoding="utf-8")
 
+def config_printers(cfg: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Imprimantes d'une config: {"printers": [...]} ou, ancien format, un seul objet imprimante."""
+    if not cfg:
+        return []
+    if "printers" in cfg:
+        return list(cfg.get("printers") or [])
+    return [cfg]
+
 def validate_cfg(payload: Dict[str, Any]) -> Optional[str]:
+    """Valide une imprimante ou une config multi-imprimantes ({"printers": [...]}) et complète les défauts."""
+    if "printers" not in payload:
+        return _validate_printer_cfg(payload)
+    printers = payload.get("printers")
+    if not isinstance(printers, list):
+        return "printers doit être une liste"
+    serials = set()
+    for i, printer in enumerate(printers):
+        if not isinstance(printer, dict):
+            return f"printers[{i}]: objet attendu"
+        err = _validate_printer_cfg(printer)
+        if err:
+            return f"printers[{i}]: {err}"
+        if len(printers) > 1 and not printer["serial"]:
+            # Le numéro de série identifie la session (et le topic device/<serial>/report)
+            return f"printers[{i}]: Champ manquant: serial"
+        if printer["serial"] in serials:
+            return f"printers[{i}]: serial en double ({printer['serial']})"
+        serials.add(printer["serial"])
+    return None
+
+def _validate_printer_cfg(payload: Dict[str, Any]) -> Optional[str]:
     required = ["ip", "password"]
     for k in required:
         if not payload.get(k):
@@ -154,7 +480,7 @@ _STR_FIELDS = {
     "uid", "tray_uid", "tag_manufacturer",
     "filament_type", "filament_detailed_type",
     "color_code", "extra_color_info",
-    "xcam_info", "short_date", "last_sync_source"
+    "xcam_info", "short_date", "last_sync_source", "printer_serial"
 }
 
 _ALLOWED = set(_NUMERIC_FIELDS) | _DATETIME_FIELDS | _STR_FIELDS
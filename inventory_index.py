@@ -0,0 +1,110 @@
+# backend/inventory_index.py
+import os
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+
+from models import Filament, get_inventory_version, _normalize_material
+from colorspace import hex_to_rgb, rgb_to_lab_array
+
+# Écart de couleur max (CIE76) pour proposer une bobine, et nombre de candidats par slot
+MATCH_MAX_DELTA_E = float(os.getenv("INVENTORY_MATCH_MAX_DELTA_E", "10"))
+MATCH_LIMIT = int(os.getenv("INVENTORY_MATCH_LIMIT", "5"))
+
+_SPOOL_FIELDS = ("id", "uid", "filament_type", "filament_detailed_type",
+                 "color_code", "color_name", "remaining_grams")
+
+
+class InventoryIndex:
+    """
+    Index mémoire des bobines en stock, par matériau normalisé (cf. models._normalize_material),
+    avec les couleurs pré-converties en un tableau Lab (n, 3) par matériau (NaN pour une bobine sans
+    couleur). Reconstruit uniquement quand la version d'inventaire change.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._by_material: Dict[str, Tuple[List[dict], np.ndarray]] = {}
+
+    def refresh(self, session) -> None:
+        version = get_inventory_version(session)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            rows = (
+                session.query(*[getattr(Filament, f) for f in _SPOOL_FIELDS])
+                .filter((Filament.remaining_grams.is_(None)) | (Filament.remaining_grams > 0))
+                .all()
+            )
+            grouped: Dict[str, List[dict]] = {}
+            for row in rows:
+                spool = dict(zip(_SPOOL_FIELDS, row))
+                keys = {_normalize_material(spool["filament_detailed_type"]),
+                        _normalize_material(spool["filament_type"])}
+                for key in keys - {""}:
+                    grouped.setdefault(key, []).append(spool)
+            self._by_material = {key: (spools, self._labs(spools)) for key, spools in grouped.items()}
+            self._version = version
+
+    @staticmethod
+    def _labs(spools: List[dict]) -> np.ndarray:
+        rgbs = [hex_to_rgb(s["color_code"]) for s in spools]
+        labs = np.full((len(spools), 3), np.nan)
+        colored = [i for i, rgb in enumerate(rgbs) if rgb is not None]
+        if colored:
+            labs[colored] = rgb_to_lab_array(np.array([rgbs[i] for i in colored], dtype=np.uint8))
+        return labs
+
+    def _spools_for(self, material: Optional[str]) -> Tuple[List[dict], Optional[np.ndarray]]:
+        key = _normalize_material(material)
+        if key in self._by_material:
+            return self._by_material[key]
+        # "Generic ASA", "PLA Basic" sans sous-type en stock... → on retente mot par mot
+        for word in key.split():
+            if word in self._by_material:
+                return self._by_material[word]
+        return [], None
+
+    def candidates(self, material: Optional[str], color: Optional[str],
+                   limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Bobines du matériau dont la couleur est à moins de MATCH_MAX_DELTA_E, triées par grammes restants.
+        Si le slot a une couleur, les bobines sans couleur connue sont écartées.
+        """
+        spools, labs = self._spools_for(material)
+        if not spools:
+            return []
+        rgb = hex_to_rgb(color)
+        if rgb is None:
+            found = [(spool, None) for spool in spools]
+        else:
+            target = rgb_to_lab_array(np.array([rgb], dtype=np.uint8))[0]
+            dist = np.sqrt(((labs - target) ** 2).sum(axis=1))   # NaN (sans couleur) → jamais retenu
+            keep = np.flatnonzero(dist <= MATCH_MAX_DELTA_E)
+            found = [(spools[i], float(dist[i])) for i in keep]
+
+        found.sort(key=lambda x: (-(x[0]["remaining_grams"] or 0), x[1] if x[1] is not None else 1e9))
+        return [
+            {**{f: spool[f] for f in _SPOOL_FIELDS}, "delta_e": round(de, 1) if de is not None else None}
+            for spool, de in found[:limit or MATCH_LIMIT]
+        ]
+
+    def match_slots(self, session, materials: List[str], colors: List[str]) -> List[Dict[str, Any]]:
+        """Un résultat par slot filament du projet (slots numérotés à partir de 1 comme dans Bambu Studio)."""
+        self.refresh(session)
+        n = max(len(materials), len(colors))
+        out = []
+        for i in range(n):
+            material = materials[i] if i < len(materials) else None
+            color = colors[i] if i < len(colors) else None
+            out.append({
+                "slot": i + 1,
+                "material": material,
+                "color": color,
+                "candidates": self.candidates(material, color),
+            })
+        return out
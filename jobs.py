@@ -0,0 +1,140 @@
+# backend/jobs.py
+import os
+import re
+import time
+import uuid
+from concurrent.futures import Executor, Future, wait as wait_futures
+from pathlib import Path
+from typing import Optional, Dict, Any, Callable
+
+from leader import write_json_atomic, read_json
+
+# Durée (s) de conservation d'un job terminé avant purge
+JOB_TTL = float(os.getenv("JOB_TTL", "3600"))
+# Attente maximale (s) acceptée par GET /api/jobs/<id>?wait=
+JOB_WAIT_MAX = float(os.getenv("JOB_WAIT_MAX", "30"))
+# Intervalle (s) de relecture du fichier d'un job attendu
+WAIT_POLL_INTERVAL = 0.1
+
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """
+    État des tâches de fond dans un fichier JSON par job (data/jobs/<id>.json), pour qu'un job
+    lancé par un worker gunicorn puisse être suivi depuis n'importe quel autre.
+    Statuts: queued → running → done | error (ou lost si le process qui l'exécutait a disparu).
+    """
+
+    def __init__(self, directory: str, ttl: Optional[float] = None):
+        self.directory = Path(directory)
+        self.ttl = JOB_TTL if ttl is None else ttl
+        # Jobs exécutés par ce process: wait() suit le Future au lieu de relire le fichier
+        self._local: Dict[str, Future] = {}
+
+    def _path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.json"
+
+    def create(self, kind: str, **meta) -> Dict[str, Any]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.purge()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": "queued",
+            "pid": os.getpid(),
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            **meta,
+        }
+        write_json_atomic(self._path(job["id"]), job)
+        return job
+
+    def update(self, job_id: str, **fields) -> Optional[Dict[str, Any]]:
+        # Un job n'est écrit que par le process qui l'exécute: pas de verrou nécessaire
+        job = read_json(self._path(job_id))
+        if job is None:
+            return None
+        job.update(fields)
+        write_json_atomic(self._path(job_id), job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not _JOB_ID.match(job_id or ""):
+            return None
+        job = read_json(self._path(job_id))
+        if job and job["status"] in ("queued", "running") and not _pid_alive(job.get("pid")):
+            job = self.update(job_id, status="lost", finished_at=time.time(),
+                              error="Le worker qui exécutait ce job s'est arrêté")
+        return job
+
+    @staticmethod
+    def is_pending(job: Optional[Dict[str, Any]]) -> bool:
+        return job is not None and job["status"] in ("queued", "running")
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Relit le job jusqu'à ce qu'il soit terminé ou timeout écoulé (bloque le thread appelant)."""
+        future = self._local.get(job_id)
+        if future is not None:
+            wait_futures([future], timeout)
+            return self.get(job_id)
+        deadline = time.monotonic() + timeout
+        job = self.get(job_id)
+        while self.is_pending(job) and time.monotonic() < deadline:
+            time.sleep(WAIT_POLL_INTERVAL)
+            job = self.get(job_id)
+        return job
+
+    def submit(self, executor: Executor, kind: str, fn: Callable[..., Any], *args, **meta) -> Dict[str, Any]:
+        """Crée le job et exécute fn(*args) dans executor; le résultat (JSON) est stocké dans le job."""
+        job = self.create(kind, **meta)
+        job_id = job["id"]
+        future = executor.submit(self._run, job_id, fn, *args)
+        self._local[job_id] = future
+        future.add_done_callback(lambda _: self._local.pop(job_id, None))
+        return job
+
+    def _run(self, job_id: str, fn: Callable[..., Any], *args) -> None:
+        self.update(job_id, status="running", started_at=time.time())
+        try:
+            result = fn(*args)
+        except Exception as e:
+            self.update(job_id, status="error", error=str(e), error_type=type(e).__name__,
+                        finished_at=time.time())
+            print(f"[JOBS] {job_id} en erreur: {e}")
+            return
+        self.update(job_id, status="done", result=result, finished_at=time.time())
+
+    def purge(self) -> int:
+        """Supprime les jobs plus anciens que ttl."""
+        cutoff = time.time() - self.ttl
+        removed = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return 0
+        for entry in entries:
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
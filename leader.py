@@ -0,0 +1,173 @@
+# backend/leader.py
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Dict, Any, Callable
+
+try:
+    import fcntl
+except ImportError:  # Windows (dev): pas de flock → chaque process se considère propriétaire
+    fcntl = None
+
+# Fréquence (s) de la tentative de prise de leadership / publication du statut partagé
+LEADER_INTERVAL = float(os.getenv("MQTT_LEADER_INTERVAL", "5"))
+
+
+class FileLock:
+    """Verrou exclusif (flock), non bloquant par défaut. Libéré automatiquement par l'OS si le process meurt."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self, blocking: bool = False) -> bool:
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            self._fd = -1
+            return True
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        if self._fd >= 0:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            finally:
+                os.close(self._fd)
+        self._fd = None
+
+
+def write_json_atomic(path: Path, data: Dict[str, Any]) -> None:
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp.write_text(json.dumps(data, default=str), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def read_json(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+class MqttLeadership:
+    """
+    Élection d'un seul propriétaire de la session MQTT parmi les workers gunicorn.
+    Le leader (détenteur du verrou) démarre le client MQTT, recharge la config si le fichier change
+    et publie son statut dans un fichier partagé; les autres workers restent passifs et servent
+    /api/mqtt/status depuis ce fichier. Si le leader meurt, le verrou est libéré et un autre
+    worker prend le relais au tick suivant.
+    """
+
+    def __init__(self, manager, data_dir: str, config_file: Path,
+                 config_loader: Callable[[], Optional[Dict[str, Any]]],
+                 interval: Optional[float] = None):
+        self.manager = manager
+        self.config_file = Path(config_file)
+        self.config_loader = config_loader
+        self.interval = LEADER_INTERVAL if interval is None else interval
+        self.lock = FileLock(Path(data_dir) / "mqtt.lock")
+        self.status_file = Path(data_dir) / "mqtt_status.json"
+        self._config_mtime: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def is_leader(self) -> bool:
+        return self.lock.held
+
+    def start(self) -> None:
+        # Première tentative synchrone: le premier worker démarre MQTT sans attendre un tick
+        self._tick()
+        self._thread = threading.Thread(target=self._run, name="mqtt-leader", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.is_leader:
+            self.manager.stop()
+            self.lock.release()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self._tick()
+            except Exception as e:
+                print(f"[MQTT] Leader tick error: {e}")
+
+    def _tick(self) -> None:
+        if not self.is_leader:
+            if not self.lock.try_acquire():
+                return
+            print(f"[MQTT] Worker {os.getpid()} devient propriétaire de la session MQTT")
+
+        mtime = self._current_config_mtime()
+        if mtime != self._config_mtime:
+            self._config_mtime = mtime
+            self._apply_config()
+        self.publish_status()
+
+    def _current_config_mtime(self) -> Optional[int]:
+        try:
+            return self.config_file.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _apply_config(self) -> None:
+        cfg = self.config_loader()
+        if not cfg:
+            return
+        try:
+            self.manager.start(cfg)
+        except Exception as e:
+            self.manager.last_error = str(e)
+            print(f"[MQTT] Startup error: {e}")
+
+    def apply_now(self, cfg: Dict[str, Any]) -> bool:
+        """Appelé après sauvegarde de la config. Retourne False si un autre worker est propriétaire."""
+        if not self.is_leader:
+            return False
+        self._config_mtime = self._current_config_mtime()
+        self.manager.start(cfg)
+        self.publish_status()
+        return True
+
+    def publish_status(self) -> None:
+        snap = self.manager.status()
+        snap.update({"role": "leader", "leader_pid": os.getpid(), "updated_at": time.time()})
+        try:
+            write_json_atomic(self.status_file, snap)
+        except OSError as e:
+            print(f"[MQTT] Status publish failed: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        if self.is_leader:
+            snap = self.manager.status()
+            snap.update({"role": "leader", "leader_pid": os.getpid(), "updated_at": time.time()})
+            return snap
+        snap = read_json(self.status_file) or {
+            "connected": False, "last_error": None, "broker": None,
+            "useTLS": None, "serial": None, "printers": [], "connected_count": 0, "ingest": None,
+            "leader_pid": None, "updated_at": None,
+        }
+        snap["role"] = "follower"
+        return snap
@@ -0,0 +1,83 @@
+# backend/metrics.py
+import os
+import time
+
+from flask import Flask, request, g
+from prometheus_client import (
+    Counter, Histogram, CollectorRegistry, REGISTRY, generate_latest, CONTENT_TYPE_LATEST,
+)
+from prometheus_client import multiprocess
+
+# Sous gunicorn, gunicorn.conf.py définit PROMETHEUS_MULTIPROC_DIR avant le fork des workers:
+# chaque process écrit ses compteurs dans des fichiers mmap de ce dossier, et /metrics les agrège
+# (quel que soit le worker qui répond). Sans cette variable (python app.py): registre en mémoire.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+_BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+_UPLOAD_BUCKETS = (64 * 1024, 256 * 1024, 1 << 20, 4 << 20, 16 << 20, 64 << 20, 256 << 20)
+
+HTTP_LATENCY = Histogram(
+    "filament_http_request_duration_seconds", "Durée des requêtes HTTP par route",
+    ["method", "route", "status"],
+)
+MQTT_MESSAGES_BYTES = Histogram(
+    "filament_mqtt_message_bytes", "Taille des messages MQTT reçus (le _count donne le débit)",
+    ["serial"], buckets=_BYTES_BUCKETS,
+)
+MQTT_AMS_REPORTS = Counter(
+    "filament_mqtt_ams_reports_total", "Messages MQTT contenant un rapport AMS", ["serial"],
+)
+INGEST_LATENCY = Histogram(
+    "filament_ams_ingest_latency_seconds", "Délai réception MQTT → commit du plus ancien rapport du lot",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+UPSERTS = Counter(
+    "filament_upserts_total", "Lignes traitées par bulk_upsert_filaments", ["result"],
+)
+WRITE_LOCK_WAIT = Histogram(
+    "filament_db_write_lock_wait_seconds",
+    "Attente du verrou d'écriture (UPDATE inventory_state, première écriture de chaque transaction)",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+THREEMF_DURATION = Histogram(
+    "filament_3mf_analysis_seconds", "Durée d'une analyse 3MF, de la réception de l'upload au résultat (file comprise)",
+    ["cache"], buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+THREEMF_BYTES = Histogram(
+    "filament_3mf_upload_bytes", "Taille des fichiers 3MF analysés", buckets=_UPLOAD_BUCKETS,
+)
+THREEMF_REJECTED = Counter(
+    "filament_3mf_rejected_total", "Uploads 3MF refusés (queue_full = 429, too_large = 413)", ["reason"],
+)
+COLOR_LOOKUPS = Counter(
+    "filament_color_lookups_total", "Résolutions color_name (memo/exact/nearest = trouvé, miss = inconnu)",
+    ["result"],
+)
+
+
+def render() -> tuple:
+    """Exposition texte Prometheus: (corps, content-type)."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def init_app(app: Flask) -> None:
+    """Mesure la durée de chaque requête, étiquetée par la route (règle Flask, pas l'URL brute)."""
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+            HTTP_LATENCY.labels(request.method, rule, str(response.status_code)).observe(
+                time.perf_counter() - start
+            )
+        return response
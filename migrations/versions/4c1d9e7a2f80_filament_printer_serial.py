@@ -0,0 +1,27 @@
+"""filaments.printer_serial: imprimante de la dernière synchro AMS
+
+Revision ID: 4c1d9e7a2f80
+Revises: bb31031854dd
+Create Date: 2026-10-18 17:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c1d9e7a2f80'
+down_revision = 'bb31031854dd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('filaments', sa.Column('printer_serial', sa.String(), nullable=True))
+    op.create_index('ix_filaments_printer_serial', 'filaments', ['printer_serial'])
+
+
+def downgrade():
+    op.drop_index('ix_filaments_printer_serial', table_name='filaments')
+    with op.batch_alter_table('filaments') as batch_op:
+        batch_op.drop_column('printer_serial')
@@ -0,0 +1,70 @@
+"""baseline: filaments + inventory_state
+
+Revision ID: 69ee269eb10e
+Revises: 
+Create Date: 2026-10-18 14:30:00.000000
+
+Les bases créées avant Flask-Migrate (db.create_all) ont déjà ces tables:
+on ne crée que ce qui manque pour pouvoir les monter en version sans stamp manuel.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '69ee269eb10e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    tables = sa.inspect(op.get_bind()).get_table_names()
+
+    if 'filaments' not in tables:
+        op.create_table(
+            'filaments',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('uid', sa.String(), nullable=False),
+            sa.Column('tray_uid', sa.String(), nullable=True),
+            sa.Column('tag_manufacturer', sa.String(), nullable=True),
+            sa.Column('filament_type', sa.String(), nullable=True),
+            sa.Column('filament_detailed_type', sa.String(), nullable=True),
+            sa.Column('color_code', sa.String(), nullable=True),
+            sa.Column('color_name', sa.String(), nullable=True),
+            sa.Column('extra_color_info', sa.String(), nullable=True),
+            sa.Column('filament_diameter', sa.Float(), nullable=True),
+            sa.Column('spool_width', sa.Float(), nullable=True),
+            sa.Column('spool_weight', sa.Integer(), nullable=True),
+            sa.Column('filament_length', sa.Integer(), nullable=True),
+            sa.Column('print_temp_min', sa.Integer(), nullable=True),
+            sa.Column('print_temp_max', sa.Integer(), nullable=True),
+            sa.Column('dry_temp', sa.Integer(), nullable=True),
+            sa.Column('dry_time_hour', sa.Integer(), nullable=True),
+            sa.Column('dry_bed_temp', sa.Integer(), nullable=True),
+            sa.Column('nozzle_diameter', sa.Integer(), nullable=True),
+            sa.Column('xcam_info', sa.String(), nullable=True),
+            sa.Column('manufacture_datetime_utc', sa.DateTime(), nullable=True),
+            sa.Column('short_date', sa.String(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('remaining_percent', sa.Integer(), nullable=True),
+            sa.Column('remaining_grams', sa.Integer(), nullable=True),
+            sa.Column('remaining_length_mm', sa.Integer(), nullable=True),
+            sa.Column('last_sync_source', sa.String(), nullable=True),
+            sa.Column('last_sync_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('uid'),
+        )
+
+    if 'inventory_state' not in tables:
+        op.create_table(
+            'inventory_state',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('version', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+        )
+
+
+def downgrade():
+    op.drop_table('inventory_state')
+    op.drop_table('filaments')
@@ -0,0 +1,48 @@
+"""filaments.updated_version / updated_at + filament_tombstones (synchro différentielle)
+
+Revision ID: 7e3f0b6c5a12
+Revises: d2a7c35e91b4
+Create Date: 2026-10-18 19:00:00.000000
+
+Les lignes existantes reçoivent la version d'inventaire courante: un client qui
+n'a encore aucun jeton repart de since=0 (inventaire complet) de toute façon.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e3f0b6c5a12'
+down_revision = 'd2a7c35e91b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('filaments', sa.Column('updated_version', sa.Integer(), nullable=True))
+    op.add_column('filaments', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute(
+        "UPDATE filaments SET updated_version = "
+        "(SELECT coalesce(max(version), 0) FROM inventory_state), updated_at = created_at"
+    )
+    op.create_index('ix_filaments_updated_version', 'filaments', ['updated_version'])
+
+    op.create_table(
+        'filament_tombstones',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('filament_id', sa.Integer(), nullable=False),
+        sa.Column('uid', sa.String(), nullable=True),
+        sa.Column('deleted_version', sa.Integer(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_filament_tombstones_deleted_version', 'filament_tombstones', ['deleted_version'])
+
+
+def downgrade():
+    op.drop_index('ix_filament_tombstones_deleted_version', table_name='filament_tombstones')
+    op.drop_table('filament_tombstones')
+    op.drop_index('ix_filaments_updated_version', table_name='filaments')
+    with op.batch_alter_table('filaments') as batch_op:
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('updated_version')
@@ -0,0 +1,26 @@
+"""inventory_state.sync_horizon (purge des filament_tombstones)
+
+Revision ID: a91c4e6d27b3
+Revises: 7e3f0b6c5a12
+Create Date: 2026-10-18 21:00:00.000000
+
+0 = aucun tombstone purgé: tous les jetons since existants restent valides.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a91c4e6d27b3'
+down_revision = '7e3f0b6c5a12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('inventory_state', sa.Column('sync_horizon', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('inventory_state') as batch_op:
+        batch_op.drop_column('sync_horizon')
@@ -0,0 +1,59 @@
+"""historique de consommation: journal brut + agrégats horaires/journaliers
+
+Revision ID: bb31031854dd
+Revises: ef065cbdd262
+Create Date: 2026-10-18 16:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bb31031854dd'
+down_revision = 'ef065cbdd262'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'consumption_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('filament_id', sa.Integer(), nullable=False),
+        sa.Column('material', sa.String(), nullable=True),
+        sa.Column('recorded_at', sa.DateTime(), nullable=False),
+        sa.Column('grams_before', sa.Integer(), nullable=False),
+        sa.Column('grams_after', sa.Integer(), nullable=False),
+        sa.Column('source', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_consumption_events_filament_time', 'consumption_events', ['filament_id', 'recorded_at'])
+    op.create_index('ix_consumption_events_time', 'consumption_events', ['recorded_at'])
+
+    op.create_table(
+        'consumption_rollups',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('bucket_seconds', sa.Integer(), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('filament_id', sa.Integer(), nullable=False),
+        sa.Column('material', sa.String(), nullable=True),
+        sa.Column('consumed_grams', sa.Integer(), nullable=False),
+        sa.Column('refilled_grams', sa.Integer(), nullable=False),
+        sa.Column('samples', sa.Integer(), nullable=False),
+        sa.Column('last_grams', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('bucket_seconds', 'filament_id', 'bucket_start', name='uq_consumption_rollups_bucket'),
+    )
+    op.create_index('ix_consumption_rollups_material', 'consumption_rollups',
+                    ['bucket_seconds', 'material', 'bucket_start'])
+    op.create_index('ix_consumption_rollups_time', 'consumption_rollups', ['bucket_seconds', 'bucket_start'])
+
+
+def downgrade():
+    op.drop_index('ix_consumption_rollups_time', table_name='consumption_rollups')
+    op.drop_index('ix_consumption_rollups_material', table_name='consumption_rollups')
+    op.drop_table('consumption_rollups')
+    op.drop_index('ix_consumption_events_time', table_name='consumption_events')
+    op.drop_index('ix_consumption_events_filament_time', table_name='consumption_events')
+    op.drop_table('consumption_events')
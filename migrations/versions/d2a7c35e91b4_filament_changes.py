@@ -0,0 +1,37 @@
+"""journal des modifications de filaments (flux SSE /api/events)
+
+Revision ID: d2a7c35e91b4
+Revises: 4c1d9e7a2f80
+Create Date: 2026-10-18 18:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a7c35e91b4'
+down_revision = '4c1d9e7a2f80'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # sqlite_autoincrement: les id (= id d'événement SSE) ne sont jamais réutilisés après purge
+    op.create_table(
+        'filament_changes',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('filament_id', sa.Integer(), nullable=True),
+        sa.Column('uid', sa.String(), nullable=True),
+        sa.Column('op', sa.String(), nullable=False),
+        sa.Column('fields', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sqlite_autoincrement=True,
+    )
+    op.create_index('ix_filament_changes_created_at', 'filament_changes', ['created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_filament_changes_created_at', table_name='filament_changes')
+    op.drop_table('filament_changes')
@@ -0,0 +1,46 @@
+"""index tray_uid + index d'expressions du listing
+
+Revision ID: ef065cbdd262
+Revises: 69ee269eb10e
+Create Date: 2026-10-18 14:35:00.000000
+
+Les expressions doivent rester identiques à models.listing_order(),
+sinon SQLite ne peut plus utiliser l'index pour l'ORDER BY.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ef065cbdd262'
+down_revision = '69ee269eb10e'
+branch_labels = None
+depends_on = None
+
+
+def _listing_exprs():
+    c = sa.column
+    missing = sa.literal_column("'zzzz'")
+    weight_key = sa.func.coalesce(
+        sa.cast(c('remaining_grams'), sa.Float),
+        sa.cast(c('spool_weight'), sa.Float),
+        sa.literal_column("1e12"),
+    )
+    return [
+        sa.func.lower(sa.func.coalesce(c('filament_type'), missing)),
+        sa.func.lower(sa.func.coalesce(c('filament_detailed_type'), missing)),
+        sa.func.lower(sa.func.coalesce(c('color_name'), missing)),
+        sa.func.lower(sa.func.coalesce(c('color_code'), missing)),
+        weight_key.desc(),
+    ]
+
+
+def upgrade():
+    # if_not_exists: les bases créées par db.create_all() ont déjà ces index
+    op.create_index('ix_filaments_tray_uid', 'filaments', ['tray_uid'], if_not_exists=True)
+    op.create_index('ix_filaments_listing', 'filaments', _listing_exprs(), if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_filaments_listing', table_name='filaments')
+    op.drop_index('ix_filaments_tray_uid', table_name='filaments')
@@ -1,65 +1,26 @@
-import os, json
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from sqlalchemy import event
+from palette import PaletteStore, _normalize_hex, _normalize_material
+from metrics import WRITE_LOCK_WAIT
+from sqlalchemy import event, select, update, insert, delete, func, cast, Float, literal_column, bindparam
+import json
+import time
+from sqlalchemy import inspect as sa_inspect
 
 db = SQLAlchemy()
 
-# --------- Chargement du mapping matériau + hex -> nom marketing ---------
-def _normalize_hex(h: str | None) -> str | None:
-    if not h:
-        return None
-    s = h.strip().upper()
-    if not s.startswith("#"):
-        s = "#" + s
-    # #RGB -> #RRGGBB
-    if len(s) == 4 and all(c in "0123456789ABCDEF" for c in s[1:]):
-        s = "#" + "".join([c * 2 for c in s[1:]])
-    # force #RRGGBB
-    if len(s) == 7:
-        return s
-    # RRGGBB -> #RRGGBB
-    if len(s) == 6:
-        return "#" + s
-    return None
-
-def _normalize_material(m: str | None) -> str:
-    return (m or "").strip().upper()
-
-def _load_color_map() -> dict[tuple[str, str], str]:
-    # 1) prend la var d'env si dispo
-    path = os.environ.get("FILAMENT_COLOR_JSON")
-    # 2) sinon fallback vers ./data/filaments_min.json
-    if not path:
-        base_dir = os.path.abspath(os.path.dirname(__file__))
-        path = os.path.join(base_dir, "data", "filaments_min.json")
-
-    cmap: dict[tuple[str, str], str] = {}
-    try:
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            for row in data:
-                mat = _normalize_material(row.get("material"))
-                hx = _normalize_hex(row.get("hex"))
-                name = (row.get("name") or "").strip()
-                if mat and hx and name:
-                    cmap[(mat, hx)] = name
-    except Exception:
-        cmap = {}
-    return cmap
-
-
-COLOR_MAP = _load_color_map()
+# --------- Mapping matériau + hex -> nom marketing (voir palette.py) ---------
+# Chargé au premier usage et rechargé automatiquement si FILAMENT_COLOR_JSON change
+COLOR_PALETTE = PaletteStore()
 
 def resolve_color_name(material: str | None, hex_code: str | None) -> str | None:
     if not hex_code:
         return None
-    mat = _normalize_material(material)
-    hx = _normalize_hex(hex_code)
-    if not hx:
-        return None
-    return COLOR_MAP.get((mat, hx))
+    return COLOR_PALETTE.get().resolve(material, hex_code)
+
+def resolve_color_names(pairs: list) -> list:
+    """Version lot de resolve_color_name: [(matériau, hex), ...] → [nom | None, ...]."""
+    return COLOR_PALETTE.get().resolve_many(pairs)
 
 
 class Filament(db.Model):
@@ -67,7 +28,7 @@ class Filament(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     uid = db.Column(db.String, unique=True, nullable=False)           # Block 0
-    tray_uid = db.Column(db.String)                                   # Block 9
+    tray_uid = db.Column(db.String, index=True)                       # Block 9 (clé de fallback AMS)
     tag_manufacturer = db.Column(db.String)                           # Block 0
 
     filament_type = db.Column(db.String)                              # Block 2
@@ -102,6 +63,11 @@ class Filament(db.Model):
     remaining_length_mm = db.Column(db.Integer)       # calculé: total_len * remain / 100
     last_sync_source = db.Column(db.String)           # "ams"
     last_sync_at = db.Column(db.DateTime)
+    printer_serial = db.Column(db.String, index=True)  # imprimante de la dernière synchro AMS
+
+    # Version d'inventaire (InventoryState) de la dernière écriture: /api/filaments/changes?since=
+    updated_version = db.Column(db.Integer, index=True)
+    updated_at = db.Column(db.DateTime)
 
     def to_dict(self):
         result = {}
@@ -114,6 +80,176 @@ class Filament(db.Model):
         return result
 
 
+# --------- Ordre du listing ---------
+# Constantes littérales (pas de paramètres liés) pour que SQLite puisse faire
+# correspondre l'ORDER BY à l'index d'expressions ix_filaments_listing.
+_SORT_MISSING = literal_column("'zzzz'")
+
+def listing_sort_keys():
+    """Clés de tri du listing: matériau → sous-type → nom couleur → hex → poids."""
+    # Poids réel si dispo, sinon poids bobine; cast au cas où la colonne est TEXT
+    weight_key = func.coalesce(
+        cast(Filament.remaining_grams, Float),
+        cast(Filament.spool_weight, Float),
+        literal_column("1e12"),
+    )
+    return (
+        func.lower(func.coalesce(Filament.filament_type, _SORT_MISSING)),
+        func.lower(func.coalesce(Filament.filament_detailed_type, _SORT_MISSING)),
+        func.lower(func.coalesce(Filament.color_name, _SORT_MISSING)),
+        func.lower(func.coalesce(Filament.color_code, _SORT_MISSING)),
+        weight_key,
+    )
+
+def listing_order():
+    """ORDER BY du listing: poids décroissant (inconnus à la fin), le reste croissant."""
+    *keys, weight_key = listing_sort_keys()
+    return (*keys, weight_key.desc())
+
+db.Index("ix_filaments_listing", *listing_order())
+
+
+class InventoryState(db.Model):
+    """Ligne unique (id=1): version d'inventaire incrémentée à chaque écriture sur filaments."""
+    __tablename__ = 'inventory_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # Plus haute version dont les tombstones ont été purgés: un since antérieur exige une resynchro complète
+    sync_horizon = db.Column(db.Integer, nullable=False, default=0)
+
+
+# --------- Historique de consommation (voir consumption.py) ---------
+class ConsumptionEvent(db.Model):
+    """Journal brut, append-only: une ligne par variation réelle de remaining_grams d'une bobine."""
+    __tablename__ = 'consumption_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    filament_id = db.Column(db.Integer, nullable=False)
+    material = db.Column(db.String)                   # sous-type, sinon type (au moment de la mesure)
+    recorded_at = db.Column(db.DateTime, nullable=False)
+    grams_before = db.Column(db.Integer, nullable=False)
+    grams_after = db.Column(db.Integer, nullable=False)
+    source = db.Column(db.String)                     # last_sync_source ("ams"...)
+
+    __table_args__ = (
+        db.Index("ix_consumption_events_filament_time", "filament_id", "recorded_at"),
+        db.Index("ix_consumption_events_time", "recorded_at"),
+    )
+
+
+class ConsumptionRollup(db.Model):
+    """Agrégats pré-calculés par bobine et par bucket (bucket_seconds = 3600 ou 86400)."""
+    __tablename__ = 'consumption_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    bucket_seconds = db.Column(db.Integer, nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    filament_id = db.Column(db.Integer, nullable=False)
+    material = db.Column(db.String)
+    consumed_grams = db.Column(db.Integer, nullable=False, default=0)   # somme des baisses
+    refilled_grams = db.Column(db.Integer, nullable=False, default=0)   # somme des hausses (recalibrage...)
+    samples = db.Column(db.Integer, nullable=False, default=0)
+    last_grams = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.UniqueConstraint("bucket_seconds", "filament_id", "bucket_start", name="uq_consumption_rollups_bucket"),
+        db.Index("ix_consumption_rollups_material", "bucket_seconds", "material", "bucket_start"),
+        db.Index("ix_consumption_rollups_time", "bucket_seconds", "bucket_start"),
+    )
+
+
+class FilamentTombstone(db.Model):
+    """Trace d'une bobine supprimée, pour que les clients en synchro différentielle la retirent."""
+    __tablename__ = 'filament_tombstones'
+
+    id = db.Column(db.Integer, primary_key=True)
+    filament_id = db.Column(db.Integer, nullable=False)
+    uid = db.Column(db.String)
+    deleted_version = db.Column(db.Integer, nullable=False, index=True)
+    deleted_at = db.Column(db.DateTime, nullable=False)
+
+
+# --------- Journal des modifications (flux SSE /api/events, voir events.py) ---------
+class FilamentChange(db.Model):
+    """
+    Une ligne par bobine insérée / modifiée / supprimée, écrite dans la transaction de l'écriture.
+    id = identifiant d'événement SSE (croissant, jamais réutilisé). op "reload": écriture en masse,
+    les clients doivent recharger le listing.
+    """
+    __tablename__ = 'filament_changes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    filament_id = db.Column(db.Integer)
+    uid = db.Column(db.String)
+    op = db.Column(db.String, nullable=False)          # insert | update | delete | reload
+    fields = db.Column(db.Text)                        # JSON: champs modifiés → nouvelle valeur
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+def _change_value(value):
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return value
+
+def change_row(op: str, filament_id=None, uid=None, fields: dict | None = None) -> dict:
+    return {
+        "op": op,
+        "filament_id": filament_id,
+        "uid": uid,
+        "fields": json.dumps({k: _change_value(v) for k, v in fields.items()}) if fields is not None else None,
+        "created_at": datetime.utcnow(),
+    }
+
+def record_filament_changes(conn, rows: list) -> None:
+    """conn: Session ou Connection; rows: voir change_row(). Dans la transaction courante."""
+    if rows:
+        conn.execute(insert(FilamentChange.__table__), rows)
+
+
+def get_inventory_version(conn) -> int:
+    """conn: Session ou Connection. Stockée en base pour rester cohérente entre workers gunicorn."""
+    t = InventoryState.__table__
+    return conn.execute(select(t.c.version).where(t.c.id == 1)).scalar() or 0
+
+def bump_inventory_version(conn) -> int:
+    """Incrémente la version dans la transaction courante (donc atomique avec l'écriture) et la retourne."""
+    t = InventoryState.__table__
+    # Première écriture de la transaction: sa durée = attente du verrou d'écriture (SQLite) / de la ligne (PostgreSQL)
+    start = time.perf_counter()
+    res = conn.execute(update(t).where(t.c.id == 1).values(version=t.c.version + 1))
+    WRITE_LOCK_WAIT.observe(time.perf_counter() - start)
+    if res.rowcount == 0:
+        conn.execute(insert(t).values(id=1, version=1))
+        return 1
+    return get_inventory_version(conn)
+
+def get_sync_horizon(conn) -> int:
+    t = InventoryState.__table__
+    return conn.execute(select(t.c.sync_horizon).where(t.c.id == 1)).scalar() or 0
+
+def purge_tombstones(conn, cutoff: datetime) -> int:
+    """
+    Supprime les tombstones antérieurs à cutoff et remonte sync_horizon à la plus haute version
+    purgée, dans la transaction courante. Retourne le nombre de lignes supprimées.
+    """
+    t = FilamentTombstone.__table__
+    horizon = conn.execute(select(func.max(t.c.deleted_version)).where(t.c.deleted_at < cutoff)).scalar()
+    if horizon is None:
+        return 0
+    n = conn.execute(delete(t).where(t.c.deleted_version <= horizon)).rowcount
+    s = InventoryState.__table__
+    conn.execute(update(s).where(s.c.id == 1).where(s.c.sync_horizon < horizon).values(sync_horizon=horizon))
+    return n
+
+def ensure_inventory_state(session) -> None:
+    if session.get(InventoryState, 1) is None:
+        session.add(InventoryState(id=1, version=0))
+        session.commit()
+
+
 # --------- Events: assignation auto du color_name ---------
 def _apply_color_name(target: Filament):
     material = target.filament_detailed_type or target.filament_type
@@ -123,6 +259,92 @@ def _apply_color_name(target: Filament):
 def filament_before_insert(mapper, connection, target: Filament):
     _apply_color_name(target)
 
+# Seuls ces champs influencent color_name: les mises à jour AMS (remain...) ne le recalculent pas
+_COLOR_INPUTS = ("color_code", "filament_type", "filament_detailed_type")
+
 @event.listens_for(Filament, "before_update")
 def filament_before_update(mapper, connection, target: Filament):
-    _apply_color_name(target)
+    attrs = sa_inspect(target).attrs
+    if any(attrs[name].history.has_changes() for name in _COLOR_INPUTS):
+        _apply_color_name(target)
+
+
+def backfill_color_names(session) -> dict:
+    """
+    Recalcule color_name pour toute la table (ex: après mise à jour de filaments_min.json).
+    Une résolution par combinaison (sous-type, type, hex) distincte, puis un UPDATE ensembliste
+    par combinaison dont le nom change.
+    """
+    t = Filament.__table__
+    combos = session.execute(
+        select(t.c.filament_detailed_type, t.c.filament_type, t.c.color_code, t.c.color_name).distinct()
+    ).all()
+    names = resolve_color_names([(detailed or ftype, code) for detailed, ftype, code, _ in combos])
+    params = [
+        {"b_detailed": detailed, "b_type": ftype, "b_code": code, "b_old": old, "b_name": name}
+        for (detailed, ftype, code, old), name in zip(combos, names)
+        if name != old
+    ]
+    rows = 0
+    if params:
+        stmt = (
+            update(t)
+            .where(t.c.filament_detailed_type.is_not_distinct_from(bindparam("b_detailed")))
+            .where(t.c.filament_type.is_not_distinct_from(bindparam("b_type")))
+            .where(t.c.color_code.is_not_distinct_from(bindparam("b_code")))
+            .where(t.c.color_name.is_not_distinct_from(bindparam("b_old")))
+            .values(color_name=bindparam("b_name"), updated_version=bindparam("b_version"),
+                    updated_at=bindparam("b_at"))
+        )
+        version = bump_inventory_version(session.connection())
+        now = datetime.utcnow()
+        for p in params:
+            p.update(b_version=version, b_at=now)
+        rows = session.execute(stmt, params).rowcount
+        record_filament_changes(session, [change_row("reload", fields={"reason": "color_names", "rows": rows})])
+    session.commit()
+    return {"combinations": len(combos), "combinations_changed": len(params), "rows_updated": rows}
+
+
+# --------- Events: version d'inventaire sur toute écriture ORM ---------
+@event.listens_for(db.session, "before_flush")
+def bump_version_before_flush(session, flush_context, instances):
+    new = [o for o in session.new if isinstance(o, Filament)]
+    dirty = [o for o in session.dirty if isinstance(o, Filament) and session.is_modified(o)]
+    deleted = [o for o in session.deleted if isinstance(o, Filament)]
+    if not (new or dirty or deleted):
+        return
+    conn = session.connection()
+    version = bump_inventory_version(conn)
+    now = datetime.utcnow()
+    for o in new + dirty:
+        o.updated_version = version
+        o.updated_at = now
+    if deleted:
+        conn.execute(insert(FilamentTombstone.__table__), [
+            {"filament_id": o.id, "uid": o.uid, "deleted_version": version, "deleted_at": now}
+            for o in deleted
+        ])
+
+
+# --------- Events: journal des modifications pour toute écriture ORM (routes CRUD) ---------
+@event.listens_for(db.session, "after_flush")
+def record_changes_after_flush(session, flush_context):
+    rows = []
+    for o in session.new:
+        if isinstance(o, Filament):
+            fields = {c.key: getattr(o, c.key) for c in Filament.__table__.columns if c.key != "id"}
+            rows.append(change_row("insert", o.id, o.uid, fields))
+    for o in session.dirty:
+        if isinstance(o, Filament) and session.is_modified(o):
+            attrs = sa_inspect(o).attrs
+            fields = {
+                c.key: getattr(o, c.key) for c in Filament.__table__.columns
+                if attrs[c.key].history.has_changes()
+            }
+            if fields:
+                rows.append(change_row("update", o.id, o.uid, fields))
+    for o in session.deleted:
+        if isinstance(o, Filament):
+            rows.append(change_row("delete", o.id, o.uid))
+    record_filament_changes(session.connection(), rows)
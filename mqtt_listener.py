@@ -1,25 +1,79 @@
 #!/usr/bin/env python3
+import os
 import ssl
 import json
 import time
+import random
 import threading
-import os
-from typing import Optional, Dict, Any
+from collections import deque
+from typing import Optional, Dict, Any, List
 from paho.mqtt import client as mqtt
-import requests
 
-# Permet de configurer l’URL de sync via une variable d’environnement
-API_PREFIX = os.getenv("API_PREFIX", "/api")
-SYNC_URL = os.getenv("SYNC_URL", f"http://localhost:5000{API_PREFIX}/ams/sync")
+from helper import config_printers
+from metrics import MQTT_MESSAGES_BYTES, MQTT_AMS_REPORTS
 
+# Fenêtre (s) du calcul de débit de messages par imprimante
+RATE_WINDOW = 60.0
+# Backoff exponentiel (avec jitter) entre deux tentatives de connexion, en secondes
+BACKOFF_MIN = float(os.getenv("MQTT_BACKOFF_MIN", "1"))
+BACKOFF_MAX = float(os.getenv("MQTT_BACKOFF_MAX", "60"))
+# Timeout (s) de l'établissement TCP/TLS, exécuté hors des threads de requête
+CONNECT_TIMEOUT = float(os.getenv("MQTT_CONNECT_TIMEOUT", "5"))
 
-class MqttManager:
-    def __init__(self):
+
+def backoff_delay(attempt: int) -> float:
+    """Délai avant la tentative suivante: exponentiel plafonné, tiré entre 50 et 100 % (jitter)."""
+    delay = min(BACKOFF_MAX, BACKOFF_MIN * (2 ** min(attempt, 16)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def broker_port(cfg: Dict[str, Any]) -> int:
+    return cfg["portTLS"] if cfg.get("useTLS", True) else cfg.get("portPlain", 1883)
+
+
+def build_client(cfg: Dict[str, Any]) -> mqtt.Client:
+    serial = cfg.get("serial") or "bambu-client"
+    c = mqtt.Client(client_id=serial, protocol=mqtt.MQTTv311)
+    c.connect_timeout = CONNECT_TIMEOUT
+    # En LAN Bambu : username "bblp", password = LAN code
+    c.username_pw_set("bblp", cfg["password"])
+
+    if cfg.get("useTLS", True):
+        c.tls_set(cert_reqs=ssl.CERT_NONE, tls_version=ssl.PROTOCOL_TLSv1_2)
+        c.tls_insecure_set(True)
+    return c
+
+
+class PrinterSession:
+    """
+    Connexion MQTT à une imprimante Bambu, avec son propre état de connexion et ses compteurs.
+    Un thread superviseur par session établit la connexion (connect_async + reconnect), fait tourner
+    la boucle réseau et réessaie avec backoff exponentiel + jitter: start() ne bloque jamais.
+    """
+
+    def __init__(self, cfg: Dict[str, Any], ingest=None):
+        self.cfg = cfg
+        self.serial: str = cfg.get("serial") or ""
+        self.ingest = ingest
         self.client: Optional[mqtt.Client] = None
-        self.cfg: Optional[Dict[str, Any]] = None
         self.lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+        self.state = "stopped"           # connecting | connected | backoff | stopped
         self.connected: bool = False
         self.last_error: Optional[str] = None
+        self.attempts = 0                # tentatives consécutives sans connexion réussie
+        self.next_retry_at: Optional[float] = None
+        self.connects = 0
+        self.disconnects = 0
+        self.connected_since: Optional[float] = None
+
+        self.messages = 0
+        self.ams_reports = 0
+        self.bytes_in = 0
+        self.last_message_at: Optional[float] = None
+        self._recent: deque = deque()
 
     # ---------- Callbacks ----------
     def _on_connect(self, client, userdata, flags, rc):
@@ -27,8 +81,13 @@ class MqttManager:
         if not self.connected:
             self.last_error = f"rc={rc}"
             return
+        self.state = "connected"
+        self.attempts = 0
+        self.last_error = None
+        self.connects += 1
+        self.connected_since = time.time()
 
-        serial = (self.cfg or {}).get("serial") or "bambu"
+        serial = self.serial or "bambu"
         rep_topic = f"device/{serial}/report"
         req_topic = f"device/{serial}/request"
         client.subscribe(rep_topic)
@@ -39,15 +98,26 @@ class MqttManager:
                 "sequence_id": str(int(time.time())),
                 "command": "pushall",
             },
-            "user_id": (self.cfg or {}).get("password", ""),
+            "user_id": self.cfg.get("password", ""),
         }
         client.publish(req_topic, json.dumps(payload), qos=1)
 
     def _on_disconnect(self, client, userdata, rc):
         self.connected = False
+        self.connected_since = None
+        self.disconnects += 1
         self.last_error = f"disconnect rc={rc}"
 
     def _on_message(self, client, userdata, msg):
+        now = time.time()
+        self.messages += 1
+        self.bytes_in += len(msg.payload)
+        MQTT_MESSAGES_BYTES.labels(self.serial).observe(len(msg.payload))
+        self.last_message_at = now
+        self._recent.append(now)
+        while self._recent and self._recent[0] < now - RATE_WINDOW:
+            self._recent.popleft()
+
         try:
             data = json.loads(msg.payload.decode(errors="replace"))
         except Exception:
@@ -57,65 +127,161 @@ class MqttManager:
         ams_list = data.get("print", {}).get("ams", {}).get("ams", [])
         if not ams_list:
             return
+        self.ams_reports += 1
+        MQTT_AMS_REPORTS.labels(self.serial).inc()
 
-        # → Forward au backend interne (endpoint Flask /api/ams/sync)
-        try:
-            requests.post(SYNC_URL, json=data, timeout=5)
-        except Exception as e:
-            self.last_error = f"/ams/sync: {e}"
+        # → File d'ingestion partagée: ne bloque jamais le thread réseau paho
+        if self.ingest is not None:
+            self.ingest.submit(ams_list, serial=self.serial)
 
-    # ---------- Construction client ----------
-    def _build_client(self, cfg: Dict[str, Any]) -> mqtt.Client:
-        serial = cfg.get("serial") or "bambu-client"
-        c = mqtt.Client(client_id=serial, protocol=mqtt.MQTTv311)
-        # En LAN Bambu : username "bblp", password = LAN code
-        c.username_pw_set("bblp", cfg["password"])
-
-        if cfg.get("useTLS", True):
-            c.tls_set(cert_reqs=ssl.CERT_NONE, tls_version=ssl.PROTOCOL_TLSv1_2)
-            c.tls_insecure_set(True)
+    # ---------- Cycle de vie ----------
+    def start(self) -> None:
+        """Non bloquant: la connexion est établie par le thread superviseur. Une session ne sert qu'une fois."""
+        with self.lock:
+            if self._thread is not None or self._stopping.is_set():
+                return
+            c = build_client(self.cfg)
+            c.on_connect = self._on_connect
+            c.on_disconnect = self._on_disconnect
+            c.on_message = self._on_message
+            c.connect_async(self.cfg["ip"], broker_port(self.cfg), keepalive=60)
+            self.client = c
+            self.state = "connecting"
+            self._thread = threading.Thread(
+                target=self._supervise, args=(c, self._stopping),
+                name=f"mqtt-{self.serial or self.cfg['ip']}", daemon=True,
+            )
+            self._thread.start()
 
-        c.on_connect = self._on_connect
-        c.on_disconnect = self._on_disconnect
-        c.on_message = self._on_message
-        return c
+    def _supervise(self, client: mqtt.Client, stopping: threading.Event) -> None:
+        while not stopping.is_set():
+            self.state = "connecting"
+            self.next_retry_at = None
+            try:
+                client.reconnect()  # TCP + TLS + CONNECT, borné par connect_timeout
+            except Exception as e:
+                self.last_error = str(e)
+            else:
+                rc = mqtt.MQTT_ERR_SUCCESS
+                while rc == mqtt.MQTT_ERR_SUCCESS and not stopping.is_set():
+                    rc = client.loop(timeout=1.0)
+            if stopping.is_set():
+                break
+            self.connected = False
+            delay = backoff_delay(self.attempts)
+            self.attempts += 1
+            self.state = "backoff"
+            self.next_retry_at = time.time() + delay
+            print(f"[MQTT] {self.serial or self.cfg['ip']}: {self.last_error}, nouvel essai dans {delay:.1f}s")
+            stopping.wait(delay)
+        # stop() pendant un reconnect(): la connexion établie ensuite doit être fermée ici
+        try:
+            client.disconnect()
+        except Exception:
+            pass
+        self.state = "stopped"
 
-    # ---------- API publique ----------
-    def start(self, cfg: Dict[str, Any]) -> None:
+    def stop(self) -> None:
+        """Non bloquant: le superviseur sort de lui-même (au plus tard après connect_timeout)."""
         with self.lock:
-            # Stop ancien client
+            self._stopping.set()
             if self.client is not None:
                 try:
-                    self.client.loop_stop()
                     self.client.disconnect()
                 except Exception:
                     pass
-                self.client = None
+            self.client = None
+            self.connected = False
+            self.connected_since = None
+            self.state = "stopped"
+            self.next_retry_at = None
+
+    def status(self) -> Dict[str, Any]:
+        now = time.time()
+        recent = sum(1 for t in list(self._recent) if t >= now - RATE_WINDOW)
+        return {
+            "serial": self.serial,
+            "state": self.state,
+            "connected": self.connected,
+            "last_error": self.last_error,
+            "attempts": self.attempts,
+            "next_retry_at": self.next_retry_at,
+            "broker": f"{self.cfg.get('ip')}:{broker_port(self.cfg)}",
+            "useTLS": self.cfg.get("useTLS", True),
+            "connects": self.connects,
+            "disconnects": self.disconnects,
+            "connected_since": self.connected_since,
+            "messages": self.messages,
+            "ams_reports": self.ams_reports,
+            "bytes_in": self.bytes_in,
+            "last_message_at": self.last_message_at,
+            "messages_per_min": round(recent * 60.0 / RATE_WINDOW, 1),
+        }
 
-            self.cfg = cfg
-            self.client = self._build_client(cfg)
 
-            host = cfg["ip"]
-            port = cfg["portTLS"] if cfg.get("useTLS", True) else cfg.get("portPlain", 1883)
-            self.client.connect(host, port, keepalive=60)
-            self.client.loop_start()  # non bloquant
+class MqttManager:
+    """Sessions MQTT des imprimantes configurées, par numéro de série, alimentant un même worker d'ingestion."""
+
+    def __init__(self, ingest=None):
+        self.sessions: Dict[str, PrinterSession] = {}
+        self.lock = threading.Lock()
+        self.last_error: Optional[str] = None
+        # Worker d'ingestion in-process (voir ams_ingest.AmsIngestWorker)
+        self.ingest = ingest
+
+    # ---------- API publique ----------
+    def start(self, cfg: Dict[str, Any]) -> None:
+        """
+        Applique une config (une imprimante ou {"printers": [...]}): démarre les nouvelles sessions,
+        redémarre celles dont les paramètres ont changé et arrête celles qui ont disparu.
+        """
+        printers = config_printers(cfg)
+        wanted = {p.get("serial") or "": p for p in printers}
+        with self.lock:
+            for serial in [s for s in self.sessions if s not in wanted]:
+                self.sessions.pop(serial).stop()
+            for serial, pcfg in wanted.items():
+                current = self.sessions.get(serial)
+                if current is not None and current.cfg == pcfg:
+                    continue
+                if current is not None:
+                    current.stop()
+                session = PrinterSession(pcfg, ingest=self.ingest)
+                self.sessions[serial] = session
+                session.start()
+            self.last_error = None
 
     def stop(self) -> None:
         with self.lock:
-            if self.client is not None:
-                try:
-                    self.client.loop_stop()
-                    self.client.disconnect()
-                except Exception:
-                    pass
-                self.client = None
-                self.connected = False
+            for session in self.sessions.values():
+                session.stop()
+            self.sessions.clear()
+
+    def status(self) -> Dict[str, Any]:
+        with self.lock:
+            printers: List[Dict[str, Any]] = [s.status() for s in self.sessions.values()]
+        # Champs historiques (mono-imprimante): ceux de la première imprimante configurée
+        first = printers[0] if printers else {}
+        return {
+            "connected": first.get("connected", False),
+            "last_error": first.get("last_error", self.last_error),
+            "broker": first.get("broker"),
+            "useTLS": first.get("useTLS"),
+            "serial": first.get("serial"),
+            "printers": printers,
+            "connected_count": sum(1 for p in printers if p["connected"]),
+            "ingest": self.ingest.stats() if self.ingest else None,
+        }
 
     def quick_test(self, cfg: Dict[str, Any], timeout: float = 4.0) -> Dict[str, Any]:
-        """Connexion éphémère pour valider les paramètres sans lancer le loop permanent."""
-        test_client = self._build_client(cfg)
+        """
+        Connexion éphémère pour valider les paramètres sans lancer le loop permanent.
+        Bloquant (jusqu'à ~2 × timeout): à exécuter hors des threads de requête (voir jobs.JobStore).
+        """
+        test_client = build_client(cfg)
+        test_client.connect_timeout = timeout
         host = cfg["ip"]
-        port = cfg["portTLS"] if cfg.get("useTLS", True) else cfg.get("portPlain", 1883)
+        port = broker_port(cfg)
         res = {"ok": False, "details": ""}
 
         done = threading.Event()
@@ -128,8 +294,6 @@ class MqttManager:
                 res["details"] = f"Échec rc={rc}"
             done.set()
 
-        # Remplace temporairement le callback
-        orig = test_client.on_connect
         test_client.on_connect = on_connect
 
         try:
@@ -144,6 +308,5 @@ class MqttManager:
                 test_client.disconnect()
             except Exception:
                 pass
-            test_client.on_connect = orig
 
         return res
@@ -0,0 +1,316 @@
+# backend/palette.py
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Optional, Dict, List, Tuple, Any
+
+import numpy as np
+
+from colorspace import hex_to_rgb, rgb_to_lab_array
+from metrics import COLOR_LOOKUPS
+
+# Écart max (CIE76) pour nommer une couleur absente de la palette d'après la plus proche du même matériau
+COLOR_MATCH_MAX_DELTA_E = float(os.getenv("COLOR_MATCH_MAX_DELTA_E", "5"))
+_MEMO_MAX = 65536
+# Intervalle min (s) entre deux vérifications du fichier source (mtime/taille)
+PALETTE_CHECK_INTERVAL = float(os.getenv("PALETTE_CHECK_INTERVAL", "5"))
+# À incrémenter si la structure de la forme compilée change
+_COMPILED_FORMAT = 2
+
+
+def _normalize_hex(h: str | None) -> str | None:
+    if not h:
+        return None
+    s = h.strip().upper()
+    if not s.startswith("#"):
+        s = "#" + s
+    # #RGB -> #RRGGBB
+    if len(s) == 4 and all(c in "0123456789ABCDEF" for c in s[1:]):
+        s = "#" + "".join([c * 2 for c in s[1:]])
+    # force #RRGGBB (chiffres hexadécimaux uniquement)
+    if len(s) == 7 and all(c in "0123456789ABCDEF" for c in s[1:]):
+        return s
+    return None
+
+def _normalize_material(m: str | None) -> str:
+    return (m or "").strip().upper()
+
+
+class Palette:
+    """
+    Mapping (matériau, #RRGGBB) → nom marketing, plus un tableau Lab compact par matériau:
+    une couleur absente (ex: tray_color décalé d'une unité) prend le nom de la plus proche
+    si l'écart reste sous COLOR_MATCH_MAX_DELTA_E. Résultats mémoïsés par (matériau, hex).
+    """
+
+    def __init__(self, entries: Dict[Tuple[str, str], str], max_delta_e: Optional[float] = None,
+                 labs: Optional[Dict[str, Tuple[np.ndarray, List[str]]]] = None):
+        self.exact = entries
+        self.max_delta_e = COLOR_MATCH_MAX_DELTA_E if max_delta_e is None else max_delta_e
+        self._labs = labs if labs is not None else self._build_labs(entries)
+        self._memo: Dict[Tuple[str, str], Optional[str]] = {}
+        self.memo_hits = 0
+        self.exact_hits = 0
+        self.nearest_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _build_labs(entries: Dict[Tuple[str, str], str]) -> Dict[str, Tuple[np.ndarray, List[str]]]:
+        grouped: Dict[str, Tuple[list, list]] = {}
+        for (mat, hx), name in entries.items():
+            rgbs, names = grouped.setdefault(mat, ([], []))
+            rgbs.append(hex_to_rgb(hx))
+            names.append(name)
+        return {
+            mat: (rgb_to_lab_array(np.array(rgbs, dtype=np.uint8)), names)
+            for mat, (rgbs, names) in grouped.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.exact)
+
+    def resolve(self, material: str | None, hex_code: str | None) -> str | None:
+        return self.resolve_many([(material, hex_code)])[0]
+
+    def resolve_many(self, pairs: List[Tuple[str | None, str | None]]) -> List[str | None]:
+        """Résolution en lot: les couleurs inconnues sont comparées à toute la palette du matériau en une passe."""
+        out: List[Optional[str]] = [None] * len(pairs)
+        pending: Dict[str, Dict[str, List[int]]] = {}
+        memo = exact = nearest = misses = 0
+        for i, (material, hex_code) in enumerate(pairs):
+            hx = _normalize_hex(hex_code)
+            if not hx:
+                continue
+            key = (_normalize_material(material), hx)
+            if key in self._memo:
+                memo += 1
+                out[i] = self._memo[key]
+                continue
+            name = self.exact.get(key)
+            if name is not None:
+                exact += 1
+                self._remember(key, name)
+                out[i] = name
+                continue
+            pending.setdefault(key[0], {}).setdefault(hx, []).append(i)
+
+        for mat, by_hex in pending.items():
+            names = self._nearest(mat, list(by_hex))
+            for (hx, idx), name in zip(by_hex.items(), names):
+                if name is None:
+                    misses += 1
+                else:
+                    nearest += 1
+                self._remember((mat, hx), name)
+                for i in idx:
+                    out[i] = name
+
+        self.memo_hits += memo
+        self.exact_hits += exact
+        self.nearest_hits += nearest
+        self.misses += misses
+        for result, n in (("memo", memo), ("exact", exact), ("nearest", nearest), ("miss", misses)):
+            if n:
+                COLOR_LOOKUPS.labels(result).inc(n)
+        return out
+
+    def _nearest(self, mat: str, hexes: List[str]) -> List[Optional[str]]:
+        out: List[Optional[str]] = [None] * len(hexes)
+        table = self._labs.get(mat)
+        if table is None or self.max_delta_e <= 0:
+            return out
+        # Un hex illisible n'a pas de nom, sans priver les autres couleurs du lot
+        rgbs = [hex_to_rgb(h) for h in hexes]
+        valid = [i for i, rgb in enumerate(rgbs) if rgb is not None]
+        if not valid:
+            return out
+        labs, names = table
+        targets = rgb_to_lab_array(np.array([rgbs[i] for i in valid], dtype=np.uint8))
+        dist = np.sqrt(((targets[:, None, :] - labs[None, :, :]) ** 2).sum(axis=2))
+        best = dist.argmin(axis=1)
+        best_de = dist[np.arange(len(valid)), best]
+        for i, j, de in zip(valid, best, best_de):
+            if de <= self.max_delta_e:
+                out[i] = names[j]
+        return out
+
+    def _remember(self, key: Tuple[str, str], name: Optional[str]) -> None:
+        if len(self._memo) >= _MEMO_MAX:
+            self._memo.clear()
+        self._memo[key] = name
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self.exact),
+            "materials": len(self._labs),
+            "memo_size": len(self._memo),
+            "memo_hits": self.memo_hits,
+            "exact_hits": self.exact_hits,
+            "nearest_hits": self.nearest_hits,
+            "misses": self.misses,
+        }
+
+
+def palette_source_path() -> str:
+    # 1) prend la var d'env si dispo
+    path = os.environ.get("FILAMENT_COLOR_JSON")
+    # 2) sinon fallback vers ./data/filaments_min.json
+    if not path:
+        base_dir = os.path.abspath(os.path.dirname(__file__))
+        path = os.path.join(base_dir, "data", "filaments_min.json")
+    return path
+
+
+def parse_palette_json(raw: bytes) -> Dict[Tuple[str, str], str]:
+    cmap: Dict[Tuple[str, str], str] = {}
+    for row in json.loads(raw.decode("utf-8")):
+        mat = _normalize_material(row.get("material"))
+        hx = _normalize_hex(row.get("hex"))
+        name = (row.get("name") or "").strip()
+        if mat and hx and name:
+            cmap[(mat, hx)] = name
+    return cmap
+
+
+class PaletteStore:
+    """
+    Palette chargée au premier usage (pas à l'import), puis rechargée quand le fichier source change:
+    stat (mtime/taille) au plus toutes les PALETTE_CHECK_INTERVAL s, sha256 du contenu pour confirmer.
+    Une forme compilée (.npz à côté du JSON) évite le parsing et le calcul Lab au démarrage suivant.
+    En cas d'erreur, la dernière palette valide est conservée et l'erreur est exposée dans status().
+    """
+
+    def __init__(self, path: Optional[str] = None, check_interval: Optional[float] = None):
+        self._path = path
+        self.check_interval = PALETTE_CHECK_INTERVAL if check_interval is None else check_interval
+        self._lock = threading.Lock()
+        self._palette: Optional[Palette] = None
+        self._signature: Optional[Tuple[int, int]] = None
+        self._next_check = 0.0
+        self.version: Optional[str] = None
+        self.loads = 0
+        self.load_ms: Optional[float] = None
+        self.loaded_at: Optional[float] = None
+        self.loaded_from: Optional[str] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def path(self) -> str:
+        return self._path or palette_source_path()
+
+    def _compiled_path(self) -> str:
+        head, tail = os.path.split(self.path)
+        return os.path.join(head, f".{tail}.palette.npz")
+
+    def get(self) -> Palette:
+        if self._palette is not None and time.monotonic() < self._next_check:
+            return self._palette
+        with self._lock:
+            if self._palette is None or time.monotonic() >= self._next_check:
+                self._refresh(force=False)
+            return self._palette
+
+    def reload(self) -> Dict[str, Any]:
+        """Relit le fichier source, même si sa signature n'a pas changé."""
+        with self._lock:
+            self._refresh(force=True)
+        return self.status()
+
+    def _refresh(self, force: bool) -> None:
+        self._next_check = time.monotonic() + self.check_interval
+        path = self.path
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            self._fail(f"{path}: {e.strerror or e}")
+            return
+        signature = (st.st_mtime_ns, st.st_size)
+        if not force and self._palette is not None and signature == self._signature:
+            return
+
+        t0 = time.perf_counter()
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+            digest = hashlib.sha256(raw).hexdigest()[:12]
+            if not force and self._palette is not None and digest == self.version:
+                self._signature = signature  # touch sans changement de contenu
+                return
+            palette, source = self._load_compiled(digest), "compiled"
+            if palette is None:
+                palette, source = Palette(parse_palette_json(raw)), "json"
+                self._save_compiled(digest, palette)
+        except Exception as e:
+            self._fail(f"{path}: {e}")
+            return
+
+        self._palette = palette
+        self._signature = signature
+        self.version = digest
+        self.loads += 1
+        self.load_ms = round((time.perf_counter() - t0) * 1000, 2)
+        self.loaded_at = time.time()
+        self.loaded_from = source
+        self.last_error = None
+        print(f"[PALETTE] v{digest}: {len(palette)} couleurs ({source}, {self.load_ms} ms)")
+
+    def _fail(self, error: str) -> None:
+        self.last_error = error
+        print(f"[PALETTE] Chargement impossible, palette précédente conservée: {error}")
+        if self._palette is None:
+            self._palette = Palette({})
+
+    def _load_compiled(self, digest: str) -> Optional[Palette]:
+        # Fichier du dossier de données (modifiable): données seules, jamais de pickle
+        try:
+            with np.load(self._compiled_path(), allow_pickle=False) as npz:
+                meta = json.loads(npz["meta"].tobytes().decode("utf-8"))
+                if meta["format"] != _COMPILED_FORMAT or meta["version"] != digest:
+                    return None
+                entries = {(mat, hx): name for mat, hx, name in meta["entries"]}
+                # Un seul tableau Lab, découpé par matériau dans l'ordre de meta["labs"]
+                lab_all, labs, start = npz["labs"], {}, 0
+                for mat, names in meta["labs"]:
+                    labs[mat] = (lab_all[start:start + len(names)], names)
+                    start += len(names)
+        except Exception:
+            return None
+        return Palette(entries, labs=labs)
+
+    def _save_compiled(self, digest: str, palette: Palette) -> None:
+        target = self._compiled_path()
+        tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+        meta = {
+            "format": _COMPILED_FORMAT,
+            "version": digest,
+            "entries": [[mat, hx, name] for (mat, hx), name in palette.exact.items()],
+            "labs": [[mat, names] for mat, (_, names) in palette._labs.items()],
+        }
+        labs = [lab for lab, _ in palette._labs.values()]
+        try:
+            with open(tmp, "wb") as f:
+                np.savez(f, meta=np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8),
+                         labs=np.concatenate(labs) if labs else np.empty((0, 3)))
+            os.replace(tmp, target)
+        except OSError:
+            # Dossier en lecture seule: on se passe de la forme compilée
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    def status(self) -> Dict[str, Any]:
+        palette = self._palette
+        return {
+            "version": self.version,
+            "source": self.path,
+            "loaded_from": self.loaded_from,
+            "loads": self.loads,
+            "load_ms": self.load_ms,
+            "loaded_at": self.loaded_at,
+            "last_error": self.last_error,
+            **(palette.stats() if palette is not None else {"size": 0}),
+        }
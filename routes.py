@@ -1,120 +1,363 @@
 from flask import Blueprint, request, jsonify, current_app
-from models import db, Filament
+from werkzeug.exceptions import RequestEntityTooLarge
+from sqlalchemy import func, and_, or_
+from models import db, Filament, FilamentTombstone, COLOR_PALETTE, backfill_color_names, get_inventory_version, get_sync_horizon, listing_order, listing_sort_keys
 from datetime import datetime
-from sqlalchemy import func, cast, Float
-from helper import tray_to_filament_dict, upsert_filament, validate_cfg, save_config, _parse_dt, _NUMERIC_FIELDS, _DATETIME_FIELDS, _ALLOWED
-import tempfile
-import os
-import zipfile
+from consumption import spool_usage, spool_series, material_usage
+from threemf import ThreeMFError
+from threemf_jobs import (
+    QueueFullError, UploadTooLargeError, RETRY_AFTER, JOB_KIND as THREEMF_JOB_KIND, SYNC_WAIT as THREEMF_SYNC_WAIT,
+)
+from jobs import JOB_WAIT_MAX
+from helper import sync_ams_units, bulk_import_filaments, iter_import_records, _IMPORT_EXTENSIONS, validate_cfg, save_config, load_config, config_printers, _parse_dt, _NUMERIC_FIELDS, _DATETIME_FIELDS, _ALLOWED
 import json
-import xml.etree.ElementTree as ET
+import base64
+import threading
 
 api = Blueprint('api', __name__)
 
 # ------------------- MQTT endpoints -------------------
 
+def _run_mqtt_test(manager, payload):
+    if "printers" not in payload:
+        return manager.quick_test(payload)
+    results = [{"serial": p["serial"], **manager.quick_test(p)} for p in payload["printers"]]
+    return {"ok": all(r["ok"] for r in results), "printers": results}
+
 @api.post("/api/mqtt/test")
 def api_mqtt_test():
+    # Test exécuté en tâche de fond: suivre le résultat via GET /api/jobs/<id>
     payload = request.get_json(force=True) or {}
     err = validate_cfg(payload)
     if err:
         return jsonify({"error": err}), 400
-    res = current_app.mqtt_manager.quick_test(payload)
-    return (jsonify(res), 200) if res.get("ok") else (jsonify(res), 400)
+    job = current_app.jobs.submit(current_app.job_executor, "mqtt_test",
+                                  _run_mqtt_test, current_app.mqtt_manager, payload)
+    url = f"/api/jobs/{job['id']}"
+    return jsonify({"job_id": job["id"], "status": job["status"], "url": url}), 202, {"Location": url}
+
+def _job_wait_arg():
+    # ?wait=<s>: attend la fin du job (borné par JOB_WAIT_MAX); sous ASGI, attente sans thread (asgi.py)
+    try:
+        return max(0.0, float(request.args.get("wait", 0)))
+    except ValueError:
+        return None
+
+@api.get("/api/jobs/<job_id>")
+def api_job_status(job_id):
+    wait = _job_wait_arg()
+    if wait is None:
+        return jsonify({"error": "Invalid wait"}), 400
+    job = current_app.jobs.wait(job_id, min(wait, JOB_WAIT_MAX)) if wait else current_app.jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Not found"}), 404
+    return jsonify(job)
+
+def _save_and_apply_mqtt_config(cfg):
+    save_config(cfg)
+    try:
+        applied = current_app.mqtt_leadership.apply_now(cfg)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    # La connexion s'établit en arrière-plan: suivre l'état via GET /api/mqtt/status
+    if not applied:
+        # Un autre worker possède la session MQTT: il recharge la config au prochain tick
+        message = "Configuration enregistrée, appliquée par le worker MQTT"
+    else:
+        message = "Connexion MQTT en cours"
+    return jsonify({"ok": True, "message": message, "status_url": "/api/mqtt/status"}), 202
 
 @api.post("/api/mqtt/config")
 def api_mqtt_config():
+    # Une imprimante (format historique) ou {"printers": [...]}: remplace toute la config
     payload = request.get_json(force=True) or {}
     err = validate_cfg(payload)
     if err:
         return jsonify({"error": err}), 400
+    return _save_and_apply_mqtt_config(payload)
+
+@api.put("/api/mqtt/printers/<serial>")
+def api_mqtt_printer_put(serial):
+    """Ajoute ou remplace une imprimante sans toucher aux autres."""
+    printer = request.get_json(force=True) or {}
+    printer["serial"] = serial
+    printers = [p for p in config_printers(load_config()) if (p.get("serial") or "") != serial]
+    cfg = {"printers": printers + [printer]}
+    err = validate_cfg(cfg)
+    if err:
+        return jsonify({"error": err}), 400
+    return _save_and_apply_mqtt_config(cfg)
 
-    save_config(payload)
-    try:
-        current_app.mqtt_manager.start(payload)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-    return jsonify({"ok": True, "message": "Client MQTT démarré"})
+@api.delete("/api/mqtt/printers/<serial>")
+def api_mqtt_printer_delete(serial):
+    printers = config_printers(load_config())
+    remaining = [p for p in printers if (p.get("serial") or "") != serial]
+    if len(remaining) == len(printers):
+        return jsonify({"error": "Not found"}), 404
+    return _save_and_apply_mqtt_config({"printers": remaining})
 
 @api.get("/api/mqtt/status")
 def api_mqtt_status():
-    m = current_app.mqtt_manager
-    cfg = m.cfg or {}
-    broker = None
-    if cfg:
-        port = cfg["portTLS"] if cfg.get("useTLS", True) else cfg.get("portPlain", 1883)
-        broker = f"{cfg.get('ip')}:{port}"
-
-    return jsonify({
-        "connected": m.connected,
-        "last_error": m.last_error,
-        "broker": broker,
-        "useTLS": cfg.get("useTLS", True) if cfg else None,
-        "serial": cfg.get("serial") if cfg else None,
-    })
+    return jsonify(current_app.mqtt_leadership.status())
+
+# ------------------- Flux de modifications (SSE) ---------------------------
+
+@api.get("/api/events")
+def api_events():
+    """
+    Server-Sent Events: un événement "filament" par bobine insérée / modifiée / supprimée
+    (champs modifiés uniquement), "reload" après une écriture en masse, "reset" si le
+    Last-Event-ID n'est plus rejouable (recharger le listing complet).
+    """
+    raw = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_event_id = int(raw) if raw else None
+    except ValueError:
+        return jsonify({"error": "Invalid Last-Event-ID"}), 400
+    return current_app.response_class(
+        current_app.event_hub.stream(last_event_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# ------------------- Palette couleurs ---------------------------
+
+@api.get("/api/palette")
+def palette_status():
+    return jsonify(COLOR_PALETTE.status())
+
+@api.post("/api/palette/reload")
+def palette_reload():
+    # Recharge la palette de ce worker (les autres suivent via le contrôle de mtime)
+    status = COLOR_PALETTE.reload()
+    if status["last_error"]:
+        return jsonify(status), 500
+    if request.args.get("backfill") in ("1", "true"):
+        status["backfill"] = backfill_color_names(db.session)
+    return jsonify(status)
 
 # ------------------- Filaments API (inchangé) -------------------
 
+# Champs du listing → colonne (remaining_weight / remaining_length gardent leurs noms historiques)
+_LISTING_FIELDS = {
+    "id": Filament.id,
+    "uid": Filament.uid,
+    "tray_uid": Filament.tray_uid,
+    "tag_manufacturer": Filament.tag_manufacturer,
+    "filament_type": Filament.filament_type,
+    "filament_detailed_type": Filament.filament_detailed_type,
+    "color_code": Filament.color_code,
+    "color_name": Filament.color_name,
+    "extra_color_info": Filament.extra_color_info,
+    "filament_diameter": Filament.filament_diameter,
+    "spool_width": Filament.spool_width,
+    "spool_weight": Filament.spool_weight,
+    "filament_length": Filament.filament_length,
+    "print_temp_min": Filament.print_temp_min,
+    "print_temp_max": Filament.print_temp_max,
+    "dry_temp": Filament.dry_temp,
+    "dry_time_hour": Filament.dry_time_hour,
+    "dry_bed_temp": Filament.dry_bed_temp,
+    "nozzle_diameter": Filament.nozzle_diameter,
+    "xcam_info": Filament.xcam_info,
+    "manufacture_datetime_utc": Filament.manufacture_datetime_utc,
+    "short_date": Filament.short_date,
+    "remaining_percent": Filament.remaining_percent,
+    "remaining_weight": Filament.remaining_grams,
+    "remaining_length": Filament.remaining_length_mm,
+    "last_sync_source": Filament.last_sync_source,
+    "last_sync_at": Filament.last_sync_at,
+    "printer_serial": Filament.printer_serial,
+    "updated_version": Filament.updated_version,
+    "updated_at": Filament.updated_at,
+}
+_LISTING_MAX_LIMIT = 1000
+
+# Réponses sérialisées par query string, valides tant que la version d'inventaire (en base) ne change pas
+_listing_cache = {"version": None, "bodies": {}}
+_listing_lock = threading.Lock()
+_LISTING_CACHE_MAX = 64
+
+def _listing_bodies(version: int) -> dict:
+    """Cache des réponses de `version`; un dict jetable si un autre thread a déjà vu une version plus récente."""
+    with _listing_lock:
+        if _listing_cache["version"] is None or version > _listing_cache["version"]:
+            _listing_cache.update(version=version, bodies={})
+        return _listing_cache["bodies"] if _listing_cache["version"] == version else {}
+
 # Get all filaments
+# Sans paramètre: liste complète (format historique). Paramètres optionnels:
+#   fields=id,uid,...             projection SQL des seules colonnes demandées
+#   filament_type=PLA,PETG        color_code=#000000,...     last_sync_source=ams
+#   printer_serial=01P00A...,...
+#   min_remaining=1 / max_remaining=500 (grammes restants)
+#   limit=100 [&cursor=...]       pagination keyset → {"items": [...], "next_cursor": ...}
 @api.route('/api/filaments', methods=['GET'])
 def get_filaments():
-    # Clé de tri poids: poids réel si dispo, sinon poids bobine; cast au cas où la colonne est TEXT
-    weight_key = func.coalesce(
-        cast(Filament.remaining_grams, Float),
-        cast(Filament.spool_weight, Float),
-        1e12  # met les inconnus tout à la fin
-    )
+    version = get_inventory_version(db.session)
+    etag = f"inv-{version}"
+    # Comparaison faible: un proxy (compression) peut renvoyer W/"inv-N"
+    if request.if_none_match.contains_weak(etag):
+        resp = current_app.response_class(status=304)
+    else:
+        # Dict de cette version pris une seule fois: une réponse ne peut pas finir dans le cache d'une autre version
+        bodies = _listing_bodies(version)
+        key = request.query_string
+        body = bodies.get(key)
+        if body is None:
+            try:
+                body = _build_filament_listing(request.args).get_data()
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            with _listing_lock:
+                if len(bodies) < _LISTING_CACHE_MAX:
+                    bodies[key] = body
+        resp = current_app.response_class(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+def _csv_arg(args, name):
+    raw = args.get(name)
+    return [v.strip() for v in raw.split(",") if v.strip()] if raw else []
+
+def _int_arg(args, name):
+    raw = args.get(name)
+    if raw is None or raw == "":
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        raise ValueError(f"Invalid number for {name}")
 
-    # Tri SQL: matériau → sous-type → nom couleur → hex → poids (desc)
-    filaments = (
-        db.session.query(Filament)
-        .order_by(
-            func.lower(func.coalesce(Filament.filament_type, 'zzzz')),
-            func.lower(func.coalesce(Filament.filament_detailed_type, 'zzzz')),
-            func.lower(func.coalesce(Filament.color_name, 'zzzz')),
-            func.lower(func.coalesce(Filament.color_code, 'zzzz')),
-            weight_key.desc()
-        )
-        .all()
-    )
+def _encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def _decode_cursor(raw: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(raw.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(listing_sort_keys()) + 1:
+        raise ValueError("Invalid cursor")
+    return values
+
+def _after_cursor(keys, values):
+    """Condition keyset 'strictement après' pour l'ordre (k0..k3 asc, poids desc, id asc)."""
+    cols = list(keys) + [Filament.id]
+    ops = [lambda c, v: c > v] * (len(keys) - 1) + [lambda c, v: c < v, lambda c, v: c > v]
+    branches = []
+    for i, (col, val) in enumerate(zip(cols, values)):
+        eq = [c == v for c, v in zip(cols[:i], values[:i])]
+        branches.append(and_(*eq, ops[i](col, val)))
+    # Borne sur la 1re clé: permet à SQLite de positionner le parcours de l'index
+    return and_(cols[0] >= values[0], or_(*branches))
+
+def _build_filament_listing(args):
+    fields = _csv_arg(args, "fields") or list(_LISTING_FIELDS)
+    unknown = [f for f in fields if f not in _LISTING_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+
+    limit = _int_arg(args, "limit")
+    cursor = args.get("cursor")
+    paginated = limit is not None or cursor is not None
+    if paginated:
+        limit = max(1, min(limit or _LISTING_MAX_LIMIT, _LISTING_MAX_LIMIT))
+
+    keys = listing_sort_keys()
+    q = db.session.query(*[_LISTING_FIELDS[f] for f in fields], *keys, Filament.id)
+
+    types = _csv_arg(args, "filament_type")
+    if types:
+        q = q.filter(func.lower(Filament.filament_type).in_([t.lower() for t in types]))
+    colors = _csv_arg(args, "color_code")
+    if colors:
+        q = q.filter(func.upper(Filament.color_code).in_(["#" + c.lstrip("#").upper() for c in colors]))
+    sources = _csv_arg(args, "last_sync_source")
+    if sources:
+        q = q.filter(Filament.last_sync_source.in_(sources))
+    printers = _csv_arg(args, "printer_serial")
+    if printers:
+        q = q.filter(Filament.printer_serial.in_(printers))
+    min_g = _int_arg(args, "min_remaining")
+    if min_g is not None:
+        q = q.filter(Filament.remaining_grams >= min_g)
+    max_g = _int_arg(args, "max_remaining")
+    if max_g is not None:
+        q = q.filter(Filament.remaining_grams <= max_g)
+    if cursor:
+        q = q.filter(_after_cursor(keys, _decode_cursor(cursor)))
+
+    # Tri SQL: matériau → sous-type → nom couleur → hex → poids (desc) → id, couvert par ix_filaments_listing
+    q = q.order_by(*listing_order(), Filament.id)
+    if paginated:
+        q = q.limit(limit + 1)
+    rows = q.all()
+
+    n = len(fields)
+    next_cursor = None
+    if paginated and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(list(rows[-1][n:]))
 
     data = [
         {
-            "id": f.id,
-            "uid": f.uid,
-            "tray_uid": f.tray_uid,
-            "tag_manufacturer": f.tag_manufacturer,
-            "filament_type": f.filament_type,
-            "filament_detailed_type": f.filament_detailed_type,
-            "color_code": f.color_code,
-            "color_name": f.color_name,  # ← ajouté
-            "extra_color_info": f.extra_color_info,
-            "filament_diameter": f.filament_diameter,
-            "spool_width": f.spool_width,
-            "spool_weight": f.spool_weight,
-            "filament_length": f.filament_length,
-            "print_temp_min": f.print_temp_min,
-            "print_temp_max": f.print_temp_max,
-            "dry_temp": f.dry_temp,
-            "dry_time_hour": f.dry_time_hour,
-            "dry_bed_temp": f.dry_bed_temp,
-            "nozzle_diameter": f.nozzle_diameter,
-            "xcam_info": f.xcam_info,
-            "manufacture_datetime_utc": f.manufacture_datetime_utc.strftime("%Y-%m-%d %H:%M:%S") if f.manufacture_datetime_utc else None,
-            "short_date": f.short_date,
-            "remaining_percent": f.remaining_percent,
-            "remaining_weight": f.remaining_grams,
-            "remaining_length": f.remaining_length_mm,
-            "last_sync_source": f.last_sync_source,
-            "last_sync_at": f.last_sync_at.strftime("%Y-%m-%d %H:%M:%S") if f.last_sync_at else None,
+            name: value.strftime("%Y-%m-%d %H:%M:%S") if isinstance(value, datetime) else value
+            for name, value in zip(fields, row[:n])
         }
-        for f in filaments
+        for row in rows
     ]
 
-
+    if paginated:
+        return jsonify({"items": data, "next_cursor": next_cursor})
     return jsonify(data)
 
+# Synchro différentielle: bobines insérées / modifiées / supprimées après la version `since`
+#   since=<version>   jeton "version" d'une réponse précédente (0 = tout l'inventaire)
+#   fields=id,uid,... même projection que le listing
+# 410 si since précède l'horizon des tombstones purgés: le client repart de since=0.
+# Requêtes sur les index updated_version / deleted_version: coût proportionnel aux changements.
+@api.get('/api/filaments/changes')
+def get_filament_changes():
+    try:
+        since = _int_arg(request.args, "since")
+        if since is None or since < 0:
+            raise ValueError("since (version >= 0) is required")
+        fields = _csv_arg(request.args, "fields") or list(_LISTING_FIELDS)
+        unknown = [f for f in fields if f not in _LISTING_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Version lue avant les lignes: une écriture concurrente peut être renvoyée deux fois, jamais manquée
+    version = get_inventory_version(db.session)
+    horizon = get_sync_horizon(db.session)
+    if 0 < since < horizon:
+        # Tombstones purgés depuis (events.RETENTION_HOURS): des suppressions seraient manquées
+        return jsonify({"error": "Full resync required (since=0)", "horizon": horizon, "version": version}), 410
+    q = db.session.query(*[_LISTING_FIELDS[f] for f in fields])
+    if since > 0:
+        q = q.filter(Filament.updated_version > since).order_by(Filament.updated_version, Filament.id)
+    changed = [
+        {
+            name: value.strftime("%Y-%m-%d %H:%M:%S") if isinstance(value, datetime) else value
+            for name, value in zip(fields, row)
+        }
+        for row in q.all()
+    ]
+    deleted = []
+    if since > 0:
+        t = FilamentTombstone
+        deleted = [
+            {"id": fid, "uid": uid}
+            for fid, uid in db.session.query(t.filament_id, t.uid)
+            .filter(t.deleted_version > since).order_by(t.deleted_version).all()
+        ]
+    return jsonify({"since": since, "version": version, "changed": changed, "deleted": deleted})
+
 #Get one specific filament
 @api.route('/api/filaments/<int:id>', methods=['GET'])
 def get_filament(id):
@@ -217,117 +460,163 @@ def update_filament(id):
     db.session.commit()
     return jsonify(filament.to_dict())
 
-# Import one or multiple JSON
+# Corps au-delà de MAX_CONTENT_LENGTH (voir threemf_jobs.MAX_REQUEST_BYTES): 413 en JSON
+@api.app_errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return jsonify({"error": "Request body too large"}), 413
+
+# Import one or multiple JSON (ou .ndjson / .zip de dumps pour les gros volumes)
 @api.route('/api/filaments/import', methods=['POST'])
 def import_filaments():
     if 'files' not in request.files:
         return jsonify({"error": "No files part in request"}), 400
 
     files = request.files.getlist('files')
-    imported = 0
     skipped = 0
-    errors = []
-
-    for file in files:
-        if not file.filename.endswith('.json'):
-            skipped += 1
-            continue
 
-        try:
-            raw = file.read().decode('utf-8')
-            content = json.loads(raw)
-
-            uid = content.get('tag_uid')
-            if not uid:
+    def records():
+        nonlocal skipped
+        for file in files:
+            if not file.filename.lower().endswith(_IMPORT_EXTENSIONS):
                 skipped += 1
                 continue
+            yield from iter_import_records(file.filename, file.stream)
 
-            existing = Filament.query.filter_by(uid=uid).first()
-            if existing:
-                skipped += 1
-                continue
+    # Lots avec commit par lot: un fichier invalide n'empêche pas l'import des autres
+    result = bulk_import_filaments(db.session, records())
+    result["skipped"] += skipped
 
-            filament = Filament(
-                uid=uid,
-                tray_uid=uid,
-                tag_manufacturer=content.get('material_code'),
-                filament_type=content.get('type'),
-                filament_detailed_type=content.get('subtype'),
-                color_code=content.get('color_hex'),
-                filament_diameter=content.get('diameter_mm'),
-                spool_weight=content.get('spool_weight_g'),
-                filament_length=content.get('length_m'),
-                nozzle_diameter=int(round(content.get('nozzle_diameter_mm', 0) * 1000)),
-                print_temp_min=content.get('temp_hotend_min'),
-                print_temp_max=content.get('temp_hotend_max'),
-                dry_temp=content.get('temp_drying'),
-                dry_time_hour=content.get('drying_time_h', 0) * 60,
-                manufacture_datetime_utc=datetime.strptime(content.get('produced_at'), "%Y-%m-%d-%H-%M"),
-                short_date=content.get('produced_at').replace('-', '')[:8],
-            )
-
-            db.session.add(filament)
-            imported += 1
-
-        except Exception as e:
-            skipped += 1
-            errors.append({"file": file.filename, "error": str(e)})
+    return jsonify(result), 200
 
-    db.session.commit()
+# ------------------- Consommation ---------------------------
+
+_CONSUMPTION_DEFAULT_DAYS = 30
+_CONSUMPTION_MAX_DAYS = 3660
 
-    return jsonify({
-        "imported": imported,
-        "skipped": skipped,
-        "errors": errors
-    }), 200
+def _days_arg(args) -> int:
+    days = _int_arg(args, "days")
+    if days is None:
+        return _CONSUMPTION_DEFAULT_DAYS
+    if not 1 <= days <= _CONSUMPTION_MAX_DAYS:
+        raise ValueError(f"days must be between 1 and {_CONSUMPTION_MAX_DAYS}")
+    return days
+
+@api.get("/api/consumption/spools")
+def consumption_by_spool():
+    try:
+        days = _days_arg(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"days": days, "spools": spool_usage(db.session, days)})
+
+@api.get("/api/consumption/spools/<uid>")
+def consumption_for_spool(uid):
+    filament = Filament.query.filter_by(uid=uid).first()
+    if not filament:
+        return jsonify({"error": "Not found"}), 404
+    try:
+        days = _days_arg(request.args)
+        return jsonify(spool_series(db.session, filament, days, request.args.get("resolution", "day")))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@api.get("/api/consumption/materials")
+def consumption_by_material():
+    try:
+        days = _days_arg(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"days": days, "materials": material_usage(db.session, days)})
 
 # ------------------- 3MF Analysis API ---------------------------
 
+def _submit_threemf():
+    """Upload → job d'analyse (threemf_jobs.py): (job, None) ou (None, réponse d'erreur)."""
+    queue = current_app.threemf_queue
+    # Refus avant lecture du corps: taille annoncée, puis place dans la file
+    try:
+        queue.check_size(request.content_length)
+        queue.acquire()
+    except UploadTooLargeError as e:
+        return None, (jsonify({'error': str(e)}), 413)
+    except QueueFullError as e:
+        return None, (jsonify({'error': str(e)}), 429, {"Retry-After": str(RETRY_AFTER)})
+
+    submitted = False  # submit() libère la place lui-même, y compris en cas d'erreur
+    try:
+        try:
+            # Lecture du corps, bornée par MAX_CONTENT_LENGTH (uploads chunked sans Content-Length)
+            file = request.files.get('file')
+        except RequestEntityTooLarge:
+            queue.too_large()
+        if not file:
+            return None, (jsonify({'error': 'No file provided'}), 400)
+        submitted = True
+        return queue.submit(file.stream, file.filename), None
+    except UploadTooLargeError as e:
+        return None, (jsonify({'error': str(e)}), 413)
+    except ThreeMFError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+    finally:
+        if not submitted:
+            queue.release()
+
+def _threemf_job_accepted(job):
+    url = f"/api/3mf/jobs/{job['id']}"
+    return jsonify({"job_id": job["id"], "status": job["status"], "url": url}), 202, {"Location": url}
+
+def _with_matches(result):
+    # Bobines en stock compatibles, slot par slot (non caché: l'inventaire évolue)
+    matches = current_app.inventory_index.match_slots(
+        db.session, result.get('materials', []), result.get('colors', [])
+    )
+    return {**result, 'matches': matches}
+
+# Fichier refusé → 400, limite de temps / mémoire dépassée → 422
+_THREEMF_ERROR_STATUS = {"ThreeMFError": 400, "ThreeMFLimitError": 422}
+
+@api.post('/api/3mf/jobs')
+def threemf_job_submit():
+    job, error = _submit_threemf()
+    if error:
+        return error
+    return _threemf_job_accepted(job)
+
+@api.get('/api/3mf/jobs/<job_id>')
+def threemf_job_status(job_id):
+    wait = _job_wait_arg()
+    if wait is None:
+        return jsonify({"error": "Invalid wait"}), 400
+    job = current_app.jobs.wait(job_id, min(wait, JOB_WAIT_MAX)) if wait else current_app.jobs.get(job_id)
+    if job is None or job["kind"] != THREEMF_JOB_KIND:
+        return jsonify({"error": "Not found"}), 404
+    if job["status"] == "done":
+        job = {**job, "result": _with_matches(job["result"])}
+    return jsonify(job)
+
+@api.get('/api/3mf/queue')
+def threemf_queue_stats():
+    return jsonify(current_app.threemf_queue.stats())
+
 @api.route('/api/3mf/analyze', methods=['POST'])
 def analyze_3mf():
-    # Récupère le fichier 3MF envoyé
-    file = request.files.get('file')
-    if not file:
-        return jsonify({'error': 'No file provided'}), 400
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        # Sauvegarde et extraction de l'archive 3MF
-        file_path = os.path.join(tmpdir, 'model.3mf')
-        file.save(file_path)
-        with zipfile.ZipFile(file_path, 'r') as archive:
-            archive.extractall(tmpdir)
-
-        # Dossier contenant les métadonnées
-        meta = os.path.join(tmpdir, 'metadata')
-
-        # 1) Couleurs et matériaux depuis project_settings.config
-        proj_cfg = os.path.join(meta, 'project_settings.config')
-        with open(proj_cfg, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
-        colors_raw = settings.get('filament_colour', [])
-        mats_raw = settings.get('filament_settings_id', [])
-
-        colors = colors_raw
-        materials = [m.split('@')[0].replace('Bambu ', '').strip() for m in mats_raw]
-
-        # 2) Comptage des pièces via le premier fichier XML/HTML contenant <objects>
-        pieces_count = 0
-        for fname in os.listdir(meta):
-            if fname.lower().endswith(('.xml', '.html')):
-                path = os.path.join(meta, fname)
-                with open(path, 'r', encoding='utf-8') as f:
-                    content = f.read().lstrip()
-                if content.startswith('<objects') or '<objects' in content:
-                    tree = ET.parse(path)
-                    pieces_count = len(tree.getroot().findall('.//object'))
-                    break
-
-    # Réponse JSON simplifiée
-    return jsonify({
-        'colors': colors,
-        'materials': materials,
-        'pieces_count': pieces_count,
-    })
+    # Forme synchrone historique: soumet le job et attend son résultat (THREEMF_SYNC_WAIT)
+    job, error = _submit_threemf()
+    if error:
+        return error
+    job = current_app.jobs.wait(job["id"], THREEMF_SYNC_WAIT)
+    if current_app.jobs.is_pending(job):
+        return _threemf_job_accepted(job)
+    if job["status"] != "done":
+        return jsonify({'error': job["error"]}), _THREEMF_ERROR_STATUS.get(job.get("error_type"), 500)
+
+    resp = jsonify(_with_matches(job["result"]))
+    resp.headers["X-Cache"] = job["cache"]
+    return resp
+
+@api.get('/api/3mf/cache')
+def analyze_3mf_cache_stats():
+    return jsonify(current_app.threemf_cache.stats())
 
 #-------------------- AMS Sync API ---------------------------
 
@@ -337,14 +626,6 @@ def ams_sync():
     report = data.get("print", {})
     ams = report.get("ams", {}).get("ams", [])
 
-    updated = 0
-    for sensor in ams:
-        sid = sensor.get("id")
-        for tray in sensor.get("tray", []):
-            if not tray.get("tag_uid"):
-                continue
-            payload = tray_to_filament_dict(sid, tray)
-            upsert_filament(db.session, payload)
-            updated += 1
-
+    # Imprimante d'origine optionnelle (le rapport Bambu ne contient pas le numéro de série)
+    updated = sync_ams_units(db.session, ams, request.args.get("serial") or None)
     return jsonify({"status": "ok", "updated": updated}), 200
@@ -0,0 +1,64 @@
+# backend/tests/conftest.py
+# Chaque test qui prend `session` tourne sur SQLite et sur PostgreSQL (TEST_POSTGRES_URL, base jetable:
+# toutes ses tables sont supprimées en fin de session). Sans TEST_POSTGRES_URL, la variante PostgreSQL est ignorée.
+import importlib
+import os
+import sys
+
+import pytest
+
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, _ROOT)
+
+from sqlalchemy import delete, text
+
+from database import normalize_database_url
+from models import db, ensure_inventory_state
+
+
+@pytest.fixture(scope="session", params=["sqlite", "postgresql"])
+def database_url(request, tmp_path_factory):
+    if request.param == "sqlite":
+        return f"sqlite:///{tmp_path_factory.mktemp('db') / 'test.db'}"
+    url = os.getenv("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL non défini")
+    return normalize_database_url(url)
+
+
+@pytest.fixture(scope="session")
+def app(database_url, tmp_path_factory):
+    """App complète (routes, file 3MF, flux SSE) sans threads de fond, schéma créé par les migrations (init_schema)."""
+    tmp = tmp_path_factory.mktemp("data")
+    os.environ.update(DATABASE_URL=database_url, DEFER_SERVICES="1",
+                      THREEMF_CACHE_DIR=str(tmp / "3mf_cache"), THREEMF_SPOOL_DIR=str(tmp / "3mf_spool"))
+    app = importlib.import_module("app").create_app(start=False)
+    assert app.startup["schema"] != "error"
+    yield app
+    app.job_executor.shutdown(wait=False)
+    app.threemf_queue.executor.shutdown(wait=False)
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.session.execute(text("DROP TABLE IF EXISTS alembic_version"))
+        db.session.commit()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app, session):
+    # Caches indexés par version d'inventaire: la base est vidée (version 0) entre deux tests
+    importlib.import_module("routes")._listing_cache.update(version=None, bodies={})
+    return app.test_client()
+
+
+@pytest.fixture
+def session(app):
+    with app.app_context():
+        ensure_inventory_state(db.session)
+        yield db.session
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(delete(table))
+        db.session.commit()
+        db.session.remove()
@@ -0,0 +1,82 @@
+# backend/tests/test_database.py
+import threading
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+import database
+from database import normalize_database_url, engine_options, dialect_insert
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("postgres://u:p@db:5432/spools", "postgresql+psycopg://u:p@db:5432/spools"),
+    ("postgresql://u:p@db/spools", "postgresql+psycopg://u:p@db/spools"),
+    ("postgresql+psycopg://u:p@db/spools", "postgresql+psycopg://u:p@db/spools"),
+    ("postgresql+psycopg2://u:p@db/spools", "postgresql+psycopg2://u:p@db/spools"),
+    ("sqlite:////app/data/app.db", "sqlite:////app/data/app.db"),
+])
+def test_normalize_database_url(url, expected):
+    assert normalize_database_url(url) == expected
+
+
+def test_engine_options_sqlite():
+    opts = engine_options("sqlite:////app/data/app.db")
+    assert opts == {"connect_args": {"check_same_thread": False, "timeout": database.SQLITE_BUSY_TIMEOUT}}
+
+
+def test_engine_options_postgresql():
+    opts = engine_options(normalize_database_url("postgres://u:p@db/spools"))
+    assert "connect_args" not in opts
+    assert opts["pool_size"] == database.POOL_SIZE
+    assert opts["max_overflow"] == database.MAX_OVERFLOW
+    assert opts["pool_recycle"] == database.POOL_RECYCLE
+    assert opts["pool_pre_ping"] is True
+
+
+def test_dialect_insert(session):
+    expected = {"sqlite": sqlite_insert, "postgresql": pg_insert}
+    assert dialect_insert(session) is expected[session.get_bind().dialect.name]
+
+
+def test_dialect_insert_without_on_conflict():
+    session = SimpleNamespace(get_bind=lambda: SimpleNamespace(dialect=SimpleNamespace(name="mysql")))
+    assert dialect_insert(session) is None
+
+
+def test_engine_applies_dialect_options(app, session):
+    engine = session.get_bind()
+    if engine.dialect.name == "postgresql":
+        assert engine.pool.size() == database.POOL_SIZE
+        assert engine.pool.timeout() == database.POOL_TIMEOUT
+        assert engine.pool._pre_ping is True
+    else:
+        # PRAGMAs appliqués par _sqlite_pragmas à chaque connexion
+        with engine.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == int(database.SQLITE_BUSY_TIMEOUT * 1000)
+
+
+def test_migrations_wait_for_advisory_lock(app, session):
+    """PostgreSQL: un second process qui migre attend le verrou consultatif de migrations/env.py."""
+    engine = session.get_bind()
+    if engine.dialect.name != "postgresql":
+        pytest.skip("verrou consultatif PostgreSQL uniquement")
+    from flask_migrate import upgrade
+    from app import _MIGRATIONS_DIR
+
+    def migrate():
+        with app.app_context():
+            upgrade(directory=_MIGRATIONS_DIR)
+
+    with engine.connect() as holder:
+        holder.begin()
+        holder.exec_driver_sql("SELECT pg_advisory_xact_lock(74656)")
+        worker = threading.Thread(target=migrate)
+        worker.start()
+        worker.join(0.5)
+        assert worker.is_alive()          # bloqué derrière le verrou
+        holder.rollback()                 # libère le verrou (fin de transaction)
+    worker.join(10)
+    assert not worker.is_alive()
@@ -0,0 +1,100 @@
+# backend/tests/test_events.py
+# Flux SSE /api/events: reprise après Last-Event-ID depuis le tampon mémoire ou depuis la base.
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from events import EventHub
+from helper import bulk_upsert_filaments
+from models import FilamentChange
+from test_writes import _payload
+
+
+@pytest.fixture
+def hub(app, session, monkeypatch):
+    hub = EventHub(app, buffer_size=3)
+    # Pas de thread de lecture: le test appelle _poll() lui-même
+    monkeypatch.setattr(hub, "_ensure_started", lambda: None)
+    hub._head = 0
+    fetches = []
+    fetch = hub._fetch
+    monkeypatch.setattr(hub, "_fetch", lambda after, *a: fetches.append(after) or fetch(after, *a))
+    hub.fetches = fetches
+    monkeypatch.setattr(app, "event_hub", hub)
+    return hub
+
+
+def _write(session, hub, n):
+    """n insertions journalisées; retourne leurs id d'événement (croissants, jamais réutilisés)."""
+    bulk_upsert_filaments(session, [_payload(f"U{i}") for i in range(n)])
+    hub._poll()
+    hub.fetches.clear()
+    return list(session.scalars(select(FilamentChange.id).order_by(FilamentChange.id)))
+
+
+def _parse(message):
+    lines = dict(line.split(": ", 1) for line in message.strip().split("\n"))
+    return lines["event"], json.loads(lines["data"])
+
+
+def _take(stream, n):
+    assert next(stream).startswith("retry: ")
+    return [_parse(next(stream)) for _ in range(n)]
+
+
+def test_replay_from_buffer(session, hub):
+    ids = _write(session, hub, 5)
+    assert [e["id"] for e in hub._buffer] == ids[2:]
+    got = _take(hub.stream(last_event_id=ids[2]), 2)
+    assert [(name, e["id"], e["op"], e["uid"]) for name, e in got] == [
+        ("filament", ids[3], "insert", "U3"), ("filament", ids[4], "insert", "U4"),
+    ]
+    assert hub.fetches == []
+
+
+def test_replay_from_database_past_buffer(session, hub):
+    ids = _write(session, hub, 5)
+    got = _take(hub.stream(last_event_id=ids[0]), 4)
+    assert [e["id"] for _, e in got] == ids[1:]
+    assert hub.fetches == [ids[0]]
+
+
+def test_replay_after_purge_sends_reset(session, hub):
+    ids = _write(session, hub, 2)
+    t = FilamentChange.__table__
+    session.execute(update(t).values(created_at=datetime.utcnow() - timedelta(days=30)))
+    session.commit()
+    hub.purge()
+    assert _take(hub.stream(last_event_id=ids[0]), 1) == [("reset", {"id": ids[1]})]
+
+
+def test_astream_replay_from_database(session, hub):
+    ids = _write(session, hub, 5)
+
+    async def collect():
+        stream = hub.astream(ids[0], lambda fn, *a: asyncio.to_thread(fn, *a))
+        out = [await stream.__anext__() for _ in range(5)]
+        await stream.aclose()
+        return out
+
+    retry, *messages = asyncio.run(collect())
+    assert retry.startswith("retry: ")
+    assert [_parse(m)[1]["id"] for m in messages] == ids[1:]
+
+
+def test_events_route_honours_last_event_id(client, session, hub):
+    ids = _write(session, hub, 5)
+    resp = client.get("/api/events", headers={"Last-Event-ID": str(ids[2])}, buffered=False)
+    assert resp.mimetype == "text/event-stream"
+    stream = (chunk.decode() for chunk in resp.response)
+    assert [e["id"] for _, e in _take(stream, 2)] == ids[3:]
+    resp.close()
+
+
+def test_events_route_rejects_bad_last_event_id(client, hub):
+    resp = client.get("/api/events", headers={"Last-Event-ID": "abc"})
+    assert resp.status_code == 400
+    assert resp.json == {"error": "Invalid Last-Event-ID"}
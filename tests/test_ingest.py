@@ -0,0 +1,135 @@
+# backend/tests/test_ingest.py
+# Worker d'ingestion AMS: coalesceur (mémoire du dernier état écrit) et politiques de file pleine.
+from datetime import datetime, timedelta
+
+import pytest
+
+from ams_ingest import AmsCoalescer, AmsIngestWorker
+from models import Filament, get_inventory_version
+from test_writes import _payload
+
+
+def _tray(tid, uid, remain=50, color="FF0000FF"):
+    return {"id": tid, "tag_uid": uid, "tray_uuid": f"T-{uid}", "tray_id_name": f"A0{tid}",
+            "tray_type": "PLA", "tray_sub_brands": "PLA Basic", "tray_color": color,
+            "tray_weight": "1000", "remain": remain}
+
+
+def _unit(sid, *trays):
+    return {"id": sid, "tray": list(trays)}
+
+
+def _batch(units, serial="S1"):
+    return {"printers": {serial: units}, "reports": 1, "received_at": 0}
+
+
+# ---------- AmsCoalescer ----------
+
+def test_coalescer_suppresses_written_state():
+    c = AmsCoalescer()
+    c.sync(0)
+    first = [_payload("A"), _payload("B")]
+    assert c.diff(first) == first
+    c.mark_written(first, version=1)
+
+    c.sync(1)
+    assert c.diff([_payload("A"), _payload("B")]) == []
+    changed = c.diff([_payload("A"), _payload("B", remain=40)])
+    assert [p["uid"] for p in changed] == ["B"]
+    assert c.stats()["trays_suppressed"] == 3
+
+
+def test_coalescer_ignores_volatile_fields():
+    c = AmsCoalescer()
+    c.sync(0)
+    c.mark_written([_payload("A", last_sync_at=datetime(2024, 1, 1))], version=1)
+    later = _payload("A", last_sync_at=datetime(2024, 1, 1) + timedelta(hours=1), last_sync_source="mqtt")
+    assert c.diff([later]) == []
+
+
+def test_coalescer_forgets_after_foreign_write():
+    c = AmsCoalescer()
+    c.sync(0)
+    c.mark_written([_payload("A")], version=1)
+    c.sync(2)                                   # PUT / import / autre worker entre-temps
+    assert c.stats()["tracked_trays"] == 0
+    assert [p["uid"] for p in c.diff([_payload("A")])] == ["A"]
+
+    c.sync(2)
+    c.mark_written([_payload("A")], version=4)  # version 3 écrite par quelqu'un d'autre
+    assert c.stats()["tracked_trays"] == 1
+    c.mark_written([_payload("B")], version=5)
+    assert c.stats()["tracked_trays"] == 2
+
+
+# ---------- AmsIngestWorker._apply (base) ----------
+
+def test_apply_skips_unchanged_report(app, session):
+    worker = AmsIngestWorker(app, flush_interval=0)
+    units = [_unit("0", _tray(0, "A"), _tray(1, "B"))]
+    worker._apply(_batch(units))
+    assert get_inventory_version(session) == 1
+    worker._apply(_batch(units))
+    assert get_inventory_version(session) == 1
+    stats = worker.stats()
+    assert (stats["processed"], stats["trays_synced"], stats["errors"]) == (2, 2, 0)
+    assert stats["coalescing"]["reports_suppressed"] == 1
+
+
+def test_apply_after_put_writes_tray_again(app, client, session):
+    worker = AmsIngestWorker(app, flush_interval=0)
+    units = [_unit("0", _tray(0, "A", color="FF0000FF"))]
+    worker._apply(_batch(units))
+    spool = client.get("/api/filaments").json[0]
+    assert client.put(f"/api/filaments/{spool['id']}", json={"color_code": "#00FF00"}).status_code == 200
+
+    # Même rapport qu'avant le PUT: le coalesceur ne doit pas le juger déjà écrit
+    worker._apply(_batch(units))
+    assert client.get(f"/api/filaments/{spool['id']}").json["color_code"] == "#FF0000"
+    assert worker.stats()["trays_synced"] == 2
+
+
+# ---------- Politiques de file pleine ----------
+
+def _remains(item):
+    return {t["tag_uid"]: t["remain"] for units in item["printers"].values() for u in units for t in u["tray"]}
+
+
+def test_policy_drop_newest(app):
+    worker = AmsIngestWorker(app, maxsize=1, policy="drop_newest")
+    assert worker.submit([_unit("0", _tray(0, "A", 50))], "S1")
+    assert not worker.submit([_unit("0", _tray(0, "A", 40))], "S1")
+    assert [_remains(i) for i in worker._pending] == [{"A": 50}]
+    assert worker.stats()["dropped"] == 1
+
+
+def test_policy_drop_oldest(app):
+    worker = AmsIngestWorker(app, maxsize=1, policy="drop_oldest")
+    worker.submit([_unit("0", _tray(0, "A", 50))], "S1")
+    assert worker.submit([_unit("0", _tray(0, "A", 40))], "S1")
+    assert [_remains(i) for i in worker._pending] == [{"A": 40}]
+    assert worker.stats()["dropped"] == 1
+
+
+def test_policy_merge_keeps_latest_tray_state(app):
+    worker = AmsIngestWorker(app, maxsize=1, policy="merge")
+    worker.submit([_unit("0", _tray(0, "A", 50), _tray(1, "B", 80))], "S1")
+    assert worker.submit([_unit("0", _tray(0, "A", 40))], "S1")
+    assert worker.submit([_unit("0", _tray(0, "A", 30)), _unit("1", _tray(0, "C", 90))], "S1")
+    assert worker.submit([_unit("0", _tray(0, "D", 70))], "S2")   # id AMS/tray locaux à l'imprimante
+
+    (item,) = worker._pending
+    assert item["reports"] == 4
+    assert _remains(item) == {"A": 30, "B": 80, "C": 90, "D": 70}
+    assert worker.stats()["merged"] == 3 and worker.stats()["dropped"] == 0
+
+
+@pytest.mark.parametrize("policy", ["merge", "drop_oldest", "drop_newest"])
+def test_policy_batch_writes_once(app, session, policy):
+    worker = AmsIngestWorker(app, maxsize=1, policy=policy, flush_interval=0)
+    for remain in (50, 40, 30):
+        worker.submit([_unit("0", _tray(0, "A", remain))], "S1")
+    worker._apply(worker._next())
+    assert get_inventory_version(session) == 1
+    expected = {"merge": 30, "drop_oldest": 30, "drop_newest": 50}[policy]
+    assert session.query(Filament.remaining_percent).scalar() == expected
@@ -0,0 +1,46 @@
+# backend/tests/test_inventory_index.py
+import pytest
+
+import inventory_index
+from helper import bulk_upsert_filaments
+from inventory_index import InventoryIndex
+from test_writes import _payload
+
+
+@pytest.fixture
+def index(session):
+    bulk_upsert_filaments(session, [
+        _payload("WHITE", color_code="#FFFFFF", remain=20),
+        _payload("OFFWHITE", color_code="#F5F5F0", remain=80),
+        _payload("TAN", color_code="#E8DBB7", remain=90),
+        _payload("NOCOLOR", color_code=None, remain=100),
+        _payload("EMPTY", color_code="#FFFFFF", remain=0),
+    ])
+    idx = InventoryIndex()
+    idx.refresh(session)
+    return idx
+
+
+def test_candidates_within_delta_e_sorted_by_remaining(index):
+    found = index.candidates("PLA Basic", "#FFFFFF")
+    assert [c["uid"] for c in found] == ["OFFWHITE", "WHITE"]
+    assert found[1]["delta_e"] == 0.0
+    assert 0 < found[0]["delta_e"] <= inventory_index.MATCH_MAX_DELTA_E
+
+
+def test_candidates_exclude_distant_and_colorless_spools(index):
+    # "Desert Tan" est à ΔE≈23 du blanc: hors seuil par défaut
+    uids = {c["uid"] for c in index.candidates("PLA", "#FFFFFF")}
+    assert "TAN" not in uids and "NOCOLOR" not in uids
+
+
+def test_candidates_without_color_keep_every_spool(index):
+    found = index.candidates("PLA Basic", None)
+    assert [c["uid"] for c in found] == ["NOCOLOR", "TAN", "OFFWHITE", "WHITE"]
+    assert all(c["delta_e"] is None for c in found)
+
+
+def test_candidates_threshold_and_unknown_material(index, monkeypatch):
+    monkeypatch.setattr(inventory_index, "MATCH_MAX_DELTA_E", 30)
+    assert "TAN" in {c["uid"] for c in index.candidates("Generic PLA", "#FFFFFF")}
+    assert index.candidates("PETG", "#FFFFFF") == []
@@ -0,0 +1,27 @@
+# backend/tests/test_leader.py
+import threading
+
+from leader import write_json_atomic, read_json
+
+
+def test_write_json_atomic_concurrent_threads(tmp_path):
+    """Plusieurs threads du même process écrivent le même fichier: chacun a son fichier temporaire."""
+    path = tmp_path / "status.json"
+    errors = []
+
+    def writer(n):
+        try:
+            for i in range(200):
+                write_json_atomic(path, {"writer": n, "i": i, "pad": "x" * 4096})
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert read_json(path)["i"] == 199
+    assert [p.name for p in tmp_path.iterdir()] == ["status.json"]
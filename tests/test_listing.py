@@ -0,0 +1,109 @@
+# backend/tests/test_listing.py
+# GET /api/filaments: cache des réponses par version d'inventaire, ETag / 304.
+import pytest
+
+import routes
+from helper import bulk_upsert_filaments
+from test_writes import _payload
+
+
+def _etag(resp):
+    return resp.headers["ETag"]
+
+
+def test_etag_follows_inventory_version(client, session):
+    bulk_upsert_filaments(session, [_payload("A")])
+    first = client.get("/api/filaments")
+    assert first.status_code == 200
+    assert _etag(first) == '"inv-1"'
+    assert client.get("/api/filaments", headers={"If-None-Match": '"inv-1"'}).status_code == 304
+
+    bulk_upsert_filaments(session, [_payload("B")])
+    resp = client.get("/api/filaments", headers={"If-None-Match": '"inv-1"'})
+    assert resp.status_code == 200
+    assert _etag(resp) == '"inv-2"'
+    assert sorted(f["uid"] for f in resp.json) == ["A", "B"]
+
+
+def test_weak_etag_from_proxy_matches(client, session):
+    bulk_upsert_filaments(session, [_payload("A")])
+    assert client.get("/api/filaments", headers={"If-None-Match": 'W/"inv-1"'}).status_code == 304
+
+
+def test_cache_of_an_older_version_is_not_shared():
+    routes._listing_cache.update(version=None, bodies={})
+    old = routes._listing_bodies(1)
+    new = routes._listing_bodies(2)
+    # Réponse construite pour la version 1, terminée après le passage à la version 2
+    old[b""] = b"[stale]"
+    assert routes._listing_bodies(2) is new
+    assert new == {}
+    # Une requête qui lit encore la version 1 ne remplit pas le cache de la version 2
+    routes._listing_bodies(1)[b""] = b"[stale]"
+    assert routes._listing_bodies(2) == {}
+
+
+# ---------- Pagination keyset / filtres ----------
+
+def _inventory(session):
+    types = ["PLA", "PETG", "ABS", None]
+    colors = ["#000000", "#FFFFFF", "#FF0000", None]
+    bulk_upsert_filaments(session, [
+        # Égalités sur toutes les clés de tri (même type / couleur / poids): départage par id
+        _payload(f"S{i:02d}", filament_type=types[i % 4], filament_detailed_type=None if i % 5 == 0 else "Basic",
+                 color_code=colors[i % 3 if i % 7 else 3], remain=(i % 4) * 10)
+        for i in range(30)
+    ])
+
+
+def _pages(client, query, limit):
+    items, cursor, pages = [], None, 0
+    while True:
+        url = f"/api/filaments?{query}&limit={limit}" + (f"&cursor={cursor}" if cursor else "")
+        resp = client.get(url)
+        assert resp.status_code == 200
+        items += resp.json["items"]
+        cursor = resp.json["next_cursor"]
+        pages += 1
+        if cursor is None:
+            return items, pages
+
+
+@pytest.mark.parametrize("limit", [1, 4, 7, 1000])
+@pytest.mark.parametrize("query", ["", "fields=id,uid", "filament_type=pla,petg&min_remaining=10"])
+def test_cursor_pages_equal_full_listing(client, session, query, limit):
+    _inventory(session)
+    full = client.get(f"/api/filaments?{query}").json
+    items, pages = _pages(client, query, limit)
+    assert items == full
+    assert pages == max(1, -(-len(full) // limit))
+
+
+def test_filters_and_projection(client, session):
+    _inventory(session)
+    rows = client.get("/api/filaments?fields=uid,remaining_weight&filament_type=PLA&max_remaining=100").json
+    assert rows and all(set(r) == {"uid", "remaining_weight"} for r in rows)
+    assert all(r["remaining_weight"] <= 100 for r in rows)
+    assert {r["uid"] for r in rows} <= {f"S{i:02d}" for i in range(0, 30, 4)}
+
+
+@pytest.mark.parametrize("query, error", [
+    ("limit=abc", "Invalid number for limit"),
+    ("cursor=not-base64!", "Invalid cursor"),
+    ("cursor=WzFd", "Invalid cursor"),               # [1]: mauvais nombre de clés
+    ("min_remaining=x", "Invalid number for min_remaining"),
+    ("fields=uid,nope", "Unknown field(s): nope"),
+])
+def test_bad_listing_parameters(client, session, query, error):
+    resp = client.get(f"/api/filaments?{query}")
+    assert resp.status_code == 400
+    assert resp.json == {"error": error}
+
+
+def test_not_modified_for_paginated_query(client, session):
+    _inventory(session)
+    resp = client.get("/api/filaments?limit=5")
+    resp = client.get(f"/api/filaments?limit=5&cursor={resp.json['next_cursor']}",
+                      headers={"If-None-Match": _etag(resp)})
+    assert resp.status_code == 304
+    assert resp.data == b""
@@ -0,0 +1,64 @@
+# backend/tests/test_sync.py
+# Synchro différentielle (/api/filaments/changes) et purge des tombstones avec le journal.
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func, update
+
+from helper import bulk_upsert_filaments
+from models import FilamentTombstone, FilamentChange, get_sync_horizon
+from test_writes import _payload
+
+
+def _age(session, before: datetime):
+    old = datetime.utcnow() - timedelta(days=30)
+    for model, column in ((FilamentTombstone, "deleted_at"), (FilamentChange, "created_at")):
+        t = model.__table__
+        session.execute(update(t).where(t.c[column] <= before).values({column: old}))
+    session.commit()
+
+
+def _tombstones(session):
+    return session.scalar(select(func.count()).select_from(FilamentTombstone))
+
+
+def test_changes_since_version(client, session):
+    bulk_upsert_filaments(session, [_payload("A"), _payload("B")])
+    ids = {f["uid"]: f["id"] for f in client.get("/api/filaments").json}
+    client.delete(f"/api/filaments/{ids['A']}")
+    bulk_upsert_filaments(session, [_payload("B", remain=40)])
+
+    resp = client.get("/api/filaments/changes?since=1&fields=uid,remaining_percent")
+    assert resp.status_code == 200
+    assert resp.json["version"] == 3
+    assert resp.json["changed"] == [{"uid": "B", "remaining_percent": 40}]
+    assert resp.json["deleted"] == [{"id": ids["A"], "uid": "A"}]
+
+
+def test_purge_drops_old_tombstones_and_requires_resync(app, client, session):
+    bulk_upsert_filaments(session, [_payload("A"), _payload("B"), _payload("C")])
+    ids = {f["uid"]: f["id"] for f in client.get("/api/filaments").json}
+    client.delete(f"/api/filaments/{ids['A']}")              # version 2
+    _age(session, datetime.utcnow())
+    client.delete(f"/api/filaments/{ids['B']}")              # version 3, récent: conservé
+
+    app.event_hub.purge()
+    assert _tombstones(session) == 1
+    assert get_sync_horizon(session) == 2
+    assert session.scalar(select(func.count()).select_from(FilamentChange)) == 1
+
+    resp = client.get("/api/filaments/changes?since=1")
+    assert resp.status_code == 410
+    assert (resp.json["horizon"], resp.json["version"]) == (2, 3)
+    resp = client.get("/api/filaments/changes?since=2")
+    assert resp.status_code == 200
+    assert resp.json["deleted"] == [{"id": ids["B"], "uid": "B"}]
+    assert [f["uid"] for f in client.get("/api/filaments/changes?since=0").json["changed"]] == ["C"]
+
+
+def test_purge_without_old_tombstones_keeps_horizon(app, client, session):
+    bulk_upsert_filaments(session, [_payload("A")])
+    client.delete(f"/api/filaments/{client.get('/api/filaments').json[0]['id']}")
+    app.event_hub.purge()
+    assert _tombstones(session) == 1
+    assert get_sync_horizon(session) == 0
+    assert client.get("/api/filaments/changes?since=1").status_code == 200
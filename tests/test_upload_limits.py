@@ -0,0 +1,136 @@
+# backend/tests/test_upload_limits.py
+# Corps de requête bornés (MAX_CONTENT_LENGTH / THREEMF_MAX_UPLOAD_MB) sous WSGI (app Flask) et sous
+# ASGI (asgi.py), avec et sans Content-Length (upload chunked).
+import asyncio
+import io
+import json
+
+import pytest
+
+from threemf_jobs import _MULTIPART_SLACK
+
+_BOUNDARY = "testboundary"
+_MAX_UPLOAD = 1000
+
+
+def _multipart(data: bytes, field: str = "file", filename: str = "x.3mf") -> bytes:
+    return (
+        f'--{_BOUNDARY}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + data + f"\r\n--{_BOUNDARY}--\r\n".encode()
+
+
+_TOO_LARGE = _multipart(b"PK\x03\x04" + b"\0" * (_MAX_UPLOAD + 2 * _MULTIPART_SLACK))
+_NOT_A_ZIP = _multipart(b"hello world")
+
+
+@pytest.fixture
+def limits(app, client, monkeypatch):
+    queue = app.threemf_queue
+    monkeypatch.setattr(queue, "max_upload_bytes", _MAX_UPLOAD)
+    monkeypatch.setitem(app.config, "MAX_CONTENT_LENGTH", _MAX_UPLOAD + _MULTIPART_SLACK)
+    yield queue
+    assert queue.stats()["inflight"] == 0
+    assert list(queue.spool_dir.glob("*.3mf")) == []
+
+
+# ---------- WSGI ----------
+
+def _wsgi_post(client, path, body, content_length: bool):
+    headers = {"Content-Type": f"multipart/form-data; boundary={_BOUNDARY}"}
+    if content_length:
+        return client.post(path, data=body, headers=headers)
+    # Transfer-Encoding: chunked, sans Content-Length
+    return client.post(path, input_stream=io.BytesIO(body), headers={**headers, "Transfer-Encoding": "chunked"},
+                       environ_overrides={"wsgi.input_terminated": True})
+
+
+@pytest.mark.parametrize("content_length", [True, False], ids=["content-length", "chunked"])
+@pytest.mark.parametrize("path", ["/api/3mf/analyze", "/api/3mf/jobs"])
+def test_wsgi_rejects_oversized_3mf(client, limits, path, content_length):
+    resp = _wsgi_post(client, path, _TOO_LARGE, content_length)
+    assert resp.status_code == 413
+    assert "error" in resp.json
+
+
+@pytest.mark.parametrize("content_length", [True, False], ids=["content-length", "chunked"])
+def test_wsgi_rejects_oversized_import(client, limits, content_length):
+    resp = _wsgi_post(client, "/api/filaments/import", _multipart(b"{}" * _MULTIPART_SLACK, "files", "a.json"),
+                      content_length)
+    assert resp.status_code == 413
+    assert resp.json == {"error": "Request body too large"}
+
+
+@pytest.mark.parametrize("content_length", [True, False], ids=["content-length", "chunked"])
+def test_wsgi_small_upload_reaches_view(client, limits, content_length):
+    resp = _wsgi_post(client, "/api/3mf/analyze", _NOT_A_ZIP, content_length)
+    assert resp.status_code == 400
+    assert "zip" in resp.json["error"]
+
+
+# ---------- ASGI ----------
+
+def _asgi_post(app, path, body, content_length: bool, chunk: int = 16 * 1024):
+    """Requête ASGI en mémoire: (status, corps JSON, octets lus par l'application)."""
+    import asgi
+
+    headers = [(b"content-type", f"multipart/form-data; boundary={_BOUNDARY}".encode())]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    scope = {"type": "http", "method": "POST", "path": path, "query_string": b"", "headers": headers,
+             "http_version": "1.1", "scheme": "http", "server": ("testserver", 80), "root_path": ""}
+    pieces = [body[i:i + chunk] for i in range(0, len(body), chunk)]
+    read = 0
+    sent = []
+
+    async def receive():
+        nonlocal read
+        if not pieces:
+            return {"type": "http.disconnect"}
+        piece = pieces.pop(0)
+        read += len(piece)
+        return {"type": "http.request", "body": piece, "more_body": bool(pieces)}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.AsgiApp(app)(scope, receive, send))
+    start = next(m for m in sent if m["type"] == "http.response.start")
+    payload = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+    return start["status"], json.loads(payload), read
+
+
+@pytest.mark.parametrize("path", ["/api/3mf/analyze", "/api/3mf/jobs"])
+def test_asgi_rejects_announced_oversized_3mf_before_reading(app, limits, path):
+    status, body, read = _asgi_post(app, path, _TOO_LARGE, content_length=True)
+    assert status == 413
+    assert "error" in body
+    assert read == 0
+
+
+@pytest.mark.parametrize("path", ["/api/3mf/analyze", "/api/filaments/import"])
+def test_asgi_stops_reading_chunked_body_at_limit(app, limits, path):
+    chunk = 16 * 1024
+    status, body, read = _asgi_post(app, path, _TOO_LARGE, content_length=False, chunk=chunk)
+    assert status == 413
+    assert body == {"error": "Request body too large"}
+    assert read <= app.config["MAX_CONTENT_LENGTH"] + chunk < len(_TOO_LARGE)
+
+
+def test_asgi_rejects_3mf_when_queue_full(app, limits):
+    for _ in range(limits.queue_size):
+        limits.acquire()
+    try:
+        status, body, read = _asgi_post(app, "/api/3mf/analyze", _NOT_A_ZIP, content_length=True)
+    finally:
+        for _ in range(limits.queue_size):
+            limits.release()
+    assert status == 429
+    assert read == 0
+
+
+@pytest.mark.parametrize("content_length", [True, False], ids=["content-length", "chunked"])
+def test_asgi_small_upload_reaches_view(app, limits, content_length):
+    status, body, _ = _asgi_post(app, "/api/3mf/analyze", _NOT_A_ZIP, content_length)
+    assert status == 400
+    assert "zip" in body["error"]
@@ -0,0 +1,171 @@
+# backend/tests/test_writes.py
+# Chemins d'écriture ensemblistes: INSERT ... ON CONFLICT (SQLite / PostgreSQL) et repli
+# SELECT + INSERT / UPDATE (dialecte sans ON CONFLICT, simulé avec dialect_insert -> None).
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select, func
+
+import consumption
+import helper
+from consumption import record_consumption, HOUR, DAY
+from helper import bulk_upsert_filaments, bulk_import_filaments
+from models import Filament, ConsumptionEvent, ConsumptionRollup, get_inventory_version
+
+
+@pytest.fixture(params=["on_conflict", "fallback"])
+def write_path(request, monkeypatch):
+    if request.param == "fallback":
+        monkeypatch.setattr(helper, "dialect_insert", lambda session: None)
+        monkeypatch.setattr(consumption, "dialect_insert", lambda session: None)
+    return request.param
+
+
+def _payload(uid, tray_uid=None, remain=50, **fields):
+    return {
+        "uid": uid, "tray_uid": tray_uid or f"T-{uid}", "filament_type": "PLA",
+        "filament_detailed_type": "PLA Basic", "color_code": "#000000", "spool_weight": 1000,
+        "remaining_percent": remain, "remaining_grams": remain * 10,
+        "last_sync_source": "ams", "last_sync_at": datetime.utcnow(), **fields,
+    }
+
+
+def _filaments(session):
+    return {f.uid: f for f in session.scalars(select(Filament)).all()}
+
+
+def _dump(uid, color="#FF0000"):
+    return {
+        "tag_uid": uid, "material_code": "GFA00", "type": "PLA", "subtype": "PLA Basic",
+        "color_hex": color, "diameter_mm": 1.75, "spool_weight_g": 1000, "length_m": 330,
+        "nozzle_diameter_mm": 0.4, "temp_hotend_min": 190, "temp_hotend_max": 230,
+        "temp_drying": 55, "drying_time_h": 8, "produced_at": "2024-03-01-10-30",
+    }
+
+
+# ---------- bulk_upsert_filaments ----------
+
+def test_upsert_inserts_then_updates(session, write_path):
+    stats = bulk_upsert_filaments(session, [_payload("A"), _payload("B", remain=20)])
+    assert (stats["inserted"], stats["updated"], stats["unchanged"]) == (2, 0, 0)
+    assert stats["version"] == get_inventory_version(session) == 1
+
+    stats = bulk_upsert_filaments(session, [_payload("A", remain=40, color_code=None)])
+    assert (stats["inserted"], stats["updated"]) == (0, 1)
+    assert stats["consumption_events"] == 1
+    rows = _filaments(session)
+    assert rows["A"].remaining_grams == 400
+    assert rows["A"].color_code == "#000000"   # champ nul du payload: valeur en base conservée
+    assert rows["A"].color_name == "Black"
+    assert rows["A"].updated_version == 2
+    assert rows["B"].updated_version == 1
+
+
+def test_upsert_identical_report_keeps_version(session, write_path):
+    bulk_upsert_filaments(session, [_payload("A")])
+    stats = bulk_upsert_filaments(session, [_payload("A")])
+    assert (stats["updated"], stats["unchanged"]) == (0, 1)
+    assert "version" not in stats
+    assert get_inventory_version(session) == 1
+    assert _filaments(session)["A"].updated_version == 1
+
+
+def test_upsert_new_tag_on_known_tray(session, write_path):
+    bulk_upsert_filaments(session, [_payload("A", tray_uid="T1")])
+    stats = bulk_upsert_filaments(session, [_payload("A2", tray_uid="T1", remain=90)])
+    assert (stats["inserted"], stats["updated"]) == (0, 1)
+    rows = _filaments(session)
+    assert list(rows) == ["A2"]
+    assert rows["A2"].remaining_percent == 90
+
+
+def test_upsert_new_tag_on_known_tray_is_not_consumption(session, write_path):
+    bulk_upsert_filaments(session, [_payload("A", tray_uid="T1", remain=10)])
+    stats = bulk_upsert_filaments(session, [_payload("A2", tray_uid="T1", remain=100)])
+    assert stats["consumption_events"] == 0
+    assert session.scalar(select(func.count()).select_from(ConsumptionEvent)) == 0
+    assert session.scalar(select(func.count()).select_from(ConsumptionRollup)) == 0
+
+
+def test_upsert_same_uid_twice_in_batch(session, write_path):
+    stats = bulk_upsert_filaments(session, [_payload("A", remain=50), _payload("A", remain=45)])
+    assert stats["inserted"] == 1
+    assert _filaments(session)["A"].remaining_percent == 45
+
+
+# ---------- bulk_import_filaments ----------
+
+def test_import_skips_duplicates_and_errors(session, write_path):
+    records = [
+        ("a.json", _dump("U1")),
+        ("b.json", _dump("U2", color="#FFFFFF")),
+        ("c.json", _dump("U1")),                 # doublon dans le fichier
+        ("d.json", {"tag_uid": "U3"}),           # dump incomplet
+        ("e.json", ValueError("JSON illisible")),
+    ]
+    res = bulk_import_filaments(session, iter(records), chunk_size=2)
+    assert res["imported"] == 2
+    assert res["skipped"] == 3
+    assert [e["file"] for e in res["errors"]] == ["d.json", "e.json"]
+    rows = _filaments(session)
+    assert set(rows) == {"U1", "U2"}
+    assert rows["U2"].color_name == "Jade White"
+    assert rows["U1"].manufacture_datetime_utc == datetime(2024, 3, 1, 10, 30)
+
+    res = bulk_import_filaments(session, iter([("f.json", _dump("U1")), ("g.json", _dump("U4"))]))
+    assert (res["imported"], res["skipped"]) == (1, 1)
+    assert set(_filaments(session)) == {"U1", "U2", "U4"}
+
+
+def test_import_one_version_per_chunk(session, write_path):
+    records = [(f"{i}.json", _dump(f"U{i}")) for i in range(5)]
+    bulk_import_filaments(session, iter(records), chunk_size=2)
+    assert get_inventory_version(session) == 3
+    assert sorted(f.updated_version for f in _filaments(session).values()) == [1, 1, 2, 2, 3]
+
+
+# ---------- record_consumption (agrégats horaires / journaliers) ----------
+
+def _change(before, after, at, filament_id=1):
+    return {"filament_id": filament_id, "material": "PLA Basic", "before": before, "after": after,
+            "at": at, "source": "ams"}
+
+
+def _rollups(session, seconds):
+    t = ConsumptionRollup.__table__
+    return session.execute(
+        select(t.c.bucket_start, t.c.consumed_grams, t.c.refilled_grams, t.c.samples, t.c.last_grams)
+        .where(t.c.bucket_seconds == seconds).order_by(t.c.bucket_start)
+    ).all()
+
+
+def test_rollups_accumulate_across_calls(session, write_path):
+    n = record_consumption(session, [
+        _change(1000, 900, datetime(2024, 3, 1, 10, 5)),
+        _change(900, 900, datetime(2024, 3, 1, 10, 6)),     # sans variation: ignoré
+        _change(900, 850, datetime(2024, 3, 1, 11, 0)),
+    ])
+    session.commit()
+    assert n == 2
+    # Même bucket horaire et journalier: ON CONFLICT DO UPDATE (ou UPDATE du repli) cumule
+    n = record_consumption(session, [
+        _change(850, 800, datetime(2024, 3, 1, 11, 30)),
+        _change(800, 1000, datetime(2024, 3, 1, 11, 45)),   # recharge
+    ])
+    session.commit()
+    assert n == 2
+
+    assert session.scalar(select(func.count()).select_from(ConsumptionEvent)) == 4
+    assert _rollups(session, HOUR) == [
+        (datetime(2024, 3, 1, 10), 100, 0, 1, 900),
+        (datetime(2024, 3, 1, 11), 100, 200, 3, 1000),
+    ]
+    assert _rollups(session, DAY) == [(datetime(2024, 3, 1), 200, 200, 4, 1000)]
+
+
+def test_rollups_from_upserts(session, write_path):
+    bulk_upsert_filaments(session, [_payload("A", remain=50)])
+    bulk_upsert_filaments(session, [_payload("A", remain=45)])
+    bulk_upsert_filaments(session, [_payload("A", remain=30)])
+    (_, consumed, refilled, samples, last), = _rollups(session, DAY)
+    assert (consumed, refilled, samples, last) == (200, 0, 2, 300)
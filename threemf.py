@@ -0,0 +1,219 @@
+# backend/threemf.py
+import json
+import os
+import sys
+import threading
+import uuid
+import zipfile
+from pathlib import Path
+from typing import Optional, Dict, Any, BinaryIO
+
+_META_DIR = "metadata/"
+_PROJECT_SETTINGS = "metadata/project_settings.config"
+
+
+# Plafond du cache disque des résultats d'analyse
+CACHE_MAX_BYTES = int(float(os.getenv("THREEMF_CACHE_MAX_MB", "50")) * 1024 * 1024)
+# À incrémenter si le format du résultat change: les anciennes entrées sont ignorées
+_RESULT_VERSION = 1
+
+
+class ThreeMFError(ValueError):
+    pass
+
+
+class ThreeMFLimitError(ThreeMFError):
+    """Analyse interrompue: durée ou mémoire maximale dépassée (archive piégée ou démesurée)."""
+
+
+class AnalysisCache:
+    """
+    Cache des résultats d'analyse adressé par contenu (sha256 du fichier uploadé),
+    persisté dans le dossier data: un fichier JSON par entrée, LRU via mtime et plafond en octets.
+    """
+
+    def __init__(self, directory: str, max_bytes: Optional[int] = None):
+        self.dir = Path(directory)
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, digest: str) -> Path:
+        return self.dir / f"{digest}.v{_RESULT_VERSION}.json"
+
+    def get(self, digest: str) -> Optional[Dict[str, Any]]:
+        path = self._path(digest)
+        try:
+            result = json.loads(path.read_text(encoding="utf-8"))
+            os.utime(path)  # marque l'entrée comme récemment utilisée
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, digest: str, result: Dict[str, Any]) -> None:
+        if self.max_bytes <= 0:
+            return
+        self.dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(digest)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            tmp.write_text(json.dumps(result), encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[3MF] Cache write failed: {e}")
+            return
+        self._evict()
+
+    def _entries(self) -> list:
+        entries = []
+        for p in self.dir.glob("*.json"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        return entries
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                p.unlink()
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._entries() if self.dir.exists() else []
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes,
+            }
+
+
+def analyze_3mf_stream(fileobj: BinaryIO) -> Dict[str, Any]:
+    """
+    Analyse un .3mf (Bambu Studio) directement depuis un flux seekable, sans extraction:
+    seuls les membres metadata/* utiles sont lus, les maillages ne sont jamais décompressés.
+    """
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise ThreeMFError("Fichier 3MF invalide (archive zip illisible)")
+
+    with archive:
+        # Noms insensibles à la casse (Metadata/ chez Bambu Studio)
+        members = [info for info in archive.infolist() if not info.is_dir()]
+        by_name = {info.filename.lower(): info for info in members}
+
+        # 1) Couleurs et matériaux depuis project_settings.config
+        cfg = by_name.get(_PROJECT_SETTINGS)
+        if cfg is None:
+            raise ThreeMFError("metadata/project_settings.config introuvable")
+        try:
+            with archive.open(cfg) as f:
+                settings = json.load(f)
+        except ValueError:
+            raise ThreeMFError("project_settings.config invalide (JSON attendu)")
+        colors = settings.get('filament_colour', [])
+        mats_raw = settings.get('filament_settings_id', [])
+        materials = [m.split('@')[0].replace('Bambu ', '').strip() for m in mats_raw]
+
+        # 2) Comptage des pièces via le premier fichier XML/HTML de metadata/ contenant <objects>
+        pieces_count = 0
+        for info in members:
+            name = info.filename.lower()
+            if not name.startswith(_META_DIR) or "/" in name[len(_META_DIR):]:
+                continue
+            if not name.endswith(('.xml', '.html')):
+                continue
+            with archive.open(info) as f:
+                count = _count_objects(f)
+            if count is not None:
+                pieces_count = count
+                break
+
+    return {
+        'colors': colors,
+        'materials': materials,
+        'pieces_count': pieces_count,
+    }
+
+
+def analyze_file_limited(path: str, memory_bytes: int = 0) -> tuple:
+    """
+    Analyse de path avec l'espace d'adressage du process plafonné (process d'analyse dédié, voir
+    threemf_jobs.py): (statut, résultat ou message), statut parmi ok / invalid / limit / error.
+    """
+    if memory_bytes:
+        try:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+        except (ImportError, ValueError, OSError) as e:
+            print(f"[3MF] Limite mémoire non appliquée: {e}", file=sys.stderr)
+    try:
+        with open(path, "rb") as f:
+            return "ok", analyze_3mf_stream(f)
+    except ThreeMFError as e:
+        return "invalid", str(e)
+    except MemoryError:
+        return "limit", f"Analyse interrompue: plus de {memory_bytes // (1024 * 1024)} Mo de mémoire"
+    except Exception as e:
+        return "error", f"{type(e).__name__}: {e}"
+
+
+def _count_objects(f: BinaryIO) -> Optional[int]:
+    """
+    Compte les éléments <object> (descendants de la racine) en streaming.
+    Retourne None si le document ne contient pas de <objects>.
+    Les éléments sont vidés au fil de l'eau: mémoire constante quelle que soit la taille.
+    """
+    import xml.etree.ElementTree as ET  # importé à la première analyse, pas au démarrage
+
+    has_objects = False
+    count = 0
+    root = None
+    depth = 0
+    try:
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                if elem.tag == "objects":
+                    has_objects = True
+                depth += 1
+                continue
+            depth -= 1
+            if elem.tag == "object" and elem is not root:
+                count += 1
+            elem.clear()
+            if depth == 1:
+                root.clear()
+    except ET.ParseError:
+        if has_objects:
+            raise ThreeMFError("XML des objets invalide")
+        return None
+    return count if has_objects else None
+
+
+if __name__ == "__main__":
+    # Process d'analyse: python threemf.py <fichier> <mémoire max en octets> → [statut, résultat] sur stdout
+    sys.stdout.write(json.dumps(analyze_file_limited(sys.argv[1], int(sys.argv[2]))))
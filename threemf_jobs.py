@@ -0,0 +1,222 @@
+# backend/threemf_jobs.py
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Dict, Any, BinaryIO
+
+from jobs import JobStore, JOB_TTL
+import threemf
+from threemf import AnalysisCache, ThreeMFError, ThreeMFLimitError
+from metrics import THREEMF_DURATION, THREEMF_BYTES, THREEMF_REJECTED
+
+# Taille max d'un upload 3MF
+MAX_UPLOAD_BYTES = int(float(os.getenv("THREEMF_MAX_UPLOAD_MB", "256")) * 1024 * 1024)
+# Analyses simultanées par worker (un process chacune)
+WORKERS = int(os.getenv("THREEMF_WORKERS", "2"))
+# Analyses en cours + en attente par worker: au-delà, 429
+QUEUE_SIZE = int(os.getenv("THREEMF_QUEUE_SIZE", "8"))
+# Durée (s) et mémoire (Mo, espace d'adressage) max d'une analyse: au-delà le process est tué
+JOB_TIMEOUT = float(os.getenv("THREEMF_JOB_TIMEOUT", "60"))
+JOB_MEMORY_MB = int(os.getenv("THREEMF_JOB_MEMORY_MB", "1024"))
+# Attente max (s) du résultat par POST /api/3mf/analyze avant de répondre 202 avec le job
+SYNC_WAIT = float(os.getenv("THREEMF_SYNC_WAIT", "120"))
+
+JOB_KIND = "3mf_analysis"
+RETRY_AFTER = 5
+
+_ZIP_MAGIC = b"PK\x03\x04"
+_CHUNK = 1024 * 1024
+# En-têtes multipart autour du fichier, tolérés au-delà de MAX_UPLOAD_BYTES dans Content-Length
+_MULTIPART_SLACK = 64 * 1024
+# Corps de requête max (MAX_CONTENT_LENGTH de l'app): borne aussi les uploads sans Content-Length (chunked)
+MAX_REQUEST_BYTES = MAX_UPLOAD_BYTES + _MULTIPART_SLACK
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class UploadTooLargeError(ThreeMFError):
+    pass
+
+
+def analyze_in_process(path: str, timeout: float, memory_bytes: int) -> Dict[str, Any]:
+    """
+    Analyse dans un process neuf (python threemf.py), tué s'il dépasse timeout. Pas de fork du
+    worker (threads, connexions) ni de multiprocessing (réimport du module principal: gunicorn, app.py).
+    ThreeMFError si le fichier est refusé, ThreeMFLimitError si une limite est dépassée.
+    """
+    proc = subprocess.Popen([sys.executable, threemf.__file__, path, str(memory_bytes)],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+    try:
+        out, _ = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        raise ThreeMFLimitError(f"Analyse interrompue: plus de {timeout:g} s")
+    try:
+        status, payload = json.loads(out)
+    except ValueError:
+        # Process mort sans réponse: tué par le noyau (mémoire) ou crash de l'interpréteur
+        raise ThreeMFLimitError(f"Analyse interrompue: process d'analyse terminé sans résultat "
+                                f"(code {proc.returncode})")
+    if status == "ok":
+        return payload
+    if status == "limit":
+        raise ThreeMFLimitError(payload)
+    if status == "invalid":
+        raise ThreeMFError(payload)
+    raise ThreeMFError(f"Fichier 3MF invalide ({payload})")
+
+
+class ThreeMFQueue:
+    """
+    File d'analyse 3MF d'un worker. L'upload est validé et copié dans spool_dir (sha256 au passage),
+    puis analysé dans un process dédié (analyze_in_process): au plus `workers` à la fois, tués
+    au-delà de `timeout`, espace d'adressage plafonné. L'état est suivi par JobStore (data/jobs/,
+    lisible par tous les workers). Au-delà de queue_size analyses en cours ou en attente, acquire() refuse (HTTP 429).
+    """
+
+    def __init__(self, jobs: JobStore, cache: AnalysisCache, spool_dir: str,
+                 workers: Optional[int] = None, queue_size: Optional[int] = None,
+                 timeout: Optional[float] = None, memory_mb: Optional[int] = None,
+                 max_upload_bytes: Optional[int] = None):
+        self.jobs = jobs
+        self.cache = cache
+        self.spool_dir = Path(spool_dir)
+        self.workers = workers or WORKERS
+        self.queue_size = queue_size or QUEUE_SIZE
+        self.timeout = timeout or JOB_TIMEOUT
+        self.memory_bytes = (JOB_MEMORY_MB if memory_mb is None else memory_mb) * 1024 * 1024
+        self.max_upload_bytes = max_upload_bytes or MAX_UPLOAD_BYTES
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="3mf")
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self.rejected = 0
+        self._purge_spool()
+
+    # ---------- Admission ----------
+    def check_size(self, content_length: Optional[int]) -> None:
+        """Refus sur la taille annoncée (Content-Length), avant toute lecture du corps."""
+        if content_length and content_length > self.max_upload_bytes + _MULTIPART_SLACK:
+            self.too_large()
+
+    def too_large(self) -> None:
+        """Lève UploadTooLargeError (comptée dans les métriques)."""
+        THREEMF_REJECTED.labels("too_large").inc()
+        raise UploadTooLargeError(f"Fichier trop volumineux (max {self.max_upload_bytes // (1024 * 1024)} Mo)")
+
+    def acquire(self) -> None:
+        """Réserve une place dans la file; à appeler avant de lire l'upload, submit() la libère."""
+        with self._lock:
+            self._check_capacity()
+            self._inflight += 1
+
+    def check_capacity(self) -> None:
+        """Refus sans réservation (mode ASGI: avant de recevoir le corps, la vue appelle ensuite acquire())."""
+        with self._lock:
+            self._check_capacity()
+
+    def _check_capacity(self) -> None:
+        if self._inflight >= self.queue_size:
+            self.rejected += 1
+            THREEMF_REJECTED.labels("queue_full").inc()
+            raise QueueFullError(f"File d'analyse pleine ({self.queue_size} analyses en cours)")
+
+    def release(self) -> None:
+        with self._lock:
+            self._inflight -= 1
+
+    # ---------- Soumission ----------
+    def _spool(self, stream: BinaryIO, path: Path) -> tuple:
+        h = hashlib.sha256()
+        size = 0
+        with open(path, "wb") as out:
+            while True:
+                chunk = stream.read(_CHUNK)
+                if not chunk:
+                    break
+                if size == 0 and chunk[:4] != _ZIP_MAGIC:
+                    raise ThreeMFError("Fichier 3MF invalide (archive zip illisible)")
+                size += len(chunk)
+                if size > self.max_upload_bytes:
+                    self.too_large()
+                h.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise ThreeMFError("Fichier 3MF invalide (fichier vide)")
+        return h.hexdigest(), size
+
+    def submit(self, stream: BinaryIO, filename: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Après acquire(): copie l'upload et crée le job, déjà terminé si l'analyse est en cache.
+        Lève ThreeMFError (fichier refusé) ou UploadTooLargeError; la place est alors libérée.
+        """
+        start = time.perf_counter()
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spool_dir / f"{uuid.uuid4().hex}.3mf"
+        try:
+            digest, size = self._spool(stream, path)
+            THREEMF_BYTES.observe(size)
+            meta = {"digest": digest, "size": size, "filename": filename}
+            result = self.cache.get(digest)
+            if result is None:
+                return self.jobs.submit(self.executor, JOB_KIND, self._analyze, path, digest, start,
+                                        cache="miss", **meta)
+        except BaseException:
+            path.unlink(missing_ok=True)
+            self.release()
+            raise
+        path.unlink(missing_ok=True)
+        self.release()
+        now = time.time()
+        THREEMF_DURATION.labels("hit").observe(time.perf_counter() - start)
+        return self.jobs.create(JOB_KIND, status="done", started_at=now, finished_at=now,
+                                result=result, cache="hit", **meta)
+
+    def _analyze(self, path: Path, digest: str, start: float) -> Dict[str, Any]:
+        try:
+            result = analyze_in_process(str(path), self.timeout, self.memory_bytes)
+        except ThreeMFError:
+            THREEMF_DURATION.labels("error").observe(time.perf_counter() - start)
+            raise
+        finally:
+            path.unlink(missing_ok=True)
+            self.release()
+        self.cache.put(digest, result)
+        THREEMF_DURATION.labels("miss").observe(time.perf_counter() - start)
+        return result
+
+    def _purge_spool(self) -> None:
+        # Fichiers laissés par un worker arrêté en cours d'analyse
+        cutoff = time.time() - JOB_TTL
+        try:
+            entries = list(os.scandir(self.spool_dir))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.name.endswith(".3mf") and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            inflight = self._inflight
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "inflight": inflight,
+            "rejected": self.rejected,
+            "timeout_s": self.timeout,
+            "memory_mb": self.memory_bytes // (1024 * 1024),
+            "max_upload_mb": self.max_upload_bytes // (1024 * 1024),
+        }